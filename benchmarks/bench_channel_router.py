@@ -0,0 +1,91 @@
+"""Micro-benchmark of ChannelRouter.
+
+Measures the cost per path to resolve the channel, compared with
+splitting the path by the target folder used before.
+
+Usage:
+    python benchmarks/bench_channel_router.py [--paths N] [--repeat R]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "src", "dropbox2slack")
+)
+
+from util.router import ChannelRouter  # noqa: E402
+
+TARGET_DIR = "/target"
+
+
+def run_legacy(paths):
+    return [
+        filepath.replace(TARGET_DIR + "/", "").split("/")[0]
+        for filepath in paths
+    ]
+
+
+def generate_rules(n):
+    rules = {"folder{}".format(i): "channel{}".format(i) for i in range(n)}
+    rules.update(
+        {
+            "folder{}/sub{}".format(i, i): "sub-channel{}".format(i)
+            for i in range(n)
+        }
+    )
+    rules["clients/*/reports"] = "client-reports"
+    return rules
+
+
+def generate_paths(n):
+    paths = []
+    for i in range(n):
+        if i % 3 == 0:
+            paths.append("/target/folder{}/file{}.xlsx".format(i % 100, i))
+        elif i % 3 == 1:
+            paths.append(
+                "/target/folder{0}/sub{0}/deep/file{1}.xlsx".format(i % 100, i)
+            )
+        else:
+            paths.append(
+                "/target/clients/client{}/reports/file{}.pdf".format(i, i)
+            )
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paths", type=int, default=100000)
+    parser.add_argument("--rules", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    paths = generate_paths(args.paths)
+    router = ChannelRouter(TARGET_DIR, generate_rules(args.rules))
+
+    def run_router(paths):
+        return [router.resolve(filepath) for filepath in paths]
+
+    build = min(
+        timeit.repeat(
+            lambda: ChannelRouter(TARGET_DIR, generate_rules(args.rules)),
+            number=1,
+            repeat=args.repeat,
+        )
+    )
+    print("build    {:8.3f} ms".format(build * 1000))
+    for name, func in (("legacy", run_legacy), ("router", run_router)):
+        best = min(
+            timeit.repeat(lambda: func(paths), number=1, repeat=args.repeat)
+        )
+        print(
+            "{:8s} {:8.3f} ms total {:8.3f} us/path".format(
+                name, best * 1000, best / args.paths * 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
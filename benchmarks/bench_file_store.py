@@ -0,0 +1,94 @@
+"""Micro-benchmark of ChangedFileStore.
+
+Measures the cost per entry to add files, validate shared links and
+render Slack links, compared with the pydantic model per file used before.
+
+Usage:
+    python benchmarks/bench_file_store.py [--entries N] [--repeat R]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+from collections import defaultdict
+
+from pydantic import BaseModel, field_validator
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "src", "dropbox2slack")
+)
+
+import api.slackapi as slackapi  # noqa: E402
+
+re_url = re.compile(slackapi.url_regex)
+
+
+class _LegacyFileInfo(BaseModel):
+    filepath: str
+    shared_link: str
+
+    @field_validator("shared_link")
+    def is_shared_link_url(cls, v):
+        if not re_url.match(v):
+            raise ValueError
+        return v
+
+    def generate_filepath_with_link(self):
+        return "<{}|{}>".format(self.shared_link, self.filepath)
+
+
+def run_legacy(files):
+    files_by_channel = defaultdict(list)
+    for channel, filepath, shared_link in files:
+        files_by_channel[channel].append(
+            _LegacyFileInfo(filepath=filepath, shared_link=shared_link)
+        )
+    links_by_channel = defaultdict(list)
+    for channel, file_info_list in files_by_channel.items():
+        for file_info in file_info_list:
+            links_by_channel[channel].append(
+                file_info.generate_filepath_with_link()
+            )
+    return links_by_channel
+
+
+def run_current(files):
+    store = slackapi.ChangedFileStore()
+    for channel, filepath, shared_link in files:
+        store.add(channel, filepath, shared_link)
+    store.validate()
+    return slackapi.generage_messages_store(store)
+
+
+def generate_files(n):
+    return [
+        (
+            "channel{}".format(i % 10),
+            "/target/channel{}/file{}.xlsx".format(i % 10, i),
+            "https://www.dropbox.com/scl/fi/{:08x}/file{}.xlsx".format(i, i),
+        )
+        for i in range(n)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    files = generate_files(args.entries)
+    for name, func in (("legacy", run_legacy), ("current", run_current)):
+        best = min(
+            timeit.repeat(lambda: func(files), number=1, repeat=args.repeat)
+        )
+        print(
+            "{:8s} {:8.3f} ms total {:8.3f} us/entry".format(
+                name, best * 1000, best / args.entries * 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Cold start import time benchmark of the Lambda handler.
+
+Runs ``python -X importtime`` in a fresh interpreter, the same way as a
+Lambda cold start imports the handler module, and reports the cumulative
+import time and the heaviest modules.
+
+Usage:
+    python benchmarks/importtime.py [--module lambda_function] [--top 15]
+        [--repeat 5] [--max-ms 200]
+
+Exits with 1 if the median import time exceeds --max-ms.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), "..", "src", "dropbox2slack")
+
+re_line = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+
+
+def measure(module):
+    """Import the module in a new interpreter.
+
+    Returns:
+        list: (cumulative us, self us, depth, module name) list
+    """
+    env = dict(os.environ)
+    env.setdefault("TABLE_NAME", "dummy-table")
+    env.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=SRC_DIR,
+        env=env,
+        stderr=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    records = []
+    for line in result.stderr.splitlines():
+        m = re_line.match(line)
+        if m:
+            self_us, cumulative_us, indent, name = m.groups()
+            depth = (len(indent) - 1) // 2
+            records.append((int(cumulative_us), int(self_us), depth, name))
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="lambda_function")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    totals = []
+    records = []
+    for _ in range(args.repeat):
+        records = measure(args.module)
+        total = [r for r in records if r[3] == args.module]
+        totals.append(total[-1][0] / 1000)
+
+    median = statistics.median(totals)
+    print(
+        "{}: median {:.1f} ms (min {:.1f} ms, max {:.1f} ms)".format(
+            args.module, median, min(totals), max(totals)
+        )
+    )
+    print("heaviest direct imports of the last run:")
+    direct = [r for r in records if r[2] == 1]
+    for cumulative_us, _, _, name in sorted(direct, reverse=True)[: args.top]:
+        print("  {:10.1f} ms  {}".format(cumulative_us / 1000, name))
+
+    if args.max_ms is not None and median > args.max_ms:
+        print("import time exceeds {} ms".format(args.max_ms))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""End-to-end replay benchmark of the webhook handler.
+
+Replays synthetic change sets through ``lambda_function.lambda_handler``
+against stand-in servers, and reports the invocation wall time, API call
+counts and peak memory of each change set.
+
+- Dropbox API and Slack webhook are served by transport adapters mounted
+  on the shared session of ``api.httpclient``, with configurable latency,
+  page size and injected 429 responses.
+- DynamoDB is served by moto.
+
+Usage:
+    python benchmarks/replay.py [--entries 10 1000 10000] [--channels 10]
+        [--page-size 500] [--latency-ms 20] [--rate-429 0.0]
+        [--real-limits]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, namedtuple
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "src", "dropbox2slack")
+)
+
+TARGET_DIR = "/target"
+DROPBOX_URL = "https://api.dropboxapi.com"
+SLACK_URL = "https://hooks.slack.com"
+WEBHOOK_URL = SLACK_URL + "/services/replay"
+
+# the handler is configured before it is imported
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("TABLE_NAME", "replay-table")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["DROPBOX_TOKEN"] = "replay-token"
+os.environ["DROPBOX_TARGET_DIR"] = TARGET_DIR
+os.environ["SLACK_WEBHOOK_URL"] = WEBHOOK_URL
+
+
+class FakeAdapter(BaseAdapter):
+    def __init__(self, handler, latency=0.0, rate_429=0.0, seed=0):
+        """Transport adapter serving requests by a handler.
+
+        Args:
+            handler (callable): (path, body) -> (status code, body)
+            latency (float): seconds to wait per request
+            rate_429 (float): ratio of requests answered with 429
+            seed (int): seed of the injected errors
+        """
+        super().__init__()
+        self.handler = handler
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[request.path_url] += 1
+            throttled = self._random.random() < self.rate_429
+        if throttled:
+            with self._lock:
+                self.calls["429"] += 1
+            return _build_response(
+                request,
+                429,
+                {"error": "too_many_requests"},
+                {"Retry-After": "0"},
+            )
+        body = json.loads(request.body) if request.body else None
+        status_code, res_body = self.handler(request.path_url, body)
+        return _build_response(request, status_code, res_body)
+
+    def close(self):
+        pass
+
+
+def _build_response(request, status_code, body, headers=None):
+    response = Response()
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers or {})
+    if isinstance(body, str):
+        response._content = body.encode()
+    else:
+        response.headers["Content-Type"] = "application/json"
+        response._content = json.dumps(body).encode()
+    response.encoding = "utf-8"
+    response.url = request.url
+    response.request = request
+    return response
+
+
+class FakeDropbox:
+    def __init__(self, entries, page_size):
+        self.entries = entries
+        self.page_size = page_size
+
+    def __call__(self, path, body):
+        if path == "/2/files/list_folder/get_latest_cursor":
+            return 200, {"cursor": "page:0"}
+        if path == "/2/files/list_folder/continue":
+            page = int(body["cursor"].split(":")[1])
+            start = page * self.page_size
+            end = start + self.page_size
+            return 200, {
+                "cursor": "page:{}".format(page + 1),
+                "entries": self.entries[start:end],
+                "has_more": end < len(self.entries),
+            }
+        if path == "/2/sharing/list_shared_links":
+            return 200, {"links": [], "has_more": False}
+        if path == "/2/sharing/create_shared_link_with_settings":
+            digest = hashlib.sha1(body["path"].encode()).hexdigest()[:16]
+            name = body["path"].split("/")[-1]
+            return 200, {
+                "url": "https://www.dropbox.com/scl/fi/{}/{}?dl=0".format(
+                    digest, name
+                ),
+                "path_lower": body["path"].lower(),
+            }
+        if path == "/2/sharing/modify_shared_link_settings":
+            return 200, {"url": body["url"]}
+        return 404, {"error": "not_found"}
+
+
+def fake_slack(path, body):
+    return 200, "ok"
+
+
+def generate_entries(n, channels):
+    return [
+        {
+            ".tag": "file",
+            "id": "id:{}".format(i),
+            "path_display": "{}/channel{}/file{}.xlsx".format(
+                TARGET_DIR, i % channels, i
+            ),
+        }
+        for i in range(n)
+    ]
+
+
+Result = namedtuple(
+    "Result", ["entries", "wall", "peak_memory", "dropbox_calls", "calls"]
+)
+
+
+def replay(entries, args, trace_memory=False):
+    import api.httpclient as httpclient
+    import boto3
+    import lambda_function
+    import util.models as models
+    from moto import mock_dynamodb
+
+    dropbox = FakeAdapter(
+        FakeDropbox(entries, args.page_size),
+        latency=args.latency_ms / 1000,
+        rate_429=args.rate_429,
+    )
+    slack = FakeAdapter(fake_slack, latency=args.latency_ms / 1000)
+
+    with mock_dynamodb():
+        boto3.client("dynamodb").create_table(
+            TableName=os.environ["TABLE_NAME"],
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "id", "AttributeType": "S"}
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        models.clear_cursor_cache()
+        models.clear_routes_cache()
+        httpclient.close_session()
+        session = httpclient.get_session()
+        session.mount(DROPBOX_URL, dropbox)
+        session.mount(SLACK_URL, slack)
+
+        event = {"path": "/", "httpMethod": "POST"}
+        context = namedtuple(
+            "LambdaContext",
+            [
+                "function_name",
+                "memory_limit_in_mb",
+                "invoked_function_arn",
+                "aws_request_id",
+            ],
+        )(
+            "dropbox2slack",
+            128,
+            "arn:aws:lambda:ap-northeast-1:123456789012:function:replay",
+            str(uuid.uuid4()),
+        )
+
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(event, context)
+        wall = time.perf_counter() - start
+        peak_memory = None
+        if trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        httpclient.close_session()
+
+    assert response["statusCode"] == 200, response
+    calls = Counter(dropbox.calls)
+    calls["slack"] = sum(slack.calls.values())
+    return Result(
+        len(entries),
+        wall,
+        peak_memory,
+        sum(n for k, n in dropbox.calls.items() if k != "429"),
+        calls,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--entries", type=int, nargs="+", default=[10, 1000, 10000]
+    )
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument(
+        "--real-limits",
+        action="store_true",
+        help="keep the client side rate limits of Dropbox and Slack",
+    )
+    args = parser.parse_args()
+
+    if not args.real_limits:
+        # measure the handler, not the configured limits
+        for name in (
+            "DROPBOX_RATE_LIMIT_FILES",
+            "DROPBOX_RATE_LIMIT_SHARING",
+            "SLACK_RATE_LIMIT",
+            "SLACK_RATE_BURST",
+        ):
+            os.environ[name] = "100000"
+
+    print(
+        "{:>8s} {:>10s} {:>12s} {:>10s}  {}".format(
+            "entries", "wall ms", "peak MiB", "dropbox", "calls"
+        )
+    )
+    for n in args.entries:
+        entries = generate_entries(n, args.channels)
+        result = replay(entries, args)
+        # tracemalloc slows down allocations, so memory is measured apart.
+        peak_memory = replay(entries, args, trace_memory=True).peak_memory
+        print(
+            "{:8d} {:10.1f} {:12.2f} {:10d}  {}".format(
+                result.entries,
+                result.wall * 1000,
+                peak_memory / 2**20,
+                result.dropbox_calls,
+                dict(sorted(result.calls.items())),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ import * as dynamodb from 'aws-cdk-lib/aws-dynamodb'
 import * as iam from 'aws-cdk-lib/aws-iam'
 import * as lambda from 'aws-cdk-lib/aws-lambda'
 import * as apigateway from 'aws-cdk-lib/aws-apigateway'
+import * as sqs from 'aws-cdk-lib/aws-sqs'
+import { SqsEventSource } from 'aws-cdk-lib/aws-lambda-event-sources'
 import * as python from '@aws-cdk/aws-lambda-python-alpha'
 import { RemovalPolicy } from 'aws-cdk-lib';
 
@@ -17,6 +19,9 @@ export class CdkStack extends cdk.Stack {
     const tableName = `${appName}-table`
     const roleName = `${appName}-role`
     const lambdaFunctionName = `${appName}`
+    const workerFunctionName = `${appName}-worker`
+    const jobQueueName = `${appName}-jobs`
+    const jobDeadLetterQueueName = `${appName}-jobs-dlq`
     const lambdaLayerName = `${appName}-layer`
     const restApiName = `${appName}-api`
 
@@ -26,6 +31,7 @@ export class CdkStack extends cdk.Stack {
         name: "id",
         type: dynamodb.AttributeType.STRING,
       },
+      timeToLiveAttribute: "ttl",
       removalPolicy: RemovalPolicy.DESTROY,
       billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
     })
@@ -45,22 +51,57 @@ export class CdkStack extends cdk.Stack {
       compatibleRuntimes: [lambda.Runtime.PYTHON_3_9],
     })
 
+    // continuations, digest flushes and the async webhook mode are
+    // processed by the worker through this queue.
+    const workerTimeout = cdk.Duration.minutes(5)
+    // jobs failing repeatedly are kept here instead of being retried forever.
+    const jobDeadLetterQueue = new sqs.Queue(this, jobDeadLetterQueueName, {
+      queueName: jobDeadLetterQueueName,
+      retentionPeriod: cdk.Duration.days(14),
+    })
+    const jobQueue = new sqs.Queue(this, jobQueueName, {
+      queueName: jobQueueName,
+      // a job is not received again while the worker may still run it,
+      // 6 times the timeout as recommended for Lambda event sources.
+      visibilityTimeout: cdk.Duration.seconds(workerTimeout.toSeconds() * 6),
+      deadLetterQueue: {
+        queue: jobDeadLetterQueue,
+        maxReceiveCount: 3,
+      },
+    })
+
+    const environment = {
+      "TABLE_NAME": tableName,
+      "DROPBOX_TOKEN": "PUT_YOUR_TOKEN",
+      "DROPBOX_TARGET_DIR": "/path/to/dir",
+      "SLACK_WEBHOOK_URL": "https://hooks.slack.com/services/xxxxxxxx",
+      "JOB_QUEUE_URL": jobQueue.queueUrl,
+    }
+
     const lambdaFunction = new lambda.Function(this, lambdaFunctionName, {
       functionName: lambdaFunctionName,
       code: new lambda.AssetCode("../src/dropbox2slack"),
       handler: "lambda_function.lambda_handler",
       runtime: lambda.Runtime.PYTHON_3_9,
-      environment: {
-        "TABLE_NAME": tableName,
-        "DROPBOX_TOKEN": "PUT_YOUR_TOKEN",
-        "DROPBOX_TARGET_DIR": "/path/to/dir",
-        "SLACK_WEBHOOK_URL": "https://hooks.slack.com/services/xxxxxxxx"
-      },
+      environment: environment,
       layers: [lambdaLayer],
       role: iamRole,
       timeout: cdk.Duration.seconds(30)
     })
 
+    const workerFunction = new lambda.Function(this, workerFunctionName, {
+      functionName: workerFunctionName,
+      code: new lambda.AssetCode("../src/dropbox2slack"),
+      handler: "lambda_function.worker_handler",
+      runtime: lambda.Runtime.PYTHON_3_9,
+      environment: environment,
+      layers: [lambdaLayer],
+      role: iamRole,
+      timeout: workerTimeout
+    })
+    workerFunction.addEventSource(new SqsEventSource(jobQueue))
+    jobQueue.grantSendMessages(iamRole)
+
     const restApi = new apigateway.RestApi(this, restApiName, {
       restApiName: restApiName,
       deployOptions: {
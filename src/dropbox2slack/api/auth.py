@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from http import HTTPStatus
+from typing import Callable, Dict, NamedTuple, Optional
+
+import api.httpclient as httpclient
+from aws_lambda_powertools import Logger
+from util.metrics import recorder
+
+logger = Logger()
+
+TOKEN_URL = "https://api.dropboxapi.com/oauth2/token"
+# short-lived tokens live 4 hours, they are refreshed a while before that.
+DEFAULT_REFRESH_MARGIN_SECONDS = 300
+TOKEN_CACHE_DYNAMODB = "dynamodb"
+
+
+class TokenRefreshError(Exception):
+    pass
+
+
+class AccessToken(NamedTuple):
+    token: str
+    # epoch seconds
+    expires_at: float
+
+
+class DynamoDBTokenStore:
+    """Share the access token with the other containers."""
+
+    # pynamodb is loaded only if the token is shared.
+    def load(self) -> Optional[AccessToken]:
+        import util.models as models
+
+        item = models.get_access_token()
+        return AccessToken(*item) if item else None
+
+    def save(self, token: AccessToken) -> None:
+        import util.models as models
+
+        models.save_access_token(token.token, token.expires_at)
+
+
+class TokenManager:
+    def __init__(
+        self,
+        refresh_token: str,
+        app_key: str,
+        app_secret: Optional[str] = None,
+        store=None,
+        margin_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """Short-lived access token made from the refresh token.
+
+        The token is kept in the container and refreshed when it is
+        about to expire, so API calls do not wait for the token endpoint.
+
+        Args:
+            refresh_token (str): refresh token of the app
+            app_key (str): app key
+            app_secret (Optional[str], optional): app secret, not needed
+                for the refresh token issued with PKCE. Defaults to None.
+            store (optional): DynamoDBTokenStore or an object with
+                load() and save(token) to share the token between
+                containers. Defaults to None.
+            margin_seconds (Optional[float], optional): seconds before
+                the expiry to refresh at.
+                Defaults to DROPBOX_TOKEN_REFRESH_MARGIN_SECONDS.
+            clock (Callable[[], float], optional): clock in epoch seconds.
+                Defaults to time.time.
+        """
+        self.refresh_token = refresh_token
+        self.app_key = app_key
+        self.app_secret = app_secret
+        self.store = store
+        if margin_seconds is None:
+            value = os.environ.get("DROPBOX_TOKEN_REFRESH_MARGIN_SECONDS")
+            margin_seconds = (
+                float(value) if value else DEFAULT_REFRESH_MARGIN_SECONDS
+            )
+        self.margin_seconds = margin_seconds
+        self._clock = clock
+        self._token: Optional[AccessToken] = None
+        # token rejected by the API, not taken from the store again
+        self._rejected: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, token: Optional[AccessToken]) -> bool:
+        return (
+            token is not None
+            and token.token != self._rejected
+            and token.expires_at - self.margin_seconds > self._clock()
+        )
+
+    def get_token(self) -> str:
+        """Get the access token, refreshed if it is about to expire.
+
+        Returns:
+            str: access token
+
+        Raises:
+            TokenRefreshError: the token endpoint failed
+        """
+        token = self._token
+        if self._is_fresh(token):
+            return token.token
+        # one thread refreshes, the others wait for it.
+        with self._lock:
+            if not self._is_fresh(self._token):
+                self._token = self._load_or_refresh()
+            return self._token.token
+
+    def invalidate(self, token: str) -> None:
+        """Drop the token rejected by the API.
+
+        Args:
+            token (str): access token
+        """
+        with self._lock:
+            self._rejected = token
+            if self._token is not None and self._token.token == token:
+                self._token = None
+
+    def _load_or_refresh(self) -> AccessToken:
+        if self.store is not None:
+            token = self.store.load()
+            if self._is_fresh(token):
+                return token
+
+        token = self._refresh()
+        if self.store is not None:
+            self.store.save(token)
+        return token
+
+    def _refresh(self) -> AccessToken:
+        data = {
+            "grant_type": "refresh_token",
+            "refresh_token": self.refresh_token,
+            "client_id": self.app_key,
+        }
+        if self.app_secret:
+            data["client_secret"] = self.app_secret
+        recorder.count("api_calls_dropbox_token")
+        response = httpclient.post(TOKEN_URL, data=data)
+        if response.status_code != HTTPStatus.OK:
+            raise TokenRefreshError(
+                "token refresh failed: {} {}".format(
+                    response.status_code, response.text
+                )
+            )
+        res = response.json()
+        logger.info("access token was refreshed.")
+        return AccessToken(
+            res["access_token"], self._clock() + res["expires_in"]
+        )
+
+
+_managers: Dict[str, TokenManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager() -> Optional[TokenManager]:
+    """Get the token manager, built once per container.
+
+    DROPBOX_REFRESH_TOKEN and DROPBOX_APP_KEY (and DROPBOX_APP_SECRET)
+    enable the refresh token flow. The token is shared through DynamoDB
+    if DROPBOX_TOKEN_CACHE is "dynamodb".
+
+    Returns:
+        Optional[TokenManager]: token manager, None if no refresh token
+    """
+    refresh_token = os.environ.get("DROPBOX_REFRESH_TOKEN")
+    if not refresh_token:
+        return None
+    with _managers_lock:
+        manager = _managers.get(refresh_token)
+        if manager is None:
+            store = None
+            if os.environ.get("DROPBOX_TOKEN_CACHE") == TOKEN_CACHE_DYNAMODB:
+                store = DynamoDBTokenStore()
+            manager = TokenManager(
+                refresh_token,
+                os.environ["DROPBOX_APP_KEY"],
+                os.environ.get("DROPBOX_APP_SECRET"),
+                store=store,
+            )
+            _managers[refresh_token] = manager
+    return manager
+
+
+def get_access_token() -> str:
+    """Get the access token of the API calls.
+
+    DROPBOX_TOKEN is used as is without the refresh token.
+
+    Returns:
+        str: access token
+    """
+    manager = get_token_manager()
+    if manager is None:
+        return os.environ["DROPBOX_TOKEN"]
+    return manager.get_token()
+
+
+def invalidate_access_token(token: str) -> bool:
+    """Drop the token rejected by the API.
+
+    Args:
+        token (str): access token
+
+    Returns:
+        bool: True if a new token can be made
+    """
+    manager = get_token_manager()
+    if manager is None:
+        return False
+    manager.invalidate(token)
+    return True
@@ -1,10 +1,128 @@
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Dict, Iterator, List, Optional
 
-import requests
+import api.auth as auth
+import api.ratelimit as ratelimit
+from pydantic import BaseModel
 
 CONTENT_TYPE_JSON = "application/json"
 
+ENDPOINT_FILES = "files"
+ENDPOINT_SHARING = "sharing"
+# {endpoint class: (requests per second, burst size)}
+DEFAULT_RATE_LIMITS = {
+    ENDPOINT_FILES: (20.0, 20.0),
+    ENDPOINT_SHARING: (10.0, 10.0),
+}
+
+# settings for sharing team member
+TEAM_LINK_SETTINGS = {
+    "audience": "team",
+    "access": "viewer",
+    "allow_download": True,
+}
+
+
+class SharedLinkMetadata(BaseModel):
+    tag: str
+    url: str
+    path_lower: Optional[str] = None
+    # None if unknown
+    audience: Optional[str] = None
+    access: Optional[str] = None
+    allow_download: Optional[bool] = None
+
+    @classmethod
+    def from_response(cls, link: dict) -> "SharedLinkMetadata":
+        permissions = link.get("link_permissions", {})
+        return cls(
+            tag=link.get(".tag", ""),
+            url=link["url"],
+            path_lower=link.get("path_lower"),
+            audience=permissions.get("effective_audience", {}).get(".tag"),
+            access=permissions.get("link_access_level", {}).get(".tag"),
+            allow_download=permissions.get("allow_download"),
+        )
+
+    def needs_modify(self, settings: dict) -> bool:
+        """Whether the settings differ from the link.
+
+        Args:
+            settings (dict): settings of modify_shared_link_settings
+
+        Returns:
+            bool: True if modify_shared_link_settings is needed
+        """
+        return any(
+            getattr(self, key) != value for key, value in settings.items()
+        )
+
+
+def parse_shared_links(response: dict) -> List[SharedLinkMetadata]:
+    """Parse response of list_shared_links.
+
+    Args:
+        response (dict): response of list_shared_links
+
+    Returns:
+        List[SharedLinkMetadata]: shared links
+    """
+    return [
+        SharedLinkMetadata.from_response(link) for link in response["links"]
+    ]
+
+
+def _create_rate_limiter() -> ratelimit.RateLimiter:
+    limits = {}
+    for endpoint_class, limit in DEFAULT_RATE_LIMITS.items():
+        value = os.environ.get(
+            "DROPBOX_RATE_LIMIT_{}".format(endpoint_class.upper())
+        )
+        limits[endpoint_class] = (
+            (float(value), float(value)) if value else limit
+        )
+    max_retries = os.environ.get("DROPBOX_MAX_RETRIES")
+    if max_retries:
+        return ratelimit.RateLimiter(
+            limits, max_retries=int(max_retries), name="dropbox"
+        )
+    return ratelimit.RateLimiter(limits, name="dropbox")
+
+
+rate_limiter = _create_rate_limiter()
+
+
+def _post(endpoint_class: str, url: str, endpoint: str, data: dict) -> dict:
+    token = auth.get_access_token()
+    response = _post_with_token(endpoint_class, url, endpoint, data, token)
+    if response.status_code == HTTPStatus.UNAUTHORIZED:
+        # the token was revoked or expired earlier than expected.
+        if auth.invalidate_access_token(token):
+            token = auth.get_access_token()
+            response = _post_with_token(
+                endpoint_class, url, endpoint, data, token
+            )
+    return response.json()
+
+
+def _post_with_token(
+    endpoint_class: str, url: str, endpoint: str, data: dict, token: str
+):
+    headers = {
+        "Content-Type": CONTENT_TYPE_JSON,
+        "Authorization": "Bearer {}".format(token),
+    }
+    return rate_limiter.post(
+        endpoint_class,
+        url,
+        endpoint=endpoint,
+        data=json.dumps(data),
+        headers=headers,
+    )
+
 
 def get_latest_cursor(path: str) -> dict:
     """Get latest cursor.
@@ -17,17 +135,9 @@ def get_latest_cursor(path: str) -> dict:
             "cursor": cursor value
         }
     """
-    DROPBOX_TOKEN = os.environ["DROPBOX_TOKEN"]
-
     url = "https://api.dropboxapi.com/2/files/list_folder/get_latest_cursor"
-    headers = {
-        "Content-Type": CONTENT_TYPE_JSON,
-        "Authorization": "Bearer {}".format(DROPBOX_TOKEN),
-    }
     data = {"path": path, "recursive": True}
-    response = requests.post(
-        url, data=json.dumps(data), headers=headers
-    ).json()
+    response = _post(ENDPOINT_FILES, url, "get_latest_cursor", data)
 
     return response
 
@@ -46,26 +156,43 @@ def list_folder_continue(cursor: str) -> dict:
                     ".tag": "folder" | "deleted",
                     "path_display": "/path/to/folder"
                 }
-            ]
+            ],
+            "has_more": True | False
         }
     """
-    DROPBOX_TOKEN = os.environ["DROPBOX_TOKEN"]
-
     url = "https://api.dropboxapi.com/2/files/list_folder/continue"
-    headers = {
-        "Content-Type": CONTENT_TYPE_JSON,
-        "Authorization": "Bearer {}".format(DROPBOX_TOKEN),
-    }
     data = {"cursor": cursor}
-    response = requests.post(
-        url, data=json.dumps(data), headers=headers
-    ).json()
+    response = _post(ENDPOINT_FILES, url, "list_folder_continue", data)
 
     return response
 
 
+def iter_list_folder_continue(cursor: str) -> Iterator[dict]:
+    """Iterate pages of list folder, following "has_more".
+
+    The next page is requested in background while the caller processes
+    the current page.
+
+    Args:
+        cursor (str): cursor
+
+    Yields:
+        Iterator[dict]: response of list_folder_continue for each page
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(list_folder_continue, cursor)
+        while True:
+            page = future.result()
+            has_more = page.get("has_more", False)
+            if has_more:
+                future = executor.submit(list_folder_continue, page["cursor"])
+            yield page
+            if not has_more:
+                break
+
+
 def list_shared_link(path: str) -> dict:
-    """List shared link.
+    """List shared link of the file, not of its parent folders.
 
     Args:
         path (str): filepath
@@ -79,21 +206,69 @@ def list_shared_link(path: str) -> dict:
             ]
         }
     """
-    DROPBOX_TOKEN = os.environ["DROPBOX_TOKEN"]
+    url = "https://api.dropboxapi.com/2/sharing/list_shared_links"
+    data = {"path": path, "direct_only": True}
+    response = _post(ENDPOINT_SHARING, url, "list_shared_link", data)
+
+    return response
+
+
+def list_shared_links(cursor: Optional[str] = None) -> dict:
+    """List all shared links of the user.
 
+    Args:
+        cursor (Optional[str], optional): cursor of the previous page.
+            Defaults to None.
+
+    Returns:
+        dict: {
+            "links": [
+                {
+                    ".tag": "file" | "folder",
+                    "url": shared link,
+                    "path_lower": "/path/to/file"
+                },
+            ],
+            "has_more": True | False,
+            "cursor": cursor of the next page
+        }
+    """
     url = "https://api.dropboxapi.com/2/sharing/list_shared_links"
-    headers = {
-        "Content-Type": CONTENT_TYPE_JSON,
-        "Authorization": "Bearer {}".format(DROPBOX_TOKEN),
-    }
-    data = {"path": path}
-    response = requests.post(
-        url, data=json.dumps(data), headers=headers
-    ).json()
+    data = {}
+    if cursor:
+        data["cursor"] = cursor
+    response = _post(ENDPOINT_SHARING, url, "list_shared_links", data)
 
     return response
 
 
+def build_shared_link_index(root: str) -> Dict[str, SharedLinkMetadata]:
+    """Build index of the file shared links under the folder.
+
+    Args:
+        root (str): folder path
+
+    Returns:
+        Dict[str, SharedLinkMetadata]: {
+            path_lower: shared link metadata
+        }
+    """
+    prefix = root.lower().rstrip("/") + "/"
+    index = {}
+    cursor = None
+    while True:
+        res = list_shared_links(cursor)
+        for link in parse_shared_links(res):
+            if link.tag != "file" or not link.path_lower:
+                continue
+            if link.path_lower.startswith(prefix):
+                index[link.path_lower] = link
+        if not res.get("has_more", False):
+            break
+        cursor = res["cursor"]
+    return index
+
+
 def modify_shared_link(shared_link_url: str) -> dict:
     """Modify shared link for sharing team member.
 
@@ -103,24 +278,12 @@ def modify_shared_link(shared_link_url: str) -> dict:
     Returns:
         dict: modified result
     """
-    DROPBOX_TOKEN = os.environ["DROPBOX_TOKEN"]
-
     url = "https://api.dropboxapi.com/2/sharing/modify_shared_link_settings"
-    headers = {
-        "Content-Type": CONTENT_TYPE_JSON,
-        "Authorization": "Bearer {}".format(DROPBOX_TOKEN),
-    }
     data = {
         "url": shared_link_url,
-        "settings": {
-            "audience": "team",
-            "access": "viewer",
-            "allow_download": True,
-        },
+        "settings": TEAM_LINK_SETTINGS,
     }
-    response = requests.post(
-        url, data=json.dumps(data), headers=headers
-    ).json()
+    response = _post(ENDPOINT_SHARING, url, "modify_shared_link", data)
 
     return response
 
@@ -136,15 +299,9 @@ def create_shared_link(path: str) -> dict:
             "url": shared link
         }
     """
-    DROPBOX_TOKEN = os.environ["DROPBOX_TOKEN"]
-
     url = (
         "https://api.dropboxapi.com/2/sharing/create_shared_link_with_settings"
     )
-    headers = {
-        "Content-Type": CONTENT_TYPE_JSON,
-        "Authorization": "Bearer {}".format(DROPBOX_TOKEN),
-    }
     data = {
         "path": path,
         "settings": {
@@ -153,8 +310,6 @@ def create_shared_link(path: str) -> dict:
             "allow_download": True,
         },
     }
-    response = requests.post(
-        url, data=json.dumps(data), headers=headers
-    ).json()
+    response = _post(ENDPOINT_SHARING, url, "create_shared_link", data)
 
     return response
@@ -0,0 +1,90 @@
+import os
+import threading
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10.0
+
+# The session lives at module level so that a warm Lambda container
+# keeps its TCP/TLS connections alive across entries and invocations.
+_session: Optional[requests.Session] = None
+_lock = threading.Lock()
+
+
+def _get_env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _get_env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def get_timeout() -> Tuple[float, float]:
+    """Get (connect, read) timeout.
+
+    Returns:
+        Tuple[float, float]: connect timeout and read timeout in seconds
+    """
+    return (
+        _get_env_float("HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+        _get_env_float("HTTP_READ_TIMEOUT", DEFAULT_READ_TIMEOUT),
+    )
+
+
+def _create_session() -> requests.Session:
+    # pool_connections is the number of hosts to cache pools for,
+    # pool_maxsize is the number of keep-alive connections per host.
+    adapter = HTTPAdapter(
+        pool_connections=_get_env_int(
+            "HTTP_POOL_CONNECTIONS", DEFAULT_POOL_CONNECTIONS
+        ),
+        pool_maxsize=_get_env_int("HTTP_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE),
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Get the shared session.
+
+    Returns:
+        requests.Session: connection pooled session
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def close_session() -> None:
+    """Close the shared session and drop its pooled connections."""
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """POST through the shared session.
+
+    Args:
+        url (str): request url
+        **kwargs: passed to requests.Session.post
+
+    Returns:
+        requests.Response: response
+    """
+    kwargs.setdefault("timeout", get_timeout())
+    return get_session().post(url, **kwargs)
@@ -0,0 +1,222 @@
+import random
+import threading
+import time
+from http import HTTPStatus
+from typing import Callable, Dict, Optional, Tuple
+
+import api.httpclient as httpclient
+import requests
+from aws_lambda_powertools import Logger
+from util.metrics import recorder
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 30.0
+# ratio of random delay added to the backoff
+JITTER_RATIO = 0.5
+
+logger = Logger()
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """Token bucket.
+
+        Args:
+            rate (float): tokens added per second
+            capacity (float): max tokens, that is burst size
+            clock (Callable[[], float], optional): clock in seconds.
+                Defaults to time.monotonic.
+            sleep (Callable[[float], None], optional): sleep function.
+                Defaults to time.sleep.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, wait until it is available.
+
+        Returns:
+            float: waited seconds
+        """
+        with self._lock:
+            now = self._clock()
+            elapsed = now - self._updated
+            self._tokens = min(
+                self.capacity, self._tokens + elapsed * self.rate
+            )
+            self._updated = now
+            # the token is reserved here and the caller waits outside the
+            # lock, so that waiting callers are served in order.
+            self._tokens -= 1
+            wait = max(
+                -self._tokens / self.rate if self._tokens < 0 else 0.0,
+                self._blocked_until - now,
+            )
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def block(self, seconds: float) -> None:
+        """Block all callers, e.g. while the server asks to retry later.
+
+        Args:
+            seconds (float): seconds to block
+        """
+        with self._lock:
+            self._blocked_until = max(
+                self._blocked_until, self._clock() + seconds
+            )
+
+
+def get_retry_after(response: requests.Response) -> Optional[float]:
+    """Get seconds of Retry-After header.
+
+    Args:
+        response (requests.Response): response
+
+    Returns:
+        Optional[float]: seconds, None if not given
+    """
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        # HTTP-date is not used by Dropbox and Slack.
+        return None
+
+
+def get_backoff(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Get seconds to wait before retrying.
+
+    Args:
+        attempt (int): number of retries so far
+        retry_after (Optional[float], optional): seconds of Retry-After.
+            Defaults to None.
+
+    Returns:
+        float: seconds with jitter
+    """
+    if retry_after is not None:
+        delay = retry_after
+    else:
+        delay = min(
+            DEFAULT_BACKOFF_SECONDS * 2**attempt, MAX_BACKOFF_SECONDS
+        )
+    return delay + random.uniform(0, delay * JITTER_RATIO)
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[float, float]],
+        default_limit: Optional[Tuple[float, float]] = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        name: str = "api",
+    ):
+        """Rate limiter with a token bucket per endpoint class.
+
+        Args:
+            limits (Dict[str, Tuple[float, float]]): {
+                endpoint class: (rate per second, burst size)
+            }
+            default_limit (Optional[Tuple[float, float]], optional): limit of
+                the endpoint classes not in limits. Defaults to None.
+            max_retries (int, optional): max retries on 429.
+                Defaults to DEFAULT_MAX_RETRIES.
+            clock (Callable[[], float], optional): clock in seconds.
+                Defaults to time.monotonic.
+            sleep (Callable[[float], None], optional): sleep function.
+                Defaults to time.sleep.
+            name (str, optional): name of the API in metrics.
+                Defaults to "api".
+        """
+        self.name = name
+        self.buckets = {
+            endpoint_class: TokenBucket(rate, capacity, clock, sleep)
+            for endpoint_class, (rate, capacity) in limits.items()
+        }
+        self.default_limit = default_limit
+        self.max_retries = max_retries
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def get_bucket(self, endpoint_class: str) -> TokenBucket:
+        """Get the bucket of the endpoint class.
+
+        The bucket is created with the default limit if not configured.
+
+        Args:
+            endpoint_class (str): endpoint class
+
+        Returns:
+            TokenBucket: bucket
+        """
+        with self._lock:
+            bucket = self.buckets.get(endpoint_class)
+            if bucket is None:
+                if self.default_limit is None:
+                    raise KeyError(endpoint_class)
+                rate, capacity = self.default_limit
+                bucket = TokenBucket(rate, capacity, self._clock, self._sleep)
+                self.buckets[endpoint_class] = bucket
+            return bucket
+
+    def post(
+        self,
+        endpoint_class: str,
+        url: str,
+        endpoint: Optional[str] = None,
+        **kwargs,
+    ):
+        """POST with the rate limit, retry on 429.
+
+        Args:
+            endpoint_class (str): endpoint class of the limits
+            url (str): request url
+            endpoint (Optional[str], optional): endpoint name in metrics.
+                Defaults to None.
+            **kwargs: passed to httpclient.post
+
+        Returns:
+            requests.Response: response, 429 if retries are exhausted
+        """
+        metric = "{}_{}".format(self.name, endpoint) if endpoint else self.name
+        bucket = self.get_bucket(endpoint_class)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            recorder.count("api_calls_" + metric)
+            response = httpclient.post(url, **kwargs)
+            if response.status_code != HTTPStatus.TOO_MANY_REQUESTS:
+                return response
+            if attempt >= self.max_retries:
+                logger.warning("too many requests, give up: %s", url)
+                return response
+
+            retry_after = get_retry_after(response)
+            delay = get_backoff(attempt, retry_after)
+            logger.warning(
+                "too many requests, retry after %.2f seconds: %s", delay, url
+            )
+            if retry_after is not None:
+                # the limit is shared by the other requests of the class.
+                bucket.block(retry_after)
+            recorder.count("api_retries_" + metric)
+            self._sleep(delay)
+            attempt += 1
@@ -1,35 +1,67 @@
 import json
 import os
-import re
+import queue
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
-from typing import ItemsView, Iterator, List, Tuple
+from typing import (
+    Callable,
+    ItemsView,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
-import requests
+import api.ratelimit as ratelimit
+import api.slackwebapi as slackwebapi
 from aws_lambda_powertools import Logger
-from pydantic import BaseModel, field_validator
+from pydantic import StringConstraints, TypeAdapter, ValidationError
+from typing_extensions import Annotated
 
 url_regex = r"https?://[\w/:%#\$&\?\(\)~\.=\+\-]+"
-re_url = re.compile(url_regex)
 
 logger = Logger()
 
+DEFAULT_SLACK_CONCURRENCY = 4
+# Incoming Webhooks allow about one message per second with short bursts.
+DEFAULT_SLACK_RATE_LIMIT = 1.0
+DEFAULT_SLACK_RATE_BURST = 5.0
+# Slack truncates a long message, so files are split into messages.
+DEFAULT_MAX_MESSAGE_CHARS = 3000
+DEFAULT_MAX_MESSAGES_PER_CHANNEL = 10
+# messages waiting for the sender, the producer blocks when it is full.
+DEFAULT_DELIVERY_QUEUE_SIZE = 10
 
-class _FileInfo(BaseModel):
+
+def _get_env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _get_env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+class _FileInfo(NamedTuple):
     filepath: str
     shared_link: str
 
-    @field_validator("shared_link")
-    def is_shared_link_url(cls, v):
-        if not re_url.match(v):
-            raise ValueError
-        return v
-
     def generate_filepath_with_link(self):
         # URL link of Slack API
         return "<{}|{}>".format(self.shared_link, self.filepath)
 
 
+# validates a list of urls at once without creating a model per file.
+_shared_links_adapter = TypeAdapter(
+    List[Annotated[str, StringConstraints(pattern="^" + url_regex)]]
+)
+
+
 class ChangedFileStore:
     def __init__(self):
         # {
@@ -38,37 +70,180 @@ class ChangedFileStore:
         self.files_by_channel = defaultdict(list)
 
     def add(self, channel: str, filepath: str, shared_link: str) -> None:
-        self.files_by_channel[channel].append(
-            _FileInfo(filepath=filepath, shared_link=shared_link)
-        )
+        # shared_link is validated in bulk by validate()
+        self.files_by_channel[channel].append(_FileInfo(filepath, shared_link))
 
     def items(self) -> ItemsView[str, List[_FileInfo]]:
         return self.files_by_channel.items()
 
+    def validate(self) -> List[Tuple[str, _FileInfo]]:
+        """Remove files whose shared link is not a url.
+
+        Returns:
+            List[Tuple[str, _FileInfo]]: removed (channel, file) list
+        """
+        files = [
+            (channel, file_info)
+            for channel, file_info_list in self.files_by_channel.items()
+            for file_info in file_info_list
+        ]
+        try:
+            _shared_links_adapter.validate_python(
+                [file_info.shared_link for _, file_info in files]
+            )
+            return []
+        except ValidationError as e:
+            invalid_indexes = {error["loc"][0] for error in e.errors()}
+
+        self.files_by_channel = defaultdict(list)
+        invalid_files = []
+        for i, (channel, file_info) in enumerate(files):
+            if i in invalid_indexes:
+                invalid_files.append((channel, file_info))
+            else:
+                self.files_by_channel[channel].append(file_info)
+        return invalid_files
+
 
 class SlackMessageStore:
-    def __init__(self):
+    def __init__(
+        self,
+        max_chars: Optional[int] = None,
+        max_messages: Optional[int] = None,
+    ):
+        """Messages by channel.
+
+        Files of a channel are split into messages as they are added,
+        so that the field value of each message fits in max_chars.
+        Files over max_messages are only counted and summarized.
+
+        Args:
+            max_chars (Optional[int], optional): max chars of a message.
+                Defaults to SLACK_MAX_MESSAGE_CHARS.
+            max_messages (Optional[int], optional): max messages
+                of a channel. Defaults to SLACK_MAX_MESSAGES_PER_CHANNEL.
+        """
+        self.max_chars = max_chars or _get_env_int(
+            "SLACK_MAX_MESSAGE_CHARS", DEFAULT_MAX_MESSAGE_CHARS
+        )
+        self.max_messages = max_messages or _get_env_int(
+            "SLACK_MAX_MESSAGES_PER_CHANNEL", DEFAULT_MAX_MESSAGES_PER_CHANNEL
+        )
         self.files_by_channel = defaultdict(list)
+        # {
+        #   channel: [(start index of files, chars), ...]
+        # }
+        self._chunks_by_channel = defaultdict(list)
+        # {
+        #   channel: number of files not in messages
+        # }
+        self.omitted_by_channel = defaultdict(int)
+        # {
+        #   channel: number of messages taken by take_completed()
+        # }
+        self._taken_by_channel = defaultdict(int)
 
     def add(self, channel, filepath_with_link) -> None:
-        self.files_by_channel[channel].append(filepath_with_link)
+        files = self.files_by_channel[channel]
+        chunks = self._chunks_by_channel[channel]
+        size = len(filepath_with_link)
+        if chunks and chunks[-1][1] + 1 + size <= self.max_chars:
+            # joined with "\n"
+            start, chars = chunks[-1]
+            chunks[-1] = (start, chars + 1 + size)
+        elif self._taken_by_channel[channel] + len(chunks) < self.max_messages:
+            chunks.append((len(files), size))
+        else:
+            self.omitted_by_channel[channel] += 1
+            return
+        files.append(filepath_with_link)
+
+    def take_completed(self) -> List[Tuple[str, dict]]:
+        """Take the messages no more file is added to.
+
+        The files of the taken messages are released,
+        the last message of each channel is left to be filled.
+
+        Returns:
+            List[Tuple[str, dict]]: (channel, message) list
+        """
+        messages = []
+        for channel, chunks in self._chunks_by_channel.items():
+            if len(chunks) < 2:
+                continue
+            filelist = self.files_by_channel[channel]
+            taken = self._taken_by_channel[channel]
+            last_start, last_chars = chunks[-1]
+            for i, (start, _) in enumerate(chunks[:-1]):
+                end = chunks[i + 1][0]
+                title = "({})".format(taken + i + 1)
+                messages.append(
+                    (
+                        channel,
+                        self._build_message(
+                            channel, filelist[start:end], title, 0
+                        ),
+                    )
+                )
+            del filelist[:last_start]
+            self._chunks_by_channel[channel] = [(0, last_chars)]
+            self._taken_by_channel[channel] = taken + len(chunks) - 1
+        return messages
+
+    def _build_message(
+        self,
+        channel: str,
+        filelist: List[str],
+        title_suffix: str,
+        omitted: int,
+    ) -> dict:
+        fields = [
+            {
+                "title": "以下のファイルが更新されました。" + title_suffix,
+                "value": "\n".join(filelist),
+            }
+        ]
+        if omitted:
+            fields.append(
+                {
+                    "title": "",
+                    "value": "ほか{}件のファイルが更新されました。".format(omitted),
+                }
+            )
+        data = {
+            "channel": channel,
+            "attachments": [
+                {
+                    "fallback": "Dropboxが更新されました。",
+                    "color": "#0062ff",
+                    "fields": fields,
+                }
+            ],
+        }
+        if not channel:
+            # sent to the default channel
+            del data["channel"]
+        return data
 
     def generate_messages_items(self) -> Iterator[Tuple[str, dict]]:
         for channel, filelist in self.files_by_channel.items():
-            fields = [
-                {"title": "以下のファイルが更新されました。", "value": "\n".join(filelist)}
-            ]
-            data = {
-                "channel": channel,
-                "attachments": [
-                    {
-                        "fallback": "Dropboxが更新されました。",
-                        "color": "#0062ff",
-                        "fields": fields,
-                    }
-                ],
-            }
-            yield channel, data
+            chunks = self._chunks_by_channel[channel]
+            omitted = self.omitted_by_channel.get(channel, 0)
+            taken = self._taken_by_channel.get(channel, 0)
+            total = taken + len(chunks)
+            for i, (start, _) in enumerate(chunks):
+                end = chunks[i + 1][0] if i + 1 < len(chunks) else None
+                title = ""
+                if total > 1:
+                    # the total is unknown when the first ones are taken.
+                    title = "({})".format(taken + i + 1)
+                data = self._build_message(
+                    channel,
+                    filelist[start:end],
+                    title,
+                    omitted if end is None else 0,
+                )
+                yield channel, data
 
 
 def generage_messages_store(store: ChangedFileStore) -> SlackMessageStore:
@@ -79,21 +254,228 @@ def generage_messages_store(store: ChangedFileStore) -> SlackMessageStore:
     return msg_store
 
 
-def send_messages(store: SlackMessageStore):
-    WEBHOOK_URL = os.environ["SLACK_WEBHOOK_URL"]
+def _create_rate_limiter() -> ratelimit.RateLimiter:
+    rate = _get_env_float("SLACK_RATE_LIMIT", DEFAULT_SLACK_RATE_LIMIT)
+    burst = _get_env_float("SLACK_RATE_BURST", DEFAULT_SLACK_RATE_BURST)
+    # the limit is applied per webhook url.
+    return ratelimit.RateLimiter(
+        {}, default_limit=(rate, burst), name="slack_webhook"
+    )
+
 
+rate_limiter = _create_rate_limiter()
+
+
+def estimate_delivery_seconds(num_messages: int) -> float:
+    """Estimate seconds to send the messages through a webhook.
+
+    Args:
+        num_messages (int): number of messages
+
+    Returns:
+        float: seconds by the rate limit, bursts are not counted
+    """
+    rate, _ = rate_limiter.default_limit
+    return num_messages / rate
+
+
+class DeliveryResult(NamedTuple):
+    channel: str
+    status_code: int
+    # seconds including retries
+    elapsed: float
+    # True if sent to the default channel
+    fallback: bool = False
+    # error of Slack Web API
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code == HTTPStatus.OK and self.error is None
+
+
+def _send_message(
+    webhook_url: Optional[str], channel: str, data: dict
+) -> DeliveryResult:
+    logger.info("send message to channel: %s", channel)
+    start = time.perf_counter()
+    fallback = False
+    error = None
+    try:
+        if slackwebapi.get_bot_token():
+            max_chars = _get_env_int(
+                "SLACK_MAX_MESSAGE_CHARS", DEFAULT_MAX_MESSAGE_CHARS
+            )
+            status_code, error = slackwebapi.send_message(
+                channel, data, max_chars
+            )
+            default_channel = slackwebapi.get_default_channel()
+            if (
+                error in slackwebapi.CHANNEL_ERRORS
+                and default_channel
+                and channel != default_channel
+            ):
+                logger.warning(
+                    'cannot post to channel "%s": %s. '
+                    "send to default channel.",
+                    channel,
+                    error,
+                )
+                data = dict(data, channel=default_channel)
+                fallback = True
+                status_code, error = slackwebapi.send_message(
+                    default_channel, data, max_chars
+                )
+        else:
+            res = rate_limiter.post(
+                webhook_url, webhook_url, data=json.dumps(data)
+            )
+            if res.status_code == HTTPStatus.NOT_FOUND and "channel" in data:
+                # default channel is that configed Incoming Webhooks.
+                logger.warning(
+                    'channel "%s" does not exist. send to default channel.',
+                    channel,
+                )
+                data = {k: v for k, v in data.items() if k != "channel"}
+                fallback = True
+                res = rate_limiter.post(
+                    webhook_url, webhook_url, data=json.dumps(data)
+                )
+            status_code = res.status_code
+            logger.debug("send message response: %s", res)
+    except Exception:
+        logger.exception("send message error! channel: %s", channel)
+        status_code = 0
+    return DeliveryResult(
+        channel, status_code, time.perf_counter() - start, fallback, error
+    )
+
+
+def _send_channel_messages(
+    webhook_url: str, channel: str, data_list: List[dict]
+) -> List[DeliveryResult]:
+    return [_send_message(webhook_url, channel, data) for data in data_list]
+
+
+def send_messages(
+    store: SlackMessageStore, webhook_url: Optional[str] = None
+) -> List[DeliveryResult]:
+    """Send messages to the channels concurrently.
+
+    Args:
+        store (SlackMessageStore): messages
+        webhook_url (Optional[str], optional): incoming webhook url.
+            SLACK_WEBHOOK_URL is used if not given. Defaults to None.
+
+    Returns:
+        List[DeliveryResult]: results in the order of messages
+    """
+    # not needed with the bot token of Web API
+    WEBHOOK_URL = webhook_url or os.environ.get("SLACK_WEBHOOK_URL")
+    max_workers = max(
+        _get_env_int("SLACK_CONCURRENCY", DEFAULT_SLACK_CONCURRENCY), 1
+    )
+
+    # messages of a channel are sent in order,
+    # different channels are sent concurrently.
+    messages_by_channel = defaultdict(list)
     for channel, data in store.generate_messages_items():
-        logger.info("send message to channel: %s", channel)
-        msg = json.dumps(data)
-        res = requests.post(WEBHOOK_URL, data=msg)
-        if res.status_code == HTTPStatus.NOT_FOUND:
-            # default channel is that configed Incoming Webhooks.
-            logger.warning(
-                'channel "%s" does not exist. send to default channel.',
-                channel,
+        messages_by_channel[channel].append(data)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _send_channel_messages, WEBHOOK_URL, channel, data_list
             )
-            del data["channel"]
-            msg = json.dumps(data)
-            res = requests.post(WEBHOOK_URL, data=msg)
+            for channel, data_list in messages_by_channel.items()
+        ]
+        results = [result for future in futures for result in future.result()]
+
+    for result in results:
+        _log_result(result)
+    return results
+
+
+def _log_result(result: DeliveryResult) -> None:
+    logger.info(
+        "delivery result",
+        extra={
+            "channel": result.channel,
+            "status_code": result.status_code,
+            "elapsed": result.elapsed,
+            "fallback": result.fallback,
+            "error": result.error,
+        },
+    )
+
+
+class MessageSender:
+    def __init__(
+        self,
+        webhook_url: Optional[str] = None,
+        queue_size: Optional[int] = None,
+        on_result: Optional[Callable[[dict, DeliveryResult], None]] = None,
+    ):
+        """Send messages in the background while files are processed.
+
+        Messages are sent in the order they are put.
+        put() blocks while the queue is full,
+        so that messages are not piled up faster than they are sent.
+
+        Args:
+            webhook_url (Optional[str], optional): incoming webhook url.
+                SLACK_WEBHOOK_URL is used if not given. Defaults to None.
+            queue_size (Optional[int], optional): max messages waiting.
+                Defaults to SLACK_DELIVERY_QUEUE_SIZE.
+            on_result (Optional[Callable[[dict, DeliveryResult], None]],
+                optional): called with each message and its result
+                by the sender thread. Defaults to None.
+        """
+        self.webhook_url = webhook_url or os.environ.get("SLACK_WEBHOOK_URL")
+        self.on_result = on_result
+        self._queue: queue.Queue = queue.Queue(
+            maxsize=queue_size
+            or _get_env_int(
+                "SLACK_DELIVERY_QUEUE_SIZE", DEFAULT_DELIVERY_QUEUE_SIZE
+            )
+        )
+        self._results: List[DeliveryResult] = []
+        # started by the first message
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            channel, data = item
+            result = _send_message(self.webhook_url, channel, data)
+            _log_result(result)
+            self._results.append(result)
+            if self.on_result is not None:
+                try:
+                    self.on_result(data, result)
+                except Exception:
+                    # the sender keeps running, put() would block forever.
+                    logger.exception("on_result error!")
+
+    def pending(self) -> int:
+        """Number of messages waiting to be sent."""
+        return self._queue.qsize()
+
+    def put(self, channel: str, data: dict) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put((channel, data))
+
+    def close(self) -> List[DeliveryResult]:
+        """Wait for the messages put so far to be sent.
 
-        logger.info("send message response: %s", res)
+        Returns:
+            List[DeliveryResult]: results in the order of messages
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        return self._results
@@ -0,0 +1,198 @@
+import json
+import os
+import re
+import time
+from http import HTTPStatus
+from typing import List, Optional, Tuple
+
+import api.ratelimit as ratelimit
+import util.models as models
+from aws_lambda_powertools import Logger
+
+logger = Logger()
+
+API_URL = "https://slack.com/api/"
+METHOD_POST_MESSAGE = "chat.postMessage"
+METHOD_UPDATE = "chat.update"
+# {method: (requests per second, burst size)}
+DEFAULT_RATE_LIMITS = {
+    # about one message per second per channel
+    METHOD_POST_MESSAGE: (1.0, 5.0),
+    # Tier 3, about 50 requests per minute
+    METHOD_UPDATE: (0.8, 5.0),
+}
+
+# changes in the window are put into one message.
+DEFAULT_WINDOW_SECONDS = 60 * 60
+MODE_UPDATE = "update"
+MODE_THREAD = "thread"
+MAX_UPDATE_ATTEMPTS = 3
+# errors of a channel the bot cannot post to
+CHANNEL_ERRORS = ("channel_not_found", "not_in_channel")
+
+# part numbers of the title do not apply to merged messages
+re_part = re.compile(r"\(\d+\)$")
+
+
+def get_bot_token() -> Optional[str]:
+    """Get the bot token, the Web API is used instead of webhooks if set.
+
+    Returns:
+        Optional[str]: SLACK_BOT_TOKEN
+    """
+    return os.environ.get("SLACK_BOT_TOKEN") or None
+
+
+def get_default_channel() -> Optional[str]:
+    """Get the channel of the messages without a channel.
+
+    Returns:
+        Optional[str]: SLACK_DEFAULT_CHANNEL
+    """
+    return os.environ.get("SLACK_DEFAULT_CHANNEL") or None
+
+
+def _get_window_seconds() -> int:
+    value = os.environ.get("SLACK_MESSAGE_WINDOW_SECONDS")
+    return int(value) if value else DEFAULT_WINDOW_SECONDS
+
+
+def _get_mode() -> str:
+    return os.environ.get("SLACK_MESSAGE_MODE") or MODE_UPDATE
+
+
+rate_limiter = ratelimit.RateLimiter(DEFAULT_RATE_LIMITS, name="slack_web")
+
+
+def _call(method: str, payload: dict) -> Tuple[int, dict]:
+    headers = {
+        "Content-Type": "application/json; charset=utf-8",
+        "Authorization": "Bearer {}".format(get_bot_token()),
+    }
+    # the connections are pooled by the shared session of httpclient.
+    res = rate_limiter.post(
+        method,
+        API_URL + method,
+        endpoint=method.replace(".", "_"),
+        data=json.dumps(payload),
+        headers=headers,
+    )
+    if res.status_code != HTTPStatus.OK:
+        return res.status_code, {"ok": False, "error": res.text}
+    body = res.json()
+    if not body.get("ok"):
+        logger.error("%s error: %s", method, body.get("error"))
+    return res.status_code, body
+
+
+def get_lines(data: dict) -> List[str]:
+    """Get the file links of the message.
+
+    Args:
+        data (dict): message
+
+    Returns:
+        List[str]: file links
+    """
+    value = data["attachments"][0]["fields"][0]["value"]
+    return value.split("\n") if value else []
+
+
+def _with_lines(data: dict, lines: List[str]) -> dict:
+    attachment = data["attachments"][0]
+    first, *rest = attachment["fields"]
+    first = dict(
+        first,
+        title=re_part.sub("", first["title"]),
+        value="\n".join(lines),
+    )
+    attachment = dict(attachment, fields=[first, *rest])
+    return dict(data, attachments=[attachment])
+
+
+def send_message(
+    channel: str, data: dict, max_chars: int
+) -> Tuple[int, Optional[str]]:
+    """Send the message by the Web API.
+
+    The first message of the channel in the time window is posted.
+    The later messages update it with the new files (update mode),
+    or are posted in its thread (thread mode). A message is posted
+    again if the updated one does not fit in max_chars.
+
+    Args:
+        channel (str): channel name, SLACK_DEFAULT_CHANNEL is used
+            if empty
+        data (dict): message
+        max_chars (int): max chars of a message
+
+    Returns:
+        Tuple[int, Optional[str]]: status code and error of Slack API
+    """
+    if not channel:
+        # a bot has no default channel like Incoming Webhooks.
+        channel = get_default_channel()
+        if channel is None:
+            logger.error("SLACK_DEFAULT_CHANNEL is not set.")
+            return HTTPStatus.OK, "channel_not_found"
+        data = dict(data, channel=channel)
+
+    window_seconds = _get_window_seconds()
+    window = int(time.time() // window_seconds)
+    # kept until the end of the window
+    ttl_seconds = (window + 1) * window_seconds - int(time.time())
+    lines = get_lines(data)
+
+    for _ in range(MAX_UPDATE_ATTEMPTS):
+        message = models.get_slack_message(channel, window)
+        if message is None:
+            break
+        if _get_mode() == MODE_THREAD:
+            payload = dict(data, channel=message.channel_id)
+            payload["thread_ts"] = message.ts
+            status_code, body = _call(METHOD_POST_MESSAGE, payload)
+            return status_code, body.get("error")
+
+        posted = set(message.lines)
+        merged = message.lines + [line for line in lines if line not in posted]
+        if len(merged) == len(message.lines):
+            # the files are already in the message.
+            return HTTPStatus.OK, None
+        if len("\n".join(merged)) > max_chars:
+            break
+
+        payload = _with_lines(data, merged)
+        payload.update(channel=message.channel_id, ts=message.ts)
+        status_code, body = _call(METHOD_UPDATE, payload)
+        if body.get("error") == "message_not_found":
+            # deleted by a user
+            break
+        if not body.get("ok"):
+            return status_code, body.get("error")
+        if models.save_slack_message(
+            channel,
+            window,
+            message.channel_id,
+            message.ts,
+            merged,
+            ttl_seconds,
+            message=message,
+        ):
+            return status_code, None
+        # updated by another invocation, merge into its files again.
+        logger.info("message of %s was updated by another.", channel)
+
+    status_code, body = _call(METHOD_POST_MESSAGE, data)
+    if not body.get("ok"):
+        return status_code, body.get("error")
+    # the later messages go to the new one.
+    models.save_slack_message(
+        channel,
+        window,
+        body["channel"],
+        body["ts"],
+        lines,
+        ttl_seconds,
+        message=message,
+    )
+    return status_code, None
@@ -1,8 +1,14 @@
+from __future__ import annotations
+
+import contextlib
+import functools
 import os
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
-import api.dropboxapi as dropboxapi
-import api.slackapi as slackapi
-import util.models as models
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.event_handler.api_gateway import (
     ApiGatewayResolver,
@@ -11,11 +17,32 @@ from aws_lambda_powertools.event_handler.api_gateway import (
 )
 from aws_lambda_powertools.utilities.data_classes import APIGatewayProxyEvent
 from aws_lambda_powertools.utilities.typing import LambdaContext
+from util.changes import ChangeSet
+from util.deadline import Deadline
+from util.lazy import lazy_import, load
+from util.metrics import recorder
+from util.router import ChannelRouter, get_router
+
+# Heavy dependencies (requests, pydantic, boto3, pynamodb) are loaded on
+# the first use, so that GET / for verification does not load them.
+dropboxapi = lazy_import("api.dropboxapi")
+slackapi = lazy_import("api.slackapi")
+slackwebapi = lazy_import("api.slackwebapi")
+jobqueue = lazy_import("util.jobqueue")
+models = lazy_import("util.models")
 
 app = ApiGatewayResolver(proxy_type=ProxyEventType.APIGatewayProxyEvent)
 
 logger = Logger()
 
+DEFAULT_LINK_CONCURRENCY = 8
+# files missing in the cache to list all the shared links at once
+DEFAULT_LINK_INDEX_THRESHOLD = 20
+# result of the link resolution not started before the deadline
+_EXPIRED = object()
+DEFAULT_CHECKPOINT_BATCH_SIZE = 100
+WEBHOOK_MODE_ASYNC = "async"
+
 
 @app.get("/")
 def verify():
@@ -30,58 +57,781 @@ def verify():
     return Response(200, headers=headers, body=challenge)
 
 
-@app.post("/")
-def webhook():
-    DROPBOX_TARGET_DIR = os.environ["DROPBOX_TARGET_DIR"]
+def _get_digest_window() -> float:
+    value = os.environ.get("DIGEST_WINDOW_SECONDS")
+    return float(value) if value else 0.0
+
+
+def _is_digest_mode() -> bool:
+    if _get_digest_window() <= 0:
+        return False
+    if not jobqueue.is_queue_configured():
+        # the digest would never be flushed.
+        logger.error(
+            "DIGEST_WINDOW_SECONDS is set but JOB_QUEUE_URL is not set, "
+            "the changes are sent immediately."
+        )
+        return False
+    return True
+
+
+def _get_link_concurrency() -> int:
+    value = os.environ.get("LINK_CONCURRENCY")
+    return max(int(value), 1) if value else DEFAULT_LINK_CONCURRENCY
+
+
+def _get_link_index_threshold() -> int:
+    value = os.environ.get("LINK_INDEX_THRESHOLD")
+    return int(value) if value else DEFAULT_LINK_INDEX_THRESHOLD
+
+
+def _get_link_key(entry: dict) -> str:
+    # Shared links follow the file on move and are revoked on delete,
+    # so they are cached by the file id. A file re-created at the path
+    # gets a new id.
+    return entry.get("id") or entry["path_display"].lower()
+
+
+def _collect_targets(
+    entries: List[dict], router: ChannelRouter
+) -> List[Tuple[str, str, str]]:
+    """Collect files to notify from entries.
+
+    Args:
+        entries (List[dict]): file entries in their final state
+        router (ChannelRouter): channel router of the target folder
+
+    Returns:
+        List[Tuple[str, str, str]]: (channel, filepath, link key) list
+    """
+    targets = []
+    for entry in entries:
+        logger.debug("entry: %s", entry)
+        filepath = entry["path_display"]
+        channel = router.resolve(filepath)
+        if channel is None:
+            logger.debug("no channel for %s", filepath)
+            continue
+        targets.append((channel, filepath, _get_link_key(entry)))
+    return targets
+
+
+def _skip_handled(
+    entries: List[dict], ledger_keys: Dict[str, str]
+) -> List[dict]:
+    """Drop file entries whose revision was already notified.
+
+    A retried or overlapping invocation costs one batched lookup
+    instead of the shared link and Slack calls.
+
+    Args:
+        entries (List[dict]): file entries
+        ledger_keys (Dict[str, str]): ledger key by path_lower,
+            updated with the keys of the returned entries
+
+    Returns:
+        List[dict]: entries not notified yet
+    """
+    keys = {}
+    for entry in entries:
+        if "rev" in entry:
+            path_lower = entry["path_display"].lower()
+            keys[path_lower] = models.get_ledger_key(path_lower, entry["rev"])
+    handled = models.get_handled(list(keys.values()))
+    if handled:
+        recorder.count("entries_already_handled", len(handled))
+
+    not_handled = []
+    for entry in entries:
+        path_lower = entry["path_display"].lower()
+        key = keys.get(path_lower)
+        if key in handled:
+            continue
+        if key is not None:
+            ledger_keys[path_lower] = key
+        not_handled.append(entry)
+    return not_handled
+
+
+def _find_shared_link(
+    path_lower: str,
+) -> Optional[dropboxapi.SharedLinkMetadata]:
+    res = dropboxapi.list_shared_link(path_lower)
+    return next(iter(dropboxapi.parse_shared_links(res)), None)
+
+
+def _resolve_shared_link(
+    filepath: str,
+    find_link: Callable[[str], Optional[dropboxapi.SharedLinkMetadata]],
+) -> Optional[Tuple[str, bool]]:
+    """Get shared link of the file, create it if it does not exist.
+
+    Args:
+        filepath (str): filepath
+        find_link (Callable[[str], Optional[SharedLinkMetadata]]):
+            returns the existing shared link by path_lower
+
+    Returns:
+        Optional[Tuple[str, bool]]: shared link url and whether the
+            settings for sharing team member are applied, None if failed
+    """
     try:
-        cursor = models.get_cursor()
-    except models.CursorModel.DoesNotExist:  # type: ignore
-        res = dropboxapi.get_latest_cursor(DROPBOX_TARGET_DIR)
-        cursor = res["cursor"]
+        link = find_link(filepath.lower())
+        if link is not None:
+            url = link.url
+            applied = True
+            if link.needs_modify(dropboxapi.TEAM_LINK_SETTINGS):
+                logger.debug("modify_shared_link")
+                res = dropboxapi.modify_shared_link(url)
+                applied = "url" in res
+                if not applied:
+                    logger.warning("failed to modify shared link: %s", res)
+        else:
+            logger.debug("create_shared_link")
+            res = dropboxapi.create_shared_link(filepath)
+            logger.debug("Response of create shared link...: {}".format(res))
+            url = _get_created_url(res)
+            # created for public, modified on the next change of the file.
+            applied = False
+        return url, applied
+    except Exception:
+        logger.exception("shared link error!")
+        return None
+
+
+def _get_created_url(res: dict) -> str:
+    if "url" in res:
+        return res["url"]
+    # the link was created after the index was built.
+    error = res["error"]
+    if error[".tag"] == "shared_link_already_exists":
+        return error["shared_link_already_exists"]["metadata"]["url"]
+    raise ValueError("failed to create shared link: {}".format(res))
+
+
+def _resolve_shared_links(
+    executor: ThreadPoolExecutor,
+    files: List[Tuple[str, str]],
+    get_link_index: Callable[[], Dict[str, dropboxapi.SharedLinkMetadata]],
+    deadline: Optional[Deadline] = None,
+    reserve_ms: float = 0,
+) -> Optional[List[Optional[str]]]:
+    """Resolve shared links of the files.
+
+    Links cached in DynamoDB with the settings applied are used without
+    calling Dropbox API, the others are resolved concurrently and cached.
+    Existing links are looked up per file, or in the index of all the
+    links if LINK_INDEX_THRESHOLD files or more are missing.
+
+    Args:
+        executor (ThreadPoolExecutor): executor to resolve links
+        files (List[Tuple[str, str]]): (link key, filepath) list
+        get_link_index (Callable[[], Dict[str, SharedLinkMetadata]]):
+            returns existing shared links by path_lower
+        deadline (Optional[Deadline], optional): deadline to stop
+            resolving at. Defaults to None.
+        reserve_ms (float, optional): milliseconds needed after
+            resolving, see Deadline.expired. Defaults to 0.
+
+    Returns:
+        Optional[List[Optional[str]]]: shared link urls in the order of
+            files, None if stopped at the deadline
+    """
+    links = models.get_shared_links([key for key, _ in files])
+    missing = [(key, fp) for key, fp in files if key not in links]
+    if missing:
+        find_link = _find_shared_link
+        if len(missing) >= _get_link_index_threshold():
+            # the index pages through all the links of the account.
+            find_link = get_link_index().get
+
+        def resolve(filepath):
+            # the rate limiter may hold the files past the deadline.
+            if deadline is not None and deadline.expired(reserve_ms):
+                return _EXPIRED
+            return _resolve_shared_link(filepath, find_link)
+
+        urls = executor.map(resolve, [fp for _, fp in missing])
+        resolved = {}
+        applied = set()
+        expired = False
+        for (key, _), result in zip(missing, urls):
+            if result is _EXPIRED:
+                expired = True
+                continue
+            if result is None:
+                continue
+            resolved[key], settings_applied = result
+            if settings_applied:
+                applied.add(key)
+        # the resolved links are cached for the continuation.
+        models.save_shared_links(resolved, applied)
+        if expired:
+            return None
+        links.update(resolved)
+    return [links.get(key) for key, _ in files]
+
+
+def process_changes(
+    route: models.RouteAttribute,
+    deadline: Optional[Deadline] = None,
+    owner: Optional[str] = None,
+) -> int:
+    """Notify changed files in the folder of the route to Slack.
+
+    Args:
+        route (RouteAttribute): route
+        deadline (Optional[Deadline], optional): deadline of the
+            invocation. Defaults to None.
+        owner (Optional[str], optional): owner of the lease of the
+            cursor, renewed while processing. Defaults to None.
+
+    Raises:
+        LeaseLostError: the lease was taken by another invocation
+
+    Returns:
+        int: number of changed entries
+    """
+    deadline = deadline or Deadline()
+    try:
+        return _process_changes(route, deadline, owner)
+    except models.CursorConflictError:
+        # the cached cursor was stale, the changes until the saved cursor
+        # were processed by another invocation.
+        logger.warning("cursor was saved by another invocation. retry.")
+        return _process_changes(route, deadline, owner)
 
-    res = dropboxapi.list_folder_continue(cursor)
-    models.save_cursor(res["cursor"])
 
-    if len(res["entries"]) == 0:
+def _get_checkpoint_batch_size() -> int:
+    value = os.environ.get("CHECKPOINT_BATCH_SIZE")
+    return max(int(value), 1) if value else DEFAULT_CHECKPOINT_BATCH_SIZE
+
+
+def _renew_lease(route: models.RouteAttribute, owner: Optional[str]) -> None:
+    if owner is not None and not models.renew_lease(owner, route.cursor_id):
+        raise models.LeaseLostError()
+
+
+def _process_changes(
+    route: models.RouteAttribute, deadline: Deadline, owner: Optional[str]
+) -> int:
+    target_dir = route.root
+    with recorder.timer("cursor_load"):
+        try:
+            cursor, offset = models.get_checkpoint(route.cursor_id)
+        except models.CursorModel.DoesNotExist:  # type: ignore
+            res = dropboxapi.get_latest_cursor(target_dir)
+            cursor, offset = res["cursor"], 0
+    start_cursor, start_offset = cursor, offset
+
+    # Links are resolved concurrently, but the results are added to the store
+    # in the order of entries so that messages stay deterministic.
+    changes = ChangeSet()
+    # files of the run, kept only in the digest mode to be appended at once
+    changed = {}
+    ledger_keys = {}
+    # existing links are listed at most once instead of per file.
+    get_link_index = functools.lru_cache(maxsize=1)(
+        functools.partial(dropboxapi.build_shared_link_index, target_dir)
+    )
+    router = get_router(target_dir, route.channel_rules)
+    batch_size = _get_checkpoint_batch_size()
+    num_entries = 0
+    # (cursor, offset) to continue from if stopped before the deadline
+    checkpoint = None
+    # bursts of changes are sent at once in the digest mode.
+    delivery = (
+        None if _is_digest_mode() else _StreamingDelivery(route, changes)
+    )
+    with contextlib.ExitStack() as stack:
+        if delivery is not None:
+            # the sender is stopped even if the processing fails.
+            stack.callback(delivery.sender.close)
+        executor = stack.enter_context(
+            ThreadPoolExecutor(max_workers=_get_link_concurrency())
+        )
+        # the next page is fetched while the current page is processed.
+        pages = dropboxapi.iter_list_folder_continue(cursor)
+        while checkpoint is None:
+            with recorder.timer("listing"):
+                page = next(pages, None)
+            if page is None:
+                break
+
+            entries = page["entries"]
+            for start in range(offset, len(entries), batch_size):
+                # the rest of the messages are sent before the timeout.
+                reserve_ms = delivery.reserve_ms() if delivery else 0
+                if deadline.expired(reserve_ms):
+                    checkpoint = (cursor, start)
+                    break
+                # another invocation must not process the same changes.
+                _renew_lease(route, owner)
+                batch = entries[start : start + batch_size]  # noqa: E203
+                num_entries += len(batch)
+
+                # API calls are made once per distinct file in the batch.
+                batch_keys = {}
+                files = _skip_handled(changes.add(batch), batch_keys)
+                targets = _collect_targets(files, router)
+                recorder.count("entries_seen", len(batch))
+                recorder.count("entries_skipped", len(batch) - len(targets))
+                with recorder.timer("link_resolution"):
+                    urls = _resolve_shared_links(
+                        executor,
+                        [(key, filepath) for _, filepath, key in targets],
+                        get_link_index,
+                        deadline,
+                        reserve_ms,
+                    )
+                if urls is None:
+                    # the batch is processed again by the continuation.
+                    checkpoint = (cursor, start)
+                    break
+                resolved = [
+                    (channel, filepath, url)
+                    for (channel, filepath, _), url in zip(targets, urls)
+                    if url is not None
+                ]
+                if delivery is not None:
+                    # full messages are sent while the next batch is resolved.
+                    delivery.add(resolved, batch_keys)
+                else:
+                    for file in resolved:
+                        changed[file[1].lower()] = file
+                    ledger_keys.update(batch_keys)
+            else:
+                # the page is done, continue from the next cursor.
+                cursor, offset = page["cursor"], 0
+        pages.close()
+
+    if num_entries == 0 and checkpoint is None:
         # no change
-        logger.info("no change in {}".format(DROPBOX_TARGET_DIR))
-        return Response(200, body="no change")
+        logger.info("no change in {}".format(target_dir))
+        models.save_cursor(cursor, route.cursor_id)
+        return num_entries
+
+    _renew_lease(route, owner)
+    if delivery is None:
+        _append_digest(route, changed, changes, ledger_keys)
+    elif not delivery.close():
+        # the files are processed again from the start on the next
+        # notification, and the delivered ones are skipped by the ledger.
+        models.save_cursor(
+            start_cursor, route.cursor_id, offset=start_offset or None
+        )
+        logger.warning(
+            "some messages of route {} failed. they are sent again on "
+            "the next notification.".format(route.name)
+        )
+        return num_entries
+
+    # the cursor is saved after the files are notified,
+    # so that a failed invocation does not lose the files.
+    if checkpoint is None:
+        models.save_cursor(cursor, route.cursor_id)
+    else:
+        _save_checkpoint(route, *checkpoint)
+    return num_entries
+
+
+def _queue_continuation(route: models.RouteAttribute) -> None:
+    if not jobqueue.is_queue_configured():
+        # the cursor is kept, so the next notification continues.
+        logger.warning(
+            "JOB_QUEUE_URL is not set, route {} continues on the next "
+            "notification.".format(route.name)
+        )
+        return
+    jobqueue.get_queue().put(
+        {"type": jobqueue.JOB_FOLDER_CHANGED, "route": route.name}
+    )
 
+
+def _save_checkpoint(
+    route: models.RouteAttribute, cursor: str, offset: int
+) -> None:
+    models.save_cursor(cursor, route.cursor_id, offset=offset)
+    _queue_continuation(route)
+    recorder.count("checkpoints")
+    logger.info(
+        "stopped before the deadline at {} of the page. continue.".format(
+            offset
+        )
+    )
+
+
+def _append_digest(
+    route: models.RouteAttribute,
+    changed: Dict[str, Tuple[str, str, str]],
+    changes: ChangeSet,
+    ledger_keys: Dict[str, str],
+) -> None:
+    # files deleted in the later pages are not notified
+    files = [
+        file
+        for path_lower, file in changed.items()
+        if changes.is_alive(path_lower)
+    ]
+    # bursts of changes are sent at once after the quiet window.
+    if files and models.append_digest(files, route.cursor_id):
+        _schedule_digest_flush(route, _get_digest_window())
+    models.save_handled(
+        [
+            ledger_keys[filepath.lower()]
+            for _, filepath, _ in files
+            if filepath.lower() in ledger_keys
+        ]
+    )
+
+
+def _validate_files(
+    files: List[Tuple[str, str, str]]
+) -> slackapi.ChangedFileStore:
     store = slackapi.ChangedFileStore()
-    for entry in res["entries"]:
-        logger.info(f"entry: {entry}")
-        if entry[".tag"] in ("folder", "deleted"):
-            # process only files
-            continue
+    for channel, filepath, url in files:
+        store.add(channel, filepath, url)
 
-        # path_display = "/path/to/folder/<channel name>/<filename>""
-        filepath = entry["path_display"]
-        channel = filepath.replace(DROPBOX_TARGET_DIR + "/", "").split("/")[0]
+    for channel, file_info in store.validate():
+        logger.error("invalid shared link: {}".format(file_info))
+    return store
 
-        try:
-            res = dropboxapi.list_shared_link(filepath)
-            links = res["links"]
-            if len(links) != 0:
-                logger.debug("modify_shared_link")
-                url = links[0]["url"]
-                dropboxapi.modify_shared_link(url)
+
+def _count_results(
+    num_files: int, results: List[slackapi.DeliveryResult]
+) -> None:
+    recorder.count("files_notified", num_files)
+    recorder.count("messages_sent", sum(result.ok for result in results))
+    recorder.count("messages_failed", sum(not result.ok for result in results))
+
+
+def _send_files(
+    route: models.RouteAttribute, files: List[Tuple[str, str, str]]
+) -> None:
+    """Send changed files to Slack.
+
+    Args:
+        route (RouteAttribute): route
+        files (List[Tuple[str, str, str]]): (channel, filepath, url) list
+    """
+    with recorder.timer("message_generation"):
+        store = _validate_files(files)
+        msg_store = slackapi.generage_messages_store(store)
+
+    logger.info("send messages of route {}...".format(route.name))
+    with recorder.timer("slack_delivery"):
+        results = slackapi.send_messages(msg_store, route.slack_webhook_url)
+    num_files = sum(len(file_info_list) for _, file_info_list in store.items())
+    _count_results(num_files, results)
+
+
+class _StreamingDelivery:
+    def __init__(self, route: models.RouteAttribute, changes: ChangeSet):
+        """Send the messages of a channel as soon as they are full.
+
+        Resolved files are held per channel until they fill a message,
+        then the full messages are put to the background sender,
+        so that a channel does not wait for the links of other channels.
+        The rest of the messages are sent by close().
+        The files of each delivered message are recorded in the ledger,
+        so that a retry does not send them again.
+
+        Args:
+            route (RouteAttribute): route
+            changes (ChangeSet): changes to check the files are alive
+        """
+        self.route = route
+        self.changes = changes
+        self.msg_store = slackapi.SlackMessageStore()
+        self.sender = slackapi.MessageSender(
+            route.slack_webhook_url, on_result=self._on_result
+        )
+        self.num_files = 0
+        self._channels: Set[str] = set()
+        # {
+        #   channel: {path_lower: file link}
+        # }
+        self._pending: Dict[str, Dict[str, str]] = defaultdict(dict)
+        self._pending_chars: Dict[str, int] = defaultdict(int)
+        # {
+        #   file link: ledger key
+        # }
+        # of the files not sent yet
+        self._ledger_keys: Dict[str, str] = {}
+
+    def add(
+        self, files: List[Tuple[str, str, str]], ledger_keys: Dict[str, str]
+    ) -> None:
+        """Add resolved files of a batch.
+
+        Args:
+            files (List[Tuple[str, str, str]]): (channel, filepath, url) list
+            ledger_keys (Dict[str, str]): ledger key by path_lower
+        """
+        with recorder.timer("message_generation"):
+            for channel, file_info_list in _validate_files(files).items():
+                self._channels.add(channel)
+                self.num_files += len(file_info_list)
+                for file_info in file_info_list:
+                    link = file_info.generate_filepath_with_link()
+                    path_lower = file_info.filepath.lower()
+                    if path_lower in ledger_keys:
+                        self._ledger_keys[link] = ledger_keys[path_lower]
+                    self._pending[channel][path_lower] = link
+                    # joined with "\n"
+                    self._pending_chars[channel] += len(link) + 1
+                    if self._pending_chars[channel] > self.msg_store.max_chars:
+                        self._flush_pending(channel)
+            messages = self.msg_store.take_completed()
+        for channel, data in messages:
+            # blocks while the sender is behind
+            self.sender.put(channel, data)
+
+    def _flush_pending(self, channel: str) -> None:
+        # files deleted in the later batches are not notified
+        for path_lower, link in self._pending.pop(channel).items():
+            if self.changes.is_alive(path_lower):
+                self.msg_store.add(channel, link)
             else:
-                logger.debug("create_shared_link")
-                res = dropboxapi.create_shared_link(filepath)
-                logger.debug(
-                    "Response of create shared link...: {}".format(res)
-                )
-                url = res["url"]
+                self._ledger_keys.pop(link, None)
+        self._pending_chars.pop(channel)
+
+    def reserve_ms(self) -> float:
+        """Estimate milliseconds to send the rest of the messages.
+
+        Returns:
+            float: milliseconds
+        """
+        # the queued full messages and the last message of each channel
+        num_messages = self.sender.pending() + len(self._channels)
+        return slackapi.estimate_delivery_seconds(num_messages) * 1000
+
+    def _on_result(self, data: dict, result: slackapi.DeliveryResult) -> None:
+        keys = [
+            self._ledger_keys.pop(link)
+            for link in slackwebapi.get_lines(data)
+            if link in self._ledger_keys
+        ]
+        if result.ok and keys:
+            models.save_handled(keys)
+
+    def close(self) -> bool:
+        """Send the rest of the messages.
+
+        Returns:
+            bool: True if all the messages were delivered
+        """
+        for channel in list(self._pending):
+            self._flush_pending(channel)
+
+        logger.info("send messages of route {}...".format(self.route.name))
+        with recorder.timer("slack_delivery"):
+            # messages of a channel are sent in order.
+            results = self.sender.close()
+            rest = slackapi.send_messages(
+                self.msg_store, self.route.slack_webhook_url
+            )
+        # the results are in the order of messages.
+        for (_, data), result in zip(
+            self.msg_store.generate_messages_items(), rest
+        ):
+            self._on_result(data, result)
+        _count_results(self.num_files, results + rest)
+        return all(result.ok for result in results + rest)
+
+
+def _schedule_digest_flush(
+    route: models.RouteAttribute, delay_seconds: float
+) -> None:
+    job = {"type": jobqueue.JOB_DIGEST_FLUSH, "route": route.name}
+    jobqueue.get_queue().put(job, delay_seconds=delay_seconds)
+    # a lost flush is scheduled again by the next append.
+    models.set_digest_flush(time.time() + delay_seconds, route.cursor_id)
+    logger.info(
+        "digest flush of route {} is scheduled in {:.1f} seconds.".format(
+            route.name, delay_seconds
+        )
+    )
+
+
+def flush_digest(route: models.RouteAttribute) -> int:
+    """Send the digest of the route if no change came in the quiet window.
 
-            store.add(channel, filepath, url)
-        except Exception as e:
-            logger.exception("shared link error!", e)
+    Args:
+        route (RouteAttribute): route
 
-    logger.info("send messages...")
-    msg_store = slackapi.generage_messages_store(store)
-    slackapi.send_messages(msg_store)
+    Returns:
+        int: number of sent files
+    """
+    digest = models.get_digest(route.cursor_id)
+    if digest is None or digest.pending == 0:
+        return 0
+
+    wait = digest.updated_at + _get_digest_window() - time.time()
+    if wait > 0:
+        # changes are still coming, wait for the quiet window again.
+        _schedule_digest_flush(route, wait)
+        return 0
+
+    files = models.take_digest(digest)
+    if files is None:
+        logger.info("digest was taken by another invocation.")
+        return 0
+    # appended again by a retry of a failed invocation
+    files = list(dict.fromkeys(files))
+    _send_files(route, files)
+    return len(files)
+
+
+def process_changes_coalesced(
+    route: models.RouteAttribute, deadline: Optional[Deadline] = None
+) -> Optional[int]:
+    """Process changes unless another invocation is processing them.
+
+    Notifications received while processing are coalesced into
+    one more run by the lease holder.
+
+    Args:
+        route (RouteAttribute): route
+        deadline (Optional[Deadline], optional): deadline of the
+            invocation. Defaults to None.
+
+    Returns:
+        Optional[int]: number of changed entries,
+            None if another invocation is processing
+    """
+    deadline = deadline or Deadline()
+    owner = str(uuid.uuid4())
+    if not models.acquire_lease(owner, route.cursor_id):
+        logger.info(
+            "another invocation is processing route {}.".format(route.name)
+        )
+        return None
+
+    num_entries = 0
+    try:
+        while True:
+            num_entries += process_changes(route, deadline, owner)
+            if deadline.expired():
+                # the rest is processed by the continuation job.
+                if not models.release_lease(owner, cursor_id=route.cursor_id):
+                    # so are the changes notified while processing.
+                    models.release_lease(
+                        owner, force=True, cursor_id=route.cursor_id
+                    )
+                    _queue_continuation(route)
+                break
+            if models.release_lease(owner, cursor_id=route.cursor_id):
+                break
+            logger.info("changes were notified while processing.")
+    except models.LeaseLostError:
+        # the changes are processed by the new holder.
+        logger.warning(
+            "lease of route {} was taken by another invocation.".format(
+                route.name
+            )
+        )
+    except Exception:
+        models.release_lease(owner, force=True, cursor_id=route.cursor_id)
+        raise
+    return num_entries
+
+
+def process_routes(
+    deadline: Optional[Deadline] = None,
+) -> List[Optional[int]]:
+    """Process changes of all routes concurrently.
+
+    A failure of a route does not stop the other routes.
+
+    Args:
+        deadline (Optional[Deadline], optional): deadline of the
+            invocation. Defaults to None.
+
+    Returns:
+        List[Optional[int]]: number of changed entries of each route,
+            None if another invocation is processing
+    """
+    routes = models.get_routes()
+    # LazyLoader is not thread-safe on the first access, and the routes,
+    # the shared links and the messages are processed by threads.
+    load(dropboxapi, slackapi, slackwebapi, jobqueue, models)
+    if len(routes) == 1:
+        return [process_changes_coalesced(routes[0], deadline)]
+
+    with ThreadPoolExecutor(max_workers=len(routes)) as executor:
+        futures = [
+            executor.submit(process_changes_coalesced, route, deadline)
+            for route in routes
+        ]
+        results = []
+        errors = []
+        for route, future in zip(routes, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.exception("route {} failed!".format(route.name))
+                errors.append(e)
+                results.append(0)
+    if errors:
+        raise errors[0]
+    return results
+
+
+@app.post("/")
+def webhook():
+    if os.environ.get("WEBHOOK_MODE") == WEBHOOK_MODE_ASYNC:
+        if jobqueue.is_queue_configured():
+            # Dropbox expects a response within seconds,
+            # so the changes are processed by the worker.
+            jobqueue.get_queue().put({"type": jobqueue.JOB_FOLDER_CHANGED})
+            logger.info("folder changed job is queued.")
+            return Response(200, body="accepted")
+        logger.error(
+            "WEBHOOK_MODE is async but JOB_QUEUE_URL is not set, "
+            "the changes are processed in this invocation."
+        )
+
+    results = process_routes(Deadline(app.lambda_context))
+    if all(num_entries is None for num_entries in results):
+        return Response(200, body="coalesced")
+    if not any(results):
+        return Response(200, body="no change")
 
 
 @logger.inject_lambda_context(log_event=True)
 def lambda_handler(event: APIGatewayProxyEvent, context: LambdaContext):
-    return app.resolve(event, context)
+    try:
+        return app.resolve(event, context)
+    finally:
+        recorder.flush()
+
+
+@logger.inject_lambda_context(log_event=True)
+def worker_handler(event: dict, context: LambdaContext):
+    try:
+        _handle_jobs(event, Deadline(context))
+    finally:
+        recorder.flush()
+
+
+def _handle_jobs(event: dict, deadline: Deadline):
+    if "Records" in event:
+        jobs = jobqueue.parse_sqs_event(event)
+    else:
+        jobs = list(jobqueue.get_local_queue().drain())
+
+    # Every job reads the changes from the saved cursor,
+    # so queued jobs are coalesced into one run.
+    if any(job["type"] == jobqueue.JOB_FOLDER_CHANGED for job in jobs):
+        process_routes(deadline)
+
+    route_names = {
+        job["route"]
+        for job in jobs
+        if job["type"] == jobqueue.JOB_DIGEST_FLUSH
+    }
+    if route_names:
+        for route in models.get_routes():
+            if route.name in route_names:
+                flush_digest(route)
@@ -0,0 +1,147 @@
+import fnmatch
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Set
+
+# temporary and lock files of Office, LibreOffice and OS
+DEFAULT_IGNORE_PATTERNS = (
+    "~$*",
+    ".~lock.*#",
+    "~*.tmp",
+    "*.tmp",
+    ".DS_Store",
+    "._*",
+    "Thumbs.db",
+    "desktop.ini",
+)
+
+
+def get_ignore_patterns() -> List[str]:
+    """Get ignore patterns of file names.
+
+    IGNORE_PATTERNS is a comma separated list of glob patterns,
+    the default patterns are used if not set.
+
+    Returns:
+        List[str]: glob patterns
+    """
+    value = os.environ.get("IGNORE_PATTERNS")
+    if value is None:
+        return list(DEFAULT_IGNORE_PATTERNS)
+    return [pattern.strip() for pattern in value.split(",") if pattern.strip()]
+
+
+def compile_patterns(patterns: Iterable[str]) -> Optional[Pattern]:
+    """Compile glob patterns into one case-insensitive regex.
+
+    Args:
+        patterns (Iterable[str]): glob patterns
+
+    Returns:
+        Optional[Pattern]: regex, None if no pattern
+    """
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    return re.compile(
+        "|".join(fnmatch.translate(pattern) for pattern in patterns),
+        re.IGNORECASE,
+    )
+
+
+def _get_path_lower(entry: dict) -> str:
+    return entry.get("path_lower") or entry["path_display"].lower()
+
+
+def _iter_ancestors(path_lower: str) -> Iterable[str]:
+    index = path_lower.rfind("/")
+    while index > 0:
+        path_lower = path_lower[:index]
+        yield path_lower
+        index = path_lower.rfind("/")
+
+
+class ChangeSet:
+    def __init__(self, ignore_patterns: Optional[Iterable[str]] = None):
+        """Final state of the changed files over the pages of entries.
+
+        Entries of the same path are collapsed into the last one,
+        ignored files and files deleted later are dropped,
+        so that the files are processed once per batch.
+
+        Args:
+            ignore_patterns (Optional[Iterable[str]], optional): glob
+                patterns of file names to ignore.
+                Defaults to get_ignore_patterns().
+        """
+        if ignore_patterns is None:
+            ignore_patterns = get_ignore_patterns()
+        self._ignore = compile_patterns(ignore_patterns)
+        self._seq = 0
+        # {path_lower: sequence of the last event}
+        self._files: Dict[str, int] = {}
+        self._deleted: Dict[str, int] = {}
+        self._returned: Set[str] = set()
+
+    def is_ignored(self, path_display: str) -> bool:
+        if self._ignore is None:
+            return False
+        return bool(self._ignore.match(path_display.rsplit("/", 1)[-1]))
+
+    def add(self, entries: List[dict]) -> List[dict]:
+        """Add entries of a page.
+
+        Args:
+            entries (List[dict]): entries of list_folder/continue
+
+        Returns:
+            List[dict]: file entries of the page in their final state
+                that were not returned before
+        """
+        latest: Dict[str, dict] = {}
+        for entry in entries:
+            self._seq += 1
+            path_lower = _get_path_lower(entry)
+            tag = entry[".tag"]
+            if tag == "deleted":
+                self._deleted[path_lower] = self._seq
+                self._files.pop(path_lower, None)
+                self._returned.discard(path_lower)
+                latest.pop(path_lower, None)
+            elif tag == "file" and not self.is_ignored(entry["path_display"]):
+                self._files[path_lower] = self._seq
+                # the first event keeps the position in the page
+                latest[path_lower] = entry
+            # folders are not notified
+
+        files = []
+        for path_lower, entry in latest.items():
+            if path_lower in self._returned:
+                # the link was resolved in the previous page
+                continue
+            if self._is_deleted_later(path_lower):
+                continue
+            self._returned.add(path_lower)
+            files.append(entry)
+        return files
+
+    def _is_deleted_later(self, path_lower: str) -> bool:
+        seq = self._files.get(path_lower)
+        if seq is None:
+            return True
+        # a deleted folder deletes the files in it
+        return any(
+            self._deleted.get(ancestor, 0) > seq
+            for ancestor in _iter_ancestors(path_lower)
+        )
+
+    def is_alive(self, path_lower: str) -> bool:
+        """Whether the file exists in the final state.
+
+        Args:
+            path_lower (str): lower-cased path
+
+        Returns:
+            bool: False if the file was deleted later
+        """
+        return not self._is_deleted_later(path_lower)
@@ -0,0 +1,48 @@
+import os
+from typing import Optional
+
+# time left to send the files processed so far and save the checkpoint
+DEFAULT_MARGIN_MS = 10000
+
+
+def _get_margin_ms() -> int:
+    value = os.environ.get("CHECKPOINT_MARGIN_MS")
+    return int(value) if value else DEFAULT_MARGIN_MS
+
+
+class Deadline:
+    def __init__(self, context=None, margin_ms: Optional[int] = None):
+        """Deadline of the invocation.
+
+        Args:
+            context (LambdaContext, optional): context of the invocation.
+                The deadline never expires without
+                get_remaining_time_in_millis, e.g. in local runs.
+                Defaults to None.
+            margin_ms (Optional[int], optional): milliseconds before the
+                timeout to stop at. Defaults to CHECKPOINT_MARGIN_MS.
+        """
+        self._get_remaining = getattr(
+            context, "get_remaining_time_in_millis", None
+        )
+        self.margin_ms = _get_margin_ms() if margin_ms is None else margin_ms
+
+    def remaining_ms(self) -> Optional[int]:
+        if self._get_remaining is None:
+            return None
+        return self._get_remaining()
+
+    def expired(self, reserve_ms: float = 0) -> bool:
+        """Whether the time left is within the margin.
+
+        Args:
+            reserve_ms (float, optional): milliseconds needed after the
+                work to check for, added to the margin. Defaults to 0.
+
+        Returns:
+            bool: True if the work should stop
+        """
+        remaining = self.remaining_ms()
+        return (
+            remaining is not None and remaining < self.margin_ms + reserve_ms
+        )
@@ -0,0 +1,114 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Iterator, List
+
+import boto3
+
+JOB_FOLDER_CHANGED = "folder_changed"
+JOB_DIGEST_FLUSH = "digest_flush"
+
+# max DelaySeconds of SQS
+MAX_DELAY_SECONDS = 900
+# JOB_QUEUE_URL of the in-process queue, for local runs and testing.
+LOCAL_QUEUE_URL = "local"
+
+
+class QueueNotConfiguredError(Exception):
+    """JOB_QUEUE_URL is not set, queued jobs would never run."""
+
+
+class LocalQueue:
+    """In-process queue, a stand-in of SQS for local run and testing."""
+
+    def __init__(self):
+        self._jobs = deque()
+        self._lock = threading.Lock()
+
+    def put(self, job: dict, delay_seconds: float = 0) -> None:
+        with self._lock:
+            self._jobs.append((time.monotonic() + delay_seconds, job))
+
+    def drain(self) -> Iterator[dict]:
+        """Take the jobs that are ready, delayed jobs are left."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                for i, (ready_at, job) in enumerate(self._jobs):
+                    if ready_at <= now:
+                        del self._jobs[i]
+                        break
+                else:
+                    return
+            yield job
+
+    def clear(self) -> None:
+        with self._lock:
+            self._jobs.clear()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+
+class SqsQueue:
+    def __init__(self, queue_url: str):
+        self.queue_url = queue_url
+        self.client = boto3.client("sqs")
+
+    def put(self, job: dict, delay_seconds: float = 0) -> None:
+        self.client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=json.dumps(job),
+            DelaySeconds=min(math.ceil(delay_seconds), MAX_DELAY_SECONDS),
+        )
+
+
+_local_queue = LocalQueue()
+
+
+def is_queue_configured() -> bool:
+    """Whether jobs are processed, JOB_QUEUE_URL is set.
+
+    Returns:
+        bool: True if JOB_QUEUE_URL is set
+    """
+    return bool(os.environ.get("JOB_QUEUE_URL"))
+
+
+def get_queue():
+    """Get job queue.
+
+    SQS is used if JOB_QUEUE_URL is a queue url, the in-process queue
+    drained by worker_handler if it is "local".
+
+    Returns:
+        SqsQueue | LocalQueue: job queue
+
+    Raises:
+        QueueNotConfiguredError: JOB_QUEUE_URL is not set
+    """
+    queue_url = os.environ.get("JOB_QUEUE_URL")
+    if not queue_url:
+        raise QueueNotConfiguredError()
+    if queue_url == LOCAL_QUEUE_URL:
+        return _local_queue
+    return SqsQueue(queue_url)
+
+
+def get_local_queue() -> LocalQueue:
+    return _local_queue
+
+
+def parse_sqs_event(event: dict) -> List[dict]:
+    """Parse jobs from SQS event.
+
+    Args:
+        event (dict): SQS event
+
+    Returns:
+        List[dict]: jobs
+    """
+    return [json.loads(record["body"]) for record in event["Records"]]
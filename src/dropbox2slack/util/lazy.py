@@ -0,0 +1,43 @@
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Import module lazily.
+
+    The module is loaded on the first attribute access, so that
+    the handler does not pay for the dependencies it does not use.
+
+    Args:
+        name (str): module name
+
+    Returns:
+        ModuleType: module
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named {!r}".format(name))
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load(*modules: ModuleType) -> None:
+    """Load lazy modules now.
+
+    LazyLoader is not thread-safe on the first access, so the modules
+    should be loaded before they are shared by threads.
+
+    Args:
+        *modules (ModuleType): modules imported by lazy_import
+    """
+    for module in modules:
+        # any attribute access executes the module.
+        getattr(module, "__name__")
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_NAMESPACE = "dropbox2slack"
+
+UNIT_COUNT = "Count"
+UNIT_MILLISECONDS = "Milliseconds"
+
+
+class PowertoolsSink:
+    """Emit metrics in CloudWatch embedded metric format."""
+
+    def __init__(self, namespace: Optional[str] = None):
+        # powertools Metrics is loaded when metrics are emitted.
+        from aws_lambda_powertools import Metrics
+
+        self._metrics = Metrics(
+            namespace=namespace
+            or os.environ.get("POWERTOOLS_METRICS_NAMESPACE")
+            or DEFAULT_NAMESPACE
+        )
+
+    def add_metric(self, name: str, unit: str, value: float) -> None:
+        self._metrics.add_metric(name=name, unit=unit, value=value)
+
+    def flush(self) -> None:
+        self._metrics.flush_metrics()
+
+
+class InMemorySink:
+    """Keep metrics in memory, for local runs and testing."""
+
+    def __init__(self):
+        self.metrics: List[Tuple[str, str, float]] = []
+        self.flushed = 0
+
+    def add_metric(self, name: str, unit: str, value: float) -> None:
+        self.metrics.append((name, unit, value))
+
+    def flush(self) -> None:
+        self.flushed += 1
+
+    def get(self, name: str) -> Optional[float]:
+        """Get the last value of the metric.
+
+        Args:
+            name (str): metric name
+
+        Returns:
+            Optional[float]: value, None if not emitted
+        """
+        values = [value for n, _, value in self.metrics if n == name]
+        return values[-1] if values else None
+
+
+class MetricsRecorder:
+    def __init__(self, sink=None):
+        """Aggregate metrics of an invocation and emit them at once.
+
+        Counters and stage timings are summed up, because they are
+        recorded per entry and by the threads resolving links.
+
+        Args:
+            sink (optional): PowertoolsSink, InMemorySink or an object
+                with add_metric(name, unit, value) and flush().
+                Defaults to PowertoolsSink created on the first flush.
+        """
+        self.sink = sink
+        self._values: Dict[str, Tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _add(self, name: str, unit: str, value: float) -> None:
+        with self._lock:
+            _, total = self._values.get(name, (unit, 0))
+            self._values[name] = (unit, total + value)
+
+    def count(self, name: str, value: float = 1) -> None:
+        self._add(name, UNIT_COUNT, value)
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        self._add(
+            "stage_{}_ms".format(stage), UNIT_MILLISECONDS, seconds * 1000
+        )
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Measure the time of the stage.
+
+        Args:
+            stage (str): stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def flush(self) -> Dict[str, float]:
+        """Emit the aggregated metrics to the sink and reset them.
+
+        Returns:
+            Dict[str, float]: emitted metrics
+        """
+        with self._lock:
+            values = self._values
+            self._values = OrderedDict()
+        if not values:
+            return {}
+
+        if self.sink is None:
+            self.sink = PowertoolsSink()
+        for name, (unit, value) in values.items():
+            self.sink.add_metric(name, unit, value)
+        self.sink.flush()
+        return {name: value for name, (_, value) in values.items()}
+
+
+recorder = MetricsRecorder()
@@ -1,9 +1,42 @@
 import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
 
-from pynamodb.attributes import UnicodeAttribute
+from pynamodb.attributes import (
+    BooleanAttribute,
+    JSONAttribute,
+    ListAttribute,
+    MapAttribute,
+    NumberAttribute,
+    TTLAttribute,
+    UnicodeAttribute,
+    VersionAttribute,
+)
+from pynamodb.exceptions import DeleteError, PutError, UpdateError
 from pynamodb.models import Model
 
 CURSOR_ID = "cursor"
+DEFAULT_LEASE_SECONDS = 60
+LINK_ID_PREFIX = "link#"
+DEFAULT_LINK_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+ROUTES_ID = "routes"
+DEFAULT_ROUTE_NAME = "default"
+DEFAULT_ROUTES_CACHE_SECONDS = 60
+
+LEDGER_ID_PREFIX = "ledger#"
+DEFAULT_LEDGER_TTL_SECONDS = 7 * 24 * 60 * 60
+DIGEST_ID_PREFIX = "digest#"
+DIGEST_CHUNK_SIZE = 500
+DIGEST_TTL_SECONDS = 24 * 60 * 60
+# a flush not done by then is assumed lost and scheduled again.
+DIGEST_FLUSH_GRACE_SECONDS = 5 * 60
+ACCESS_TOKEN_ID = "token#dropbox"
+SLACK_MESSAGE_ID_PREFIX = "slack#"
+
+CONDITIONAL_CHECK_FAILED = "ConditionalCheckFailedException"
 
 
 class CursorModel(Model):
@@ -12,24 +45,716 @@ class CursorModel(Model):
         region = "ap-northeast-1"
 
     id = UnicodeAttribute(hash_key=True)
-    cursor = UnicodeAttribute(range_key=True)
+    cursor = UnicodeAttribute()
+    # number of entries processed in the page of the cursor,
+    # saved when the invocation stopped before the deadline.
+    offset = NumberAttribute(null=True)
+    # incremented on every save, the save fails if another invocation
+    # saved the cursor after it was read.
+    version = VersionAttribute()
+
+
+class CursorConflictError(Exception):
+    """The cursor was saved by another invocation."""
+
+
+class LeaseLostError(Exception):
+    """The lease expired and was taken by another invocation."""
+
+
+class LeaseModel(Model):
+    # stored in the same table as the cursor
+    class Meta(CursorModel.Meta):
+        pass
+
+    id = UnicodeAttribute(hash_key=True)
+    owner = UnicodeAttribute()
+    expires_at = NumberAttribute()
+    # True if changes were notified while the lease is held.
+    pending = BooleanAttribute(default=False)
+
+
+class SharedLinkModel(Model):
+    # stored in the same table as the cursor
+    class Meta(CursorModel.Meta):
+        pass
+
+    # LINK_ID_PREFIX + file id, or path_lower for entries without id
+    id = UnicodeAttribute(hash_key=True)
+    url = UnicodeAttribute()
+    # True if the link settings for sharing team member are applied.
+    settings_applied = BooleanAttribute(default=False)
+    ttl = TTLAttribute()
+
+
+class LedgerModel(Model):
+    # stored in the same table as the cursor
+    class Meta(CursorModel.Meta):
+        pass
+
+    # LEDGER_ID_PREFIX + path_lower + "@" + rev
+    id = UnicodeAttribute(hash_key=True)
+    ttl = TTLAttribute()
+
+
+class DigestModel(Model):
+    # stored in the same table as the cursor
+    class Meta(CursorModel.Meta):
+        pass
+
+    # DIGEST_ID_PREFIX + cursor id
+    id = UnicodeAttribute(hash_key=True)
+    # number of chunks appended and sent so far
+    chunks = NumberAttribute(default=0)
+    flushed = NumberAttribute(null=True)
+    updated_at = NumberAttribute(default=0)
+    # epoch seconds the scheduled flush runs at
+    flush_at = NumberAttribute(null=True)
+
+    @property
+    def pending(self) -> int:
+        return self.chunks - (self.flushed or 0)
+
+
+class DigestChunkModel(Model):
+    # stored in the same table as the cursor
+    class Meta(CursorModel.Meta):
+        pass
+
+    # DIGEST_ID_PREFIX + cursor id + "#" + index
+    id = UnicodeAttribute(hash_key=True)
+    # [[channel, filepath, shared link url], ...]
+    files = JSONAttribute()
+    ttl = TTLAttribute()
+
+
+class AccessTokenModel(Model):
+    # stored in the same table as the cursor
+    class Meta(CursorModel.Meta):
+        pass
+
+    # ACCESS_TOKEN_ID
+    id = UnicodeAttribute(hash_key=True)
+    access_token = UnicodeAttribute()
+    # epoch seconds
+    expires_at = NumberAttribute()
+    ttl = TTLAttribute()
+
+
+class SlackMessageModel(Model):
+    # stored in the same table as the cursor
+    class Meta(CursorModel.Meta):
+        pass
+
+    # SLACK_MESSAGE_ID_PREFIX + channel + "#" + index of the time window
+    id = UnicodeAttribute(hash_key=True)
+    # channel id and timestamp of the posted message
+    channel_id = UnicodeAttribute()
+    ts = UnicodeAttribute()
+    # file links in the message
+    lines = JSONAttribute(default=list)
+    # the save fails if another invocation updated the message
+    version = VersionAttribute()
+    ttl = TTLAttribute()
+
+
+# Cursors read or saved by this container. A warm container skips
+# reading DynamoDB, a stale cursor is detected by the conditional save.
+_cursor_cache: Dict[str, CursorModel] = {}
+_cursor_cache_lock = threading.Lock()
+
+
+class RouteAttribute(MapAttribute):
+    """A watched folder and where its changes are notified."""
+
+    name = UnicodeAttribute()
+    root = UnicodeAttribute()
+    # SLACK_WEBHOOK_URL is used if not set.
+    slack_webhook_url = UnicodeAttribute(null=True)
+    # {
+    #   folder path (or glob pattern) under root: channel name
+    # }
+    channel_rules = JSONAttribute(null=True)
+
+    @property
+    def cursor_id(self) -> str:
+        # the default route keeps the cursor saved before routing existed.
+        if self.name == DEFAULT_ROUTE_NAME:
+            return CURSOR_ID
+        return "{}:{}".format(CURSOR_ID, self.name)
+
+
+class RoutingTableModel(Model):
+    # stored in the same table as the cursor
+    class Meta(CursorModel.Meta):
+        pass
+
+    id = UnicodeAttribute(hash_key=True)
+    routes = ListAttribute(of=RouteAttribute)
+
+
+_routes_cache = None
+_routes_cached_at = 0.0
+
 
+def _get_routes_cache_seconds() -> int:
+    value = os.environ.get("ROUTES_CACHE_SECONDS")
+    return int(value) if value else DEFAULT_ROUTES_CACHE_SECONDS
 
-def get_cursor() -> str:
-    """Get cursor string.
+
+def get_routes() -> List[RouteAttribute]:
+    """Get routes of the watched folders.
+
+    If the routing table is not saved, the default route is made of
+    DROPBOX_TARGET_DIR.
 
     Returns:
-        str: cursor
+        List[RouteAttribute]: routes
     """
-    cursor = CursorModel.get(CURSOR_ID)
-    return cursor.cursor
+    global _routes_cache, _routes_cached_at
+    now = time.monotonic()
+    if (
+        _routes_cache is not None
+        and now - _routes_cached_at < _get_routes_cache_seconds()
+    ):
+        return _routes_cache
+
+    try:
+        routes = RoutingTableModel.get(ROUTES_ID).routes
+    except RoutingTableModel.DoesNotExist:
+        routes = [
+            RouteAttribute(
+                name=DEFAULT_ROUTE_NAME, root=os.environ["DROPBOX_TARGET_DIR"]
+            )
+        ]
+    _routes_cache = routes
+    _routes_cached_at = now
+    return routes
+
+
+def save_routes(routes: List[RouteAttribute]):
+    """Save routes of the watched folders.
+
+    Args:
+        routes (List[RouteAttribute]): routes
+    """
+    RoutingTableModel(ROUTES_ID, routes=routes).save()
+    clear_routes_cache()
+
+
+def clear_routes_cache():
+    global _routes_cache
+    _routes_cache = None
+
+
+def _get_cursor_model(cursor_id: str) -> CursorModel:
+    with _cursor_cache_lock:
+        cursor_model = _cursor_cache.get(cursor_id)
+    if cursor_model is None:
+        cursor_model = CursorModel.get(cursor_id)
+        with _cursor_cache_lock:
+            _cursor_cache[cursor_id] = cursor_model
+    return cursor_model
+
 
+def get_checkpoint(cursor_id: str = CURSOR_ID) -> Tuple[str, int]:
+    """Get cursor and the number of entries processed in its page.
 
-def save_cursor(cursor: str):
+    Args:
+        cursor_id (str, optional): id of the cursor. Defaults to CURSOR_ID.
+
+    Returns:
+        Tuple[str, int]: cursor and offset in the page
+    """
+    cursor_model = _get_cursor_model(cursor_id)
+    return cursor_model.cursor, cursor_model.offset or 0
+
+
+def save_cursor(
+    cursor: str, cursor_id: str = CURSOR_ID, offset: Optional[int] = None
+):
     """Save cursor
 
+    The cursor is overwritten in place only if it was not saved by
+    another invocation since it was read by this container.
+
     Args:
         cursor (str): cursor
+        cursor_id (str, optional): id of the cursor. Defaults to CURSOR_ID.
+        offset (Optional[int], optional): number of entries processed in
+            the page of the cursor. Defaults to None.
+
+    Raises:
+        CursorConflictError: saved by another invocation
+    """
+    with _cursor_cache_lock:
+        cursor_model = _cursor_cache.get(cursor_id)
+    if cursor_model is None:
+        cursor_model = CursorModel(cursor_id)
+
+    cursor_model.cursor = cursor
+    cursor_model.offset = offset
+    try:
+        # conditioned on the version by VersionAttribute
+        cursor_model.save()
+    except PutError as e:
+        with _cursor_cache_lock:
+            _cursor_cache.pop(cursor_id, None)
+        if e.cause_response_code == CONDITIONAL_CHECK_FAILED:
+            raise CursorConflictError(cursor_id) from e
+        raise
+
+    with _cursor_cache_lock:
+        _cursor_cache[cursor_id] = cursor_model
+
+
+def clear_cursor_cache():
+    with _cursor_cache_lock:
+        _cursor_cache.clear()
+
+
+def migrate_cursor():
+    """Migrate the cursor item saved before it had the version.
+
+    Items without the version are adopted by the first save anyway,
+    this sets the version in advance, e.g. from a deployment script.
+    """
+    try:
+        cursor_model = CursorModel.get(CURSOR_ID)
+    except CursorModel.DoesNotExist:
+        return
+    if cursor_model.version is None:
+        cursor_model.save()
+    clear_cursor_cache()
+
+
+def _get_lease_seconds() -> int:
+    value = os.environ.get("CURSOR_LEASE_SECONDS")
+    return int(value) if value else DEFAULT_LEASE_SECONDS
+
+
+def get_lease_id(cursor_id: str) -> str:
+    return cursor_id + "#lease"
+
+
+def acquire_lease(owner: str, cursor_id: str = CURSOR_ID) -> bool:
+    """Acquire the lease to process the cursor.
+
+    If another invocation holds the lease, it is marked as pending
+    so that the holder processes the changes again before releasing.
+
+    Args:
+        owner (str): unique id of the invocation
+        cursor_id (str, optional): id of the cursor. Defaults to CURSOR_ID.
+
+    Returns:
+        bool: True if acquired
+    """
+    lease_id = get_lease_id(cursor_id)
+    # retry once in case the holder released the lease meanwhile.
+    for _ in range(2):
+        now = time.time()
+        lease = LeaseModel(
+            lease_id,
+            owner=owner,
+            expires_at=now + _get_lease_seconds(),
+            pending=False,
+        )
+        try:
+            lease.save(
+                condition=LeaseModel.id.does_not_exist()
+                | (LeaseModel.expires_at < now)
+            )
+            return True
+        except PutError as e:
+            if e.cause_response_code != CONDITIONAL_CHECK_FAILED:
+                raise
+
+        try:
+            LeaseModel(lease_id).update(
+                actions=[LeaseModel.pending.set(True)],
+                condition=LeaseModel.id.exists(),
+            )
+            return False
+        except UpdateError as e:
+            if e.cause_response_code != CONDITIONAL_CHECK_FAILED:
+                raise
+    return False
+
+
+def renew_lease(owner: str, cursor_id: str = CURSOR_ID) -> bool:
+    """Extend the lease while processing.
+
+    Args:
+        owner (str): unique id of the invocation
+        cursor_id (str, optional): id of the cursor. Defaults to CURSOR_ID.
+
+    Returns:
+        bool: True if renewed, False if the lease expired and was
+            taken by another invocation
+    """
+    try:
+        LeaseModel(get_lease_id(cursor_id)).update(
+            actions=[
+                LeaseModel.expires_at.set(time.time() + _get_lease_seconds())
+            ],
+            condition=LeaseModel.owner == owner,
+        )
+        return True
+    except UpdateError as e:
+        if e.cause_response_code != CONDITIONAL_CHECK_FAILED:
+            raise
+        return False
+
+
+def release_lease(
+    owner: str, force: bool = False, cursor_id: str = CURSOR_ID
+) -> bool:
+    """Release the lease.
+
+    If changes were notified while holding the lease, the lease is
+    extended instead and the caller should process the changes again.
+
+    Args:
+        owner (str): unique id of the invocation
+        force (bool, optional): release even if pending. Defaults to False.
+        cursor_id (str, optional): id of the cursor. Defaults to CURSOR_ID.
+
+    Returns:
+        bool: True if released (or already lost)
+    """
+    lease_id = get_lease_id(cursor_id)
+    condition = LeaseModel.owner == owner
+    if not force:
+        condition &= LeaseModel.pending == False  # noqa: E712
+    try:
+        LeaseModel(lease_id).delete(condition=condition)
+        return True
+    except DeleteError as e:
+        if e.cause_response_code != CONDITIONAL_CHECK_FAILED:
+            raise
+
+    try:
+        LeaseModel(lease_id).update(
+            actions=[
+                LeaseModel.pending.set(False),
+                LeaseModel.expires_at.set(time.time() + _get_lease_seconds()),
+            ],
+            condition=LeaseModel.owner == owner,
+        )
+        return False
+    except UpdateError as e:
+        if e.cause_response_code != CONDITIONAL_CHECK_FAILED:
+            raise
+        # the lease expired and was taken by another invocation.
+        return True
+
+
+def _get_link_cache_ttl_seconds() -> int:
+    value = os.environ.get("LINK_CACHE_TTL_SECONDS")
+    return int(value) if value else DEFAULT_LINK_CACHE_TTL_SECONDS
+
+
+def get_shared_links(keys: List[str]) -> Dict[str, str]:
+    """Get cached shared links.
+
+    Args:
+        keys (List[str]): file id list
+
+    Returns:
+        Dict[str, str]: {
+            file id: shared link url
+        }
+    """
+    ids = {LINK_ID_PREFIX + key for key in keys}
+    if not ids:
+        return {}
+
+    # items are deleted lazily after ttl, so check it here too.
+    now = datetime.now(timezone.utc)
+    links = {}
+    for item in SharedLinkModel.batch_get(ids):
+        if item.settings_applied and item.ttl > now:
+            key = item.id.replace(LINK_ID_PREFIX, "", 1)
+            links[key] = item.url
+    return links
+
+
+def save_shared_links(links: Dict[str, str], applied: Set[str]):
+    """Save shared links to the cache.
+
+    Links without the settings applied are resolved again by
+    get_shared_links, so that the settings are modified.
+
+    Args:
+        links (Dict[str, str]): {
+            file id: shared link url
+        }
+        applied (Set[str]): file ids of the links with the settings
+            for sharing team member applied
+    """
+    ttl = timedelta(seconds=_get_link_cache_ttl_seconds())
+    with SharedLinkModel.batch_write() as batch:
+        for key, url in links.items():
+            batch.save(
+                SharedLinkModel(
+                    LINK_ID_PREFIX + key,
+                    url=url,
+                    settings_applied=key in applied,
+                    ttl=ttl,
+                )
+            )
+
+
+def get_ledger_key(path_lower: str, rev: str) -> str:
+    return "{}@{}".format(path_lower, rev)
+
+
+def _get_ledger_ttl_seconds() -> int:
+    value = os.environ.get("LEDGER_TTL_SECONDS")
+    return int(value) if value else DEFAULT_LEDGER_TTL_SECONDS
+
+
+def get_handled(keys: List[str]) -> Set[str]:
+    """Get the revisions of files already notified.
+
+    Args:
+        keys (List[str]): keys made by get_ledger_key
+
+    Returns:
+        Set[str]: keys in the ledger
+    """
+    ids = {LEDGER_ID_PREFIX + key for key in keys}
+    if not ids:
+        return set()
+
+    now = datetime.now(timezone.utc)
+    return {
+        item.id.replace(LEDGER_ID_PREFIX, "", 1)
+        for item in LedgerModel.batch_get(ids)
+        if item.ttl > now
+    }
+
+
+def save_handled(keys: List[str]):
+    """Record the revisions of files as notified.
+
+    Args:
+        keys (List[str]): keys made by get_ledger_key
+    """
+    ttl = timedelta(seconds=_get_ledger_ttl_seconds())
+    with LedgerModel.batch_write() as batch:
+        for key in set(keys):
+            batch.save(LedgerModel(LEDGER_ID_PREFIX + key, ttl=ttl))
+
+
+def _get_digest_id(cursor_id: str) -> str:
+    return DIGEST_ID_PREFIX + cursor_id
+
+
+def append_digest(
+    files: List[Tuple[str, str, str]], cursor_id: str = CURSOR_ID
+) -> bool:
+    """Append changed files to the digest.
+
+    Args:
+        files (List[Tuple[str, str, str]]): (channel, filepath, url) list
+        cursor_id (str, optional): id of the cursor. Defaults to CURSOR_ID.
+
+    Returns:
+        bool: True if a flush should be scheduled, that is the digest
+            was empty or the scheduled flush was lost
+    """
+    # an item is limited to 400KB, so files are split into chunks.
+    chunks = [
+        files[i : i + DIGEST_CHUNK_SIZE]  # noqa: E203
+        for i in range(0, len(files), DIGEST_CHUNK_SIZE)
+    ]
+    digest_id = _get_digest_id(cursor_id)
+    digest = DigestModel(digest_id)
+    digest.update(
+        actions=[
+            DigestModel.chunks.add(len(chunks)),
+            DigestModel.updated_at.set(time.time()),
+        ]
+    )
+    start = digest.chunks - len(chunks)
+
+    # the chunks are written right after they are counted, the digest
+    # is flushed only after the quiet window.
+    ttl = timedelta(seconds=DIGEST_TTL_SECONDS)
+    with DigestChunkModel.batch_write() as batch:
+        for i, chunk in enumerate(chunks, start):
+            batch.save(
+                DigestChunkModel(
+                    "{}#{}".format(digest_id, i),
+                    files=[list(file) for file in chunk],
+                    ttl=ttl,
+                )
+            )
+    if start == (digest.flushed or 0):
+        return True
+    return (
+        digest.flush_at is None
+        or digest.flush_at + DIGEST_FLUSH_GRACE_SECONDS < time.time()
+    )
+
+
+def set_digest_flush(flush_at: float, cursor_id: str = CURSOR_ID) -> None:
+    """Record when the scheduled flush of the digest runs.
+
+    Args:
+        flush_at (float): epoch seconds
+        cursor_id (str, optional): id of the cursor. Defaults to CURSOR_ID.
+    """
+    DigestModel(_get_digest_id(cursor_id)).update(
+        actions=[DigestModel.flush_at.set(flush_at)]
+    )
+
+
+def get_digest(cursor_id: str = CURSOR_ID) -> Optional[DigestModel]:
+    """Get the digest.
+
+    Args:
+        cursor_id (str, optional): id of the cursor. Defaults to CURSOR_ID.
+
+    Returns:
+        Optional[DigestModel]: digest, None if nothing was appended
+    """
+    try:
+        return DigestModel.get(_get_digest_id(cursor_id))
+    except DigestModel.DoesNotExist:
+        return None
+
+
+def take_digest(
+    digest: DigestModel,
+) -> Optional[List[Tuple[str, str, str]]]:
+    """Take the pending files of the digest to send.
+
+    Args:
+        digest (DigestModel): digest read by get_digest
+
+    Returns:
+        Optional[List[Tuple[str, str, str]]]: (channel, filepath, url)
+            list in the appended order, None if taken by another
+            invocation
+    """
+    flushed = digest.flushed
+    if flushed is None:
+        condition = DigestModel.flushed.does_not_exist()
+    else:
+        condition = DigestModel.flushed == flushed
+    try:
+        # taken before sending so that the files are sent at most once.
+        DigestModel(digest.id).update(
+            actions=[DigestModel.flushed.set(digest.chunks)],
+            condition=condition,
+        )
+    except UpdateError as e:
+        if e.cause_response_code == CONDITIONAL_CHECK_FAILED:
+            return None
+        raise
+
+    ids = [
+        "{}#{}".format(digest.id, i)
+        for i in range(flushed or 0, digest.chunks)
+    ]
+    chunks = {item.id: item.files for item in DigestChunkModel.batch_get(ids)}
+    with DigestChunkModel.batch_write() as batch:
+        for chunk_id in chunks:
+            batch.delete(DigestChunkModel(chunk_id))
+    return [
+        tuple(file) for chunk_id in ids for file in chunks.get(chunk_id, [])
+    ]
+
+
+def get_access_token() -> Optional[Tuple[str, float]]:
+    """Get the access token shared by the containers.
+
+    Returns:
+        Optional[Tuple[str, float]]: (access token, expiry in epoch
+            seconds), None if not saved
+    """
+    try:
+        item = AccessTokenModel.get(ACCESS_TOKEN_ID)
+    except AccessTokenModel.DoesNotExist:
+        return None
+    return item.access_token, item.expires_at
+
+
+def save_access_token(access_token: str, expires_at: float):
+    """Save the access token for the other containers.
+
+    Args:
+        access_token (str): access token
+        expires_at (float): expiry in epoch seconds
+    """
+    AccessTokenModel(
+        ACCESS_TOKEN_ID,
+        access_token=access_token,
+        expires_at=expires_at,
+        ttl=datetime.fromtimestamp(expires_at, timezone.utc),
+    ).save()
+
+
+def _get_slack_message_id(channel: str, window: int) -> str:
+    return "{}{}#{}".format(SLACK_MESSAGE_ID_PREFIX, channel, window)
+
+
+def get_slack_message(
+    channel: str, window: int
+) -> Optional[SlackMessageModel]:
+    """Get the message posted to the channel in the time window.
+
+    Args:
+        channel (str): channel name
+        window (int): index of the time window
+
+    Returns:
+        Optional[SlackMessageModel]: message, None if not posted
+    """
+    try:
+        return SlackMessageModel.get(_get_slack_message_id(channel, window))
+    except SlackMessageModel.DoesNotExist:
+        return None
+
+
+def save_slack_message(
+    channel: str,
+    window: int,
+    channel_id: str,
+    ts: str,
+    lines: List[str],
+    ttl_seconds: int,
+    message: Optional[SlackMessageModel] = None,
+) -> bool:
+    """Save the message posted to the channel in the time window.
+
+    Args:
+        channel (str): channel name
+        window (int): index of the time window
+        channel_id (str): channel id of the message
+        ts (str): timestamp of the message
+        lines (List[str]): file links in the message
+        ttl_seconds (int): seconds to keep the message
+        message (Optional[SlackMessageModel], optional): message read by
+            get_slack_message to overwrite. Defaults to None.
+
+    Returns:
+        bool: False if the message was saved by another invocation
     """
-    cursor_model = CursorModel(CURSOR_ID, cursor)
-    cursor_model.save()
+    if message is None:
+        message = SlackMessageModel(_get_slack_message_id(channel, window))
+    message.channel_id = channel_id
+    message.ts = ts
+    message.lines = lines
+    message.ttl = timedelta(seconds=ttl_seconds)
+    try:
+        # conditioned on the version by VersionAttribute
+        message.save()
+    except PutError as e:
+        if e.cause_response_code != CONDITIONAL_CHECK_FAILED:
+            raise
+        return False
+    return True
@@ -0,0 +1,119 @@
+import fnmatch
+import json
+import re
+import threading
+from typing import Dict, List, Optional, Pattern, Tuple
+
+GLOB_CHARS = re.compile(r"[*?\[]")
+# files right under the root go to the default channel of the webhook.
+DEFAULT_CHANNEL = ""
+
+
+class _Node:
+    __slots__ = ("children", "globs", "channel")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.globs: List[Tuple[Pattern, "_Node"]] = []
+        self.channel: Optional[str] = None
+
+
+class ChannelRouter:
+    def __init__(self, root: str, rules: Optional[Dict[str, str]] = None):
+        """Resolve the channel of a file from its folder path.
+
+        A rule maps a folder path under the root to a channel,
+        e.g. {"sales": "team-sales", "projects/*/docs": "docs"}.
+        Each segment of the folder path can be a glob pattern.
+        The rule of the deepest folder is used. If no rule matches,
+        the first folder under the root is the channel name.
+        Files right under the root go to the default channel.
+
+        Args:
+            root (str): watched folder path
+            rules (Optional[Dict[str, str]], optional): channel name by
+                folder path under the root. Defaults to None.
+        """
+        # Dropbox paths are case-insensitive.
+        self._prefix = root.rstrip("/").lower() + "/"
+        self._depth = self._prefix.count("/")
+        self._trie = _Node()
+        for pattern, channel in (rules or {}).items():
+            self._add(pattern, channel)
+
+    def _add(self, pattern: str, channel: str) -> None:
+        node = self._trie
+        for segment in pattern.strip("/").lower().split("/"):
+            if GLOB_CHARS.search(segment):
+                regex = re.compile(fnmatch.translate(segment))
+                child = next(
+                    (n for r, n in node.globs if r.pattern == regex.pattern),
+                    None,
+                )
+                if child is None:
+                    child = _Node()
+                    node.globs.append((regex, child))
+            else:
+                child = node.children.setdefault(segment, _Node())
+            node = child
+        node.channel = channel
+
+    def resolve(self, filepath: str) -> Optional[str]:
+        """Resolve the channel of the file.
+
+        Args:
+            filepath (str): path_display of the file
+
+        Returns:
+            Optional[str]: channel name, DEFAULT_CHANNEL if the file is
+                right under the root, None if it is not under the root
+        """
+        if not filepath.lower().startswith(self._prefix):
+            return None
+        depth = self._depth
+        folders = filepath.split("/")[depth:-1]
+        if not folders:
+            return DEFAULT_CHANNEL
+
+        channel = folders[0]
+        node = self._trie
+        for folder in folders:
+            segment = folder.lower()
+            child = node.children.get(segment)
+            if child is None:
+                # exact names are preferred to patterns.
+                child = next(
+                    (n for r, n in node.globs if r.match(segment)), None
+                )
+                if child is None:
+                    break
+            node = child
+            if node.channel is not None:
+                channel = node.channel
+        return channel
+
+
+_routers: Dict[str, ChannelRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(
+    root: str, rules: Optional[Dict[str, str]] = None
+) -> ChannelRouter:
+    """Get the router of the root, built once per container.
+
+    Args:
+        root (str): watched folder path
+        rules (Optional[Dict[str, str]], optional): channel name by
+            folder path under the root. Defaults to None.
+
+    Returns:
+        ChannelRouter: router
+    """
+    key = json.dumps([root, rules], sort_keys=True)
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            router = ChannelRouter(root, rules)
+            _routers[key] = router
+    return router
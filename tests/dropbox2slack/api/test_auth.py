@@ -0,0 +1,212 @@
+import json
+import threading
+
+import httpretty
+import pytest
+from httpretty import HTTPretty
+
+import dropbox2slack.api.auth as auth
+
+
+@pytest.fixture(autouse=True)
+def mock_http_request():
+    with httpretty.enabled(allow_net_connect=False):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def token_managers(monkeypatch):
+    # built per test
+    monkeypatch.setattr(auth, "_managers", {})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class MemoryTokenStore:
+    def __init__(self, token=None):
+        self.token = token
+        self.saved = []
+
+    def load(self):
+        return self.token
+
+    def save(self, token):
+        self.token = token
+        self.saved.append(token)
+
+
+def register_token_responses(*tokens):
+    """Register the token endpoint, returns the bodies of the requests."""
+    tokens = list(tokens)
+    bodies = []
+
+    def request_callback(request, uri, response_headers):
+        bodies.append(request.parsed_body)
+        body = {"access_token": tokens.pop(0), "expires_in": 14400}
+        return [200, response_headers, json.dumps(body)]
+
+    httpretty.register_uri(httpretty.POST, auth.TOKEN_URL, body=request_callback)
+    return bodies
+
+
+def test_get_token_cached():
+    # prepare
+    bodies = register_token_responses("token1", "token2")
+    clock = FakeClock()
+    manager = auth.TokenManager("refresh", "key", "secret", clock=clock)
+
+    # execute
+    first = manager.get_token()
+    clock.now += 14400 - 301
+    second = manager.get_token()
+
+    # verify
+    assert "token1" == first
+    assert "token1" == second
+    assert 1 == len(bodies)
+    body = bodies[0]
+    assert ["refresh_token"] == body["grant_type"]
+    assert ["refresh"] == body["refresh_token"]
+    assert ["key"] == body["client_id"]
+    assert ["secret"] == body["client_secret"]
+
+
+def test_get_token_refreshed_before_expiry():
+    # prepare
+    bodies = register_token_responses("token1", "token2")
+    clock = FakeClock()
+    manager = auth.TokenManager("refresh", "key", clock=clock)
+
+    # execute
+    first = manager.get_token()
+    clock.now += 14400 - 299
+    second = manager.get_token()
+
+    # verify
+    assert "token1" == first
+    assert "token2" == second
+    assert 2 == len(bodies)
+    assert "client_secret" not in bodies[-1]
+
+
+def test_get_token_concurrently(monkeypatch):
+    # prepare
+    calls = []
+
+    def refresh():
+        calls.append(1)
+        return auth.AccessToken("token1", 1e10)
+
+    manager = auth.TokenManager("refresh", "key")
+    monkeypatch.setattr(manager, "_refresh", refresh)
+    tokens = []
+
+    # execute
+    threads = [
+        threading.Thread(target=lambda: tokens.append(manager.get_token()))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # verify
+    assert ["token1"] * 8 == tokens
+    assert [1] == calls
+
+
+def test_get_token_from_store():
+    # prepare
+    clock = FakeClock()
+    store = MemoryTokenStore(auth.AccessToken("shared", clock.now + 3600))
+    manager = auth.TokenManager("refresh", "key", store=store, clock=clock)
+
+    # execute
+    actual = manager.get_token()
+
+    # verify
+    assert "shared" == actual
+    assert [] == store.saved
+
+
+def test_get_token_store_expired():
+    # prepare
+    register_token_responses("token1")
+    clock = FakeClock()
+    store = MemoryTokenStore(auth.AccessToken("shared", clock.now + 60))
+    manager = auth.TokenManager("refresh", "key", store=store, clock=clock)
+
+    # execute
+    actual = manager.get_token()
+
+    # verify
+    assert "token1" == actual
+    assert [auth.AccessToken("token1", clock.now + 14400)] == store.saved
+
+
+def test_invalidate():
+    # prepare
+    register_token_responses("token2")
+    clock = FakeClock()
+    store = MemoryTokenStore(auth.AccessToken("token1", clock.now + 3600))
+    manager = auth.TokenManager("refresh", "key", store=store, clock=clock)
+    assert "token1" == manager.get_token()
+
+    # execute
+    manager.invalidate("token1")
+
+    # verify
+    # the rejected token is not taken from the store again
+    assert "token2" == manager.get_token()
+
+
+def test_get_token_refresh_error():
+    # prepare
+    httpretty.register_uri(
+        httpretty.POST,
+        auth.TOKEN_URL,
+        responses=[HTTPretty.Response('{"error": "invalid_grant"}', status=400)],
+    )
+    manager = auth.TokenManager("refresh", "key")
+
+    # execute
+    with pytest.raises(auth.TokenRefreshError):
+        manager.get_token()
+
+
+def test_get_access_token_long_lived():
+    # execute
+    actual = auth.get_access_token()
+
+    # verify
+    assert "DUMMYTOKEN" == actual
+    assert auth.get_token_manager() is None
+    assert not auth.invalidate_access_token("DUMMYTOKEN")
+
+
+def test_get_access_token_refresh_token(monkeypatch):
+    # prepare
+    monkeypatch.setenv("DROPBOX_REFRESH_TOKEN", "refresh")
+    monkeypatch.setenv("DROPBOX_APP_KEY", "key")
+    monkeypatch.setenv("DROPBOX_TOKEN_CACHE", "dynamodb")
+    monkeypatch.setenv("DROPBOX_TOKEN_REFRESH_MARGIN_SECONDS", "60")
+    monkeypatch.setattr(auth.DynamoDBTokenStore, "load", lambda self: None)
+    monkeypatch.setattr(auth.DynamoDBTokenStore, "save", lambda self, token: None)
+    register_token_responses("token1")
+
+    # execute
+    actual = auth.get_access_token()
+
+    # verify
+    assert "token1" == actual
+    manager = auth.get_token_manager()
+    assert manager is auth.get_token_manager()
+    assert isinstance(manager.store, auth.DynamoDBTokenStore)
+    assert 60 == manager.margin_seconds
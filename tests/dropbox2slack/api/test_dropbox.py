@@ -30,6 +30,34 @@ def test_get_latest_cursor():
     assert "cursor_value" == actual["cursor"]
 
 
+def test_get_latest_cursor_too_many_requests(monkeypatch):
+    # prepare
+    slept = []
+    rate_limiter = dropboxapi.ratelimit.RateLimiter(
+        dropboxapi.DEFAULT_RATE_LIMITS, sleep=slept.append
+    )
+    monkeypatch.setattr(dropboxapi, "rate_limiter", rate_limiter)
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/get_latest_cursor",
+        responses=[
+            HTTPretty.Response(
+                json.dumps({"error_summary": "too_many_requests/"}),
+                status=429,
+                adding_headers={"Retry-After": "1"},
+            ),
+            HTTPretty.Response(json.dumps({"cursor": "cursor_value"})),
+        ],
+    )
+
+    # execute
+    actual = dropboxapi.get_latest_cursor("/path/to/folder")
+
+    # verify
+    assert "cursor_value" == actual["cursor"]
+    assert 1 <= slept[0]
+
+
 def test_list_folder_continue():
     # prepare
     res_body = {
@@ -52,6 +80,55 @@ def test_list_folder_continue():
     assert res_body == actual
 
 
+def test_iter_list_folder_continue():
+    # prepare
+    pages = [
+        {
+            "cursor": "cursor1",
+            "entries": [{".tag": "file", "path_display": "/path/to/file1"}],
+            "has_more": True,
+        },
+        {
+            "cursor": "cursor2",
+            "entries": [{".tag": "file", "path_display": "/path/to/file2"}],
+            "has_more": True,
+        },
+        {
+            "cursor": "cursor3",
+            "entries": [],
+            "has_more": False,
+        },
+    ]
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(page)) for page in pages],
+    )
+
+    # execute
+    actual = list(dropboxapi.iter_list_folder_continue("cursor0"))
+
+    # verify
+    assert pages == actual
+    assert {"cursor": "cursor2"} == json.loads(httpretty.last_request().body)
+
+
+def test_iter_list_folder_continue_no_has_more():
+    # prepare
+    res_body = {"cursor": "cursor1", "entries": []}
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+
+    # execute
+    actual = list(dropboxapi.iter_list_folder_continue("cursor0"))
+
+    # verify
+    assert [res_body] == actual
+
+
 def test_list_shared_link():
     # prepare
     res_body = {
@@ -75,6 +152,143 @@ def test_list_shared_link():
     actual = dropboxapi.list_shared_link(filepath)
 
     assert res_body == actual
+    exp = {"path": filepath, "direct_only": True}
+    assert exp == json.loads(httpretty.last_request().body)
+
+
+def test_list_shared_links():
+    # prepare
+    res_body = {
+        "links": [
+            {".tag": "file", "url": "https://sharedlink.com/1"},
+        ],
+        "has_more": False,
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/sharing/list_shared_links",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+
+    # execute
+    actual = dropboxapi.list_shared_links("prev_cursor")
+
+    # verify
+    assert res_body == actual
+    assert {"cursor": "prev_cursor"} == json.loads(httpretty.last_request().body)
+
+
+def test_build_shared_link_index():
+    # prepare
+    pages = [
+        {
+            "links": [
+                {
+                    ".tag": "file",
+                    "url": "https://sharedlink.com/1",
+                    "path_lower": "/path/to/folder/file1",
+                },
+                {
+                    ".tag": "folder",
+                    "url": "https://sharedlink.com/folder",
+                    "path_lower": "/path/to/folder/sub",
+                },
+                {
+                    ".tag": "file",
+                    "url": "https://sharedlink.com/other",
+                    "path_lower": "/path/to/folder2/file",
+                },
+            ],
+            "has_more": True,
+            "cursor": "cursor1",
+        },
+        {
+            "links": [
+                {
+                    ".tag": "file",
+                    "url": "https://sharedlink.com/2",
+                    "path_lower": "/path/to/folder/sub/file2",
+                },
+                {".tag": "file", "url": "https://sharedlink.com/not-owned"},
+            ],
+            "has_more": False,
+        },
+    ]
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/sharing/list_shared_links",
+        responses=[HTTPretty.Response(json.dumps(page)) for page in pages],
+    )
+
+    # execute
+    actual = dropboxapi.build_shared_link_index("/Path/To/Folder")
+
+    # verify
+    exp = {
+        "/path/to/folder/file1": "https://sharedlink.com/1",
+        "/path/to/folder/sub/file2": "https://sharedlink.com/2",
+    }
+    assert exp == {path: link.url for path, link in actual.items()}
+    assert {"cursor": "cursor1"} == json.loads(httpretty.last_request().body)
+
+
+def test_parse_shared_links():
+    # prepare
+    res_body = {
+        "links": [
+            {
+                ".tag": "file",
+                "url": "https://sharedlink.com/1",
+                "path_lower": "/path/to/file1",
+                "link_permissions": {
+                    "effective_audience": {".tag": "team"},
+                    "link_access_level": {".tag": "viewer"},
+                    "allow_download": True,
+                },
+            },
+            {".tag": "file", "url": "https://sharedlink.com/2"},
+        ]
+    }
+
+    # execute
+    actual = dropboxapi.parse_shared_links(res_body)
+
+    # verify
+    assert "file" == actual[0].tag
+    assert "https://sharedlink.com/1" == actual[0].url
+    assert "/path/to/file1" == actual[0].path_lower
+    assert "team" == actual[0].audience
+    assert "viewer" == actual[0].access
+    assert actual[0].allow_download
+    assert actual[1].path_lower is None
+    assert actual[1].audience is None
+
+
+@pytest.mark.parametrize(
+    "audience, access, allow_download, exp",
+    [
+        ("team", "viewer", True, False),
+        ("public", "viewer", True, True),
+        ("team", "editor", True, True),
+        ("team", "viewer", False, True),
+        (None, None, None, True),
+    ],
+)
+def test_needs_modify(audience, access, allow_download, exp):
+    # prepare
+    link = dropboxapi.SharedLinkMetadata(
+        tag="file",
+        url="https://sharedlink.com",
+        audience=audience,
+        access=access,
+        allow_download=allow_download,
+    )
+
+    # execute
+    actual = link.needs_modify(dropboxapi.TEAM_LINK_SETTINGS)
+
+    # verify
+    assert exp == actual
 
 
 def test_modify_shared_link():
@@ -111,3 +325,37 @@ def test_create_shared_link():
     actual = dropboxapi.create_shared_link(link)
 
     assert res_body == actual
+
+
+def test_get_latest_cursor_expired_token(monkeypatch):
+    # prepare
+    class FakeTokenManager:
+        def __init__(self):
+            self.tokens = ["expired", "refreshed"]
+
+        def get_token(self):
+            return self.tokens[0]
+
+        def invalidate(self, token):
+            self.tokens.remove(token)
+
+    manager = FakeTokenManager()
+    monkeypatch.setattr(dropboxapi.auth, "get_token_manager", lambda: manager)
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/get_latest_cursor",
+        responses=[
+            HTTPretty.Response(
+                json.dumps({"error_summary": "expired_access_token/"}),
+                status=401,
+            ),
+            HTTPretty.Response(json.dumps({"cursor": "cursor_value"})),
+        ],
+    )
+
+    # execute
+    actual = dropboxapi.get_latest_cursor("/path/to/folder")
+
+    # verify
+    assert "cursor_value" == actual["cursor"]
+    assert "Bearer refreshed" == httpretty.last_request().headers["Authorization"]
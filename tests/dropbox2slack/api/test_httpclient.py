@@ -0,0 +1,84 @@
+import json
+
+import httpretty
+import pytest
+from httpretty import HTTPretty
+
+import dropbox2slack.api.httpclient as httpclient
+
+
+@pytest.fixture(autouse=True)
+def mock_http_request():
+    with httpretty.enabled(allow_net_connect=False):
+        yield
+    httpclient.close_session()
+
+
+def test_get_session_is_reused():
+    # execute
+    session1 = httpclient.get_session()
+    session2 = httpclient.get_session()
+
+    # verify
+    assert session1 is session2
+
+
+def test_close_session():
+    # prepare
+    session1 = httpclient.get_session()
+
+    # execute
+    httpclient.close_session()
+    session2 = httpclient.get_session()
+
+    # verify
+    assert session1 is not session2
+
+
+def test_pool_size_from_env(monkeypatch):
+    # prepare
+    monkeypatch.setenv("HTTP_POOL_MAXSIZE", "32")
+    httpclient.close_session()
+
+    # execute
+    adapter = httpclient.get_session().get_adapter("https://example.com")
+
+    # verify
+    assert 32 == adapter._pool_maxsize
+
+
+def test_get_timeout_default():
+    # execute
+    actual = httpclient.get_timeout()
+
+    # verify
+    exp = (httpclient.DEFAULT_CONNECT_TIMEOUT, httpclient.DEFAULT_READ_TIMEOUT)
+    assert exp == actual
+
+
+def test_get_timeout_from_env(monkeypatch):
+    # prepare
+    monkeypatch.setenv("HTTP_CONNECT_TIMEOUT", "1.5")
+    monkeypatch.setenv("HTTP_READ_TIMEOUT", "20")
+
+    # execute
+    actual = httpclient.get_timeout()
+
+    # verify
+    assert (1.5, 20.0) == actual
+
+
+def test_post():
+    # prepare
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://example.com/api",
+        responses=[HTTPretty.Response(json.dumps({"ok": True}))],
+    )
+
+    # execute
+    actual = httpclient.post("https://example.com/api", data="{}")
+
+    # verify
+    assert {"ok": True} == actual.json()
+    assert "{}" == httpretty.last_request().body.decode()
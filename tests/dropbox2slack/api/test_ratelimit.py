@@ -0,0 +1,210 @@
+import json
+
+import httpretty
+import pytest
+from httpretty import HTTPretty
+
+import dropbox2slack.api.ratelimit as ratelimit
+from dropbox2slack.util.metrics import InMemorySink, MetricsRecorder
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture(autouse=True)
+def mock_http_request():
+    with httpretty.enabled(allow_net_connect=False):
+        yield
+
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
+
+
+def test_token_bucket_burst(fake_clock):
+    # prepare
+    bucket = ratelimit.TokenBucket(2, 3, fake_clock.clock, fake_clock.sleep)
+
+    # execute
+    waits = [bucket.acquire() for _ in range(3)]
+
+    # verify
+    assert [0, 0, 0] == waits
+
+
+def test_token_bucket_throttled(fake_clock):
+    # prepare
+    bucket = ratelimit.TokenBucket(2, 1, fake_clock.clock, fake_clock.sleep)
+
+    # execute
+    waits = [bucket.acquire() for _ in range(3)]
+
+    # verify
+    assert [0, 0.5, 0.5] == waits
+    assert 1.0 == fake_clock.now
+
+
+def test_token_bucket_refill(fake_clock):
+    # prepare
+    bucket = ratelimit.TokenBucket(2, 1, fake_clock.clock, fake_clock.sleep)
+    bucket.acquire()
+
+    # execute
+    fake_clock.now += 10
+    actual = bucket.acquire()
+
+    # verify
+    assert 0 == actual
+
+
+def test_token_bucket_block(fake_clock):
+    # prepare
+    bucket = ratelimit.TokenBucket(2, 3, fake_clock.clock, fake_clock.sleep)
+
+    # execute
+    bucket.block(5)
+    actual = bucket.acquire()
+
+    # verify
+    assert 5 == actual
+
+
+@pytest.mark.parametrize(
+    "headers, exp",
+    [
+        ({"Retry-After": "3"}, 3.0),
+        ({}, None),
+        ({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, None),
+    ],
+)
+def test_get_retry_after(headers, exp):
+    # prepare
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://example.com/api",
+        responses=[HTTPretty.Response("", status=429, adding_headers=headers)],
+    )
+    response = ratelimit.httpclient.post("https://example.com/api")
+
+    # execute
+    actual = ratelimit.get_retry_after(response)
+
+    # verify
+    assert exp == actual
+
+
+def test_get_backoff(monkeypatch):
+    # prepare
+    monkeypatch.setattr(ratelimit.random, "uniform", lambda a, b: b)
+
+    # execute / verify
+    assert 1.5 == ratelimit.get_backoff(0)
+    assert 6.0 == ratelimit.get_backoff(2)
+    assert 45.0 == ratelimit.get_backoff(10)
+    assert 3.0 == ratelimit.get_backoff(0, retry_after=2)
+
+
+def test_rate_limiter_retry(fake_clock, monkeypatch):
+    # prepare
+    monkeypatch.setattr(ratelimit.random, "uniform", lambda a, b: 0)
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://example.com/api",
+        responses=[
+            HTTPretty.Response("", status=429, adding_headers={"Retry-After": "2"}),
+            HTTPretty.Response(json.dumps({"ok": True})),
+        ],
+    )
+    limiter = ratelimit.RateLimiter(
+        {"api": (10, 10)}, clock=fake_clock.clock, sleep=fake_clock.sleep
+    )
+
+    # execute
+    actual = limiter.post("api", "https://example.com/api")
+
+    # verify
+    assert 200 == actual.status_code
+    assert {"ok": True} == actual.json()
+    assert 2 == sum(fake_clock.slept)
+
+
+def test_rate_limiter_give_up(fake_clock):
+    # prepare
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://example.com/api",
+        responses=[HTTPretty.Response("", status=429)],
+    )
+    limiter = ratelimit.RateLimiter(
+        {"api": (10, 10)},
+        max_retries=2,
+        clock=fake_clock.clock,
+        sleep=fake_clock.sleep,
+    )
+
+    # execute
+    actual = limiter.post("api", "https://example.com/api")
+
+    # verify
+    assert 429 == actual.status_code
+    assert 2 == len(fake_clock.slept)
+
+
+def test_rate_limiter_metrics(fake_clock, monkeypatch):
+    # prepare
+    monkeypatch.setattr(ratelimit, "recorder", MetricsRecorder(InMemorySink()))
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://example.com/api",
+        responses=[
+            HTTPretty.Response("", status=429, adding_headers={"Retry-After": "0"}),
+            HTTPretty.Response(json.dumps({"ok": True})),
+        ],
+    )
+    limiter = ratelimit.RateLimiter(
+        {"api": (10, 10)},
+        clock=fake_clock.clock,
+        sleep=fake_clock.sleep,
+        name="example",
+    )
+
+    # execute
+    limiter.post("api", "https://example.com/api", endpoint="get")
+    actual = ratelimit.recorder.flush()
+
+    # verify
+    exp = {"api_calls_example_get": 2, "api_retries_example_get": 1}
+    assert exp == actual
+
+
+def test_rate_limiter_default_limit():
+    # prepare
+    limiter = ratelimit.RateLimiter({"api": (10, 10)}, default_limit=(1, 2))
+
+    # execute
+    actual = limiter.get_bucket("https://example.com/webhook")
+
+    # verify
+    assert 1 == actual.rate
+    assert 2 == actual.capacity
+    assert actual is limiter.get_bucket("https://example.com/webhook")
+
+
+def test_rate_limiter_no_default_limit():
+    # prepare
+    limiter = ratelimit.RateLimiter({"api": (10, 10)})
+
+    # execute / verify
+    with pytest.raises(KeyError):
+        limiter.get_bucket("unknown")
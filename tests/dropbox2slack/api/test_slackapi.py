@@ -1,10 +1,11 @@
 import json
 import os
+import time
+from collections import namedtuple
 
 import httpretty
 import pytest
 from httpretty import HTTPretty
-from pydantic import ValidationError
 
 import dropbox2slack.api.slackapi as slackapi
 
@@ -15,6 +16,14 @@ def mock_http_request():
         yield
 
 
+@pytest.fixture(autouse=True)
+def rate_limiter(monkeypatch):
+    # reset the limit of each test
+    rate_limiter = slackapi._create_rate_limiter()
+    monkeypatch.setattr(slackapi, "rate_limiter", rate_limiter)
+    return rate_limiter
+
+
 def test_generate_messages_store_one_channel_one_file():
     # prepare
     store = slackapi.ChangedFileStore()
@@ -96,10 +105,35 @@ def test_generate_messages_store_two_channels_two_files():
 def test_invalid_shared_link():
     # prepare
     store = slackapi.ChangedFileStore()
+    store.add("channel1", "/path/to/file1", "https://file1.com")
+    store.add("channel1", "/path/to/file2", "invalid link")
+    store.add("channel2", "/path/to/file3", "ftp://file3.com")
 
-    # execute / verify
-    with pytest.raises(ValidationError):
-        store.add("channel1", "/path/to/file1", "invalid link")
+    # execute
+    actual = store.validate()
+
+    # verify
+    exp = [
+        ("channel1", ("/path/to/file2", "invalid link")),
+        ("channel2", ("/path/to/file3", "ftp://file3.com")),
+    ]
+    assert exp == actual
+    assert {"channel1": [("/path/to/file1", "https://file1.com")]} == dict(
+        store.items()
+    )
+
+
+def test_valid_shared_link():
+    # prepare
+    store = slackapi.ChangedFileStore()
+    store.add("channel1", "/path/to/file1", "https://file1.com")
+
+    # execute
+    actual = store.validate()
+
+    # verify
+    assert [] == actual
+    assert 1 == len(store.files_by_channel["channel1"])
 
 
 def test_generate_messages_items_add_once():
@@ -143,6 +177,108 @@ def test_generate_messages_items_add_twice_other_channel():
     assert "link2" == act[1][1]["attachments"][0]["fields"][0]["value"]
 
 
+def test_generate_messages_items_split_by_chars():
+    # prepare
+    store = slackapi.SlackMessageStore(max_chars=11)
+    store.add("channel1", "link1")
+    store.add("channel1", "link2")
+    store.add("channel1", "link3")
+
+    # execute
+    act = list(store.generate_messages_items())
+
+    # verify
+    assert 2 == len(act)
+    assert "channel1" == act[0][0]
+    fields = act[0][1]["attachments"][0]["fields"]
+    assert "以下のファイルが更新されました。(1)" == fields[0]["title"]
+    assert "link1\nlink2" == fields[0]["value"]
+    fields = act[1][1]["attachments"][0]["fields"]
+    assert "以下のファイルが更新されました。(2)" == fields[0]["title"]
+    assert "link3" == fields[0]["value"]
+
+
+def test_generate_messages_items_too_long_link():
+    # prepare
+    store = slackapi.SlackMessageStore(max_chars=3)
+    store.add("channel1", "link1")
+    store.add("channel1", "link2")
+
+    # execute
+    act = list(store.generate_messages_items())
+
+    # verify
+    values = [data["attachments"][0]["fields"][0]["value"] for _, data in act]
+    assert ["link1", "link2"] == values
+
+
+def test_generate_messages_items_summary():
+    # prepare
+    store = slackapi.SlackMessageStore(max_chars=5, max_messages=2)
+    for i in range(5):
+        store.add("channel1", f"link{i}")
+    store.add("channel2", "link9")
+
+    # execute
+    act = list(store.generate_messages_items())
+
+    # verify
+    assert ["channel1", "channel1", "channel2"] == [channel for channel, _ in act]
+    assert 1 == len(act[0][1]["attachments"][0]["fields"])
+    fields = act[1][1]["attachments"][0]["fields"]
+    assert "link1" == fields[0]["value"]
+    assert "ほか3件のファイルが更新されました。" == fields[1]["value"]
+    assert 1 == len(act[2][1]["attachments"][0]["fields"])
+    assert {"channel1": 3} == store.omitted_by_channel
+
+
+def test_take_completed():
+    # prepare
+    store = slackapi.SlackMessageStore(max_chars=11, max_messages=3)
+    for i in range(5):
+        store.add("channel1", f"link{i}")
+    store.add("channel2", "link9")
+
+    # execute
+    act = store.take_completed()
+
+    # verify
+    assert ["channel1", "channel1"] == [channel for channel, _ in act]
+    fields = act[0][1]["attachments"][0]["fields"]
+    assert "以下のファイルが更新されました。(1)" == fields[0]["title"]
+    assert "link0\nlink1" == fields[0]["value"]
+    fields = act[1][1]["attachments"][0]["fields"]
+    assert "以下のファイルが更新されました。(2)" == fields[0]["title"]
+    assert "link2\nlink3" == fields[0]["value"]
+    # the files of the taken messages are released
+    assert ["link4"] == store.files_by_channel["channel1"]
+    assert [] == store.take_completed()
+
+    # the taken messages count for max_messages
+    store.add("channel1", "link5")
+    store.add("channel1", "link6")
+    act = list(store.generate_messages_items())
+    fields = act[0][1]["attachments"][0]["fields"]
+    assert "以下のファイルが更新されました。(3)" == fields[0]["title"]
+    assert "link4\nlink5" == fields[0]["value"]
+    assert "ほか1件のファイルが更新されました。" == fields[1]["value"]
+    fields = act[1][1]["attachments"][0]["fields"]
+    assert "以下のファイルが更新されました。" == fields[0]["title"]
+
+
+def test_generate_messages_items_max_from_env(monkeypatch):
+    # prepare
+    monkeypatch.setenv("SLACK_MAX_MESSAGE_CHARS", "100")
+    monkeypatch.setenv("SLACK_MAX_MESSAGES_PER_CHANNEL", "3")
+
+    # execute
+    store = slackapi.SlackMessageStore()
+
+    # verify
+    assert 100 == store.max_chars
+    assert 3 == store.max_messages
+
+
 def test_send_messages():
     # prepare
     res_body = {}
@@ -156,9 +292,14 @@ def test_send_messages():
     store.add("channel1", "link1")
 
     # execute
-    slackapi.send_messages(store)
+    actual = slackapi.send_messages(store)
 
     # verify
+    assert 1 == len(actual)
+    assert "channel1" == actual[0].channel
+    assert actual[0].ok
+    assert not actual[0].fallback
+    assert 0 <= actual[0].elapsed
 
 
 def test_send_messages_channel_does_not_exist():
@@ -167,13 +308,196 @@ def test_send_messages_channel_does_not_exist():
     httpretty.register_uri(
         httpretty.POST,
         os.environ["SLACK_WEBHOOK_URL"],
-        responses=[HTTPretty.Response(json.dumps(res_body), status=404)],
+        responses=[
+            HTTPretty.Response(json.dumps(res_body), status=404),
+            HTTPretty.Response(json.dumps(res_body), status=200),
+        ],
     )
 
     store = slackapi.SlackMessageStore()
     store.add("channel1", "link1")
 
     # execute
-    slackapi.send_messages(store)
+    actual = slackapi.send_messages(store)
+
+    # verify
+    assert actual[0].ok
+    assert actual[0].fallback
+    assert "channel" not in json.loads(httpretty.last_request().body)
+
+
+def test_send_messages_default_channel():
+    # prepare
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=404)],
+    )
+
+    store = slackapi.SlackMessageStore()
+    store.add("", "link1")
+
+    # execute
+    actual = slackapi.send_messages(store)
+
+    # verify
+    assert 404 == actual[0].status_code
+    # not sent again without the channel
+    assert not actual[0].fallback
+    assert "channel" not in json.loads(httpretty.last_request().body)
+
+
+def test_send_messages_too_many_requests(monkeypatch):
+    # prepare
+    slept = []
+    rate_limiter = slackapi.ratelimit.RateLimiter(
+        {}, default_limit=(1, 1), sleep=slept.append
+    )
+    monkeypatch.setattr(slackapi, "rate_limiter", rate_limiter)
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[
+            HTTPretty.Response(
+                "rate_limited", status=429, adding_headers={"Retry-After": "3"}
+            ),
+            HTTPretty.Response("ok", status=200),
+        ],
+    )
+
+    store = slackapi.SlackMessageStore()
+    store.add("channel1", "link1")
+
+    # execute
+    actual = slackapi.send_messages(store)
+
+    # verify
+    assert actual[0].ok
+    assert 3 <= slept[0]
+
+
+def test_send_messages_concurrently(monkeypatch):
+    # prepare
+    monkeypatch.setenv("SLACK_CONCURRENCY", "3")
+    Response = namedtuple("Response", ["status_code"])
+
+    class FakeRateLimiter:
+        def post(self, endpoint_class, url, data):
+            channel = json.loads(data)["channel"]
+            # finish in reverse order
+            time.sleep((3 - int(channel[-1])) * 0.01)
+            return Response(404 if channel == "channel2" else 200)
+
+    monkeypatch.setattr(slackapi, "rate_limiter", FakeRateLimiter())
+
+    store = slackapi.SlackMessageStore(max_chars=5)
+    store.add("channel1", "link1")
+    store.add("channel2", "link2")
+    store.add("channel3", "link3")
+    store.add("channel1", "link4")
+
+    # execute
+    actual = slackapi.send_messages(store)
+
+    # verify
+    exp = ["channel1", "channel1", "channel2", "channel3"]
+    assert exp == [r.channel for r in actual]
+    assert [False, False, True, False] == [r.fallback for r in actual]
+
+
+def test_message_sender(monkeypatch):
+    # prepare
+    monkeypatch.setenv("SLACK_DELIVERY_QUEUE_SIZE", "1")
+    Response = namedtuple("Response", ["status_code"])
+    sent = []
+
+    class FakeRateLimiter:
+        def post(self, endpoint_class, url, data):
+            time.sleep(0.01)
+            sent.append(json.loads(data)["channel"])
+            return Response(500 if len(sent) == 2 else 200)
+
+    monkeypatch.setattr(slackapi, "rate_limiter", FakeRateLimiter())
+    sender = slackapi.MessageSender()
+
+    # execute
+    for i in range(3):
+        sender.put(f"channel{i}", {"channel": f"channel{i}"})
+    actual = sender.close()
+
+    # verify
+    assert ["channel0", "channel1", "channel2"] == sent
+    assert ["channel0", "channel1", "channel2"] == [r.channel for r in actual]
+    assert [True, False, True] == [r.ok for r in actual]
+    # closed twice
+    assert actual == sender.close()
+
+
+def test_message_sender_no_message():
+    # execute
+    sender = slackapi.MessageSender()
+
+    # verify
+    assert [] == sender.close()
+
+
+def test_send_messages_web_api(monkeypatch):
+    # prepare
+    monkeypatch.setenv("SLACK_BOT_TOKEN", "xoxb-token")
+    monkeypatch.setenv("SLACK_MAX_MESSAGE_CHARS", "100")
+    monkeypatch.delenv("SLACK_WEBHOOK_URL")
+    sent = []
+
+    def send_message(channel, data, max_chars):
+        sent.append((channel, max_chars))
+        return 200, "not_in_channel" if channel == "channel2" else None
+
+    monkeypatch.setattr(slackapi.slackwebapi, "send_message", send_message)
+
+    store = slackapi.SlackMessageStore()
+    store.add("channel1", "link1")
+    store.add("channel2", "link2")
+
+    # execute
+    actual = slackapi.send_messages(store)
+
+    # verify
+    assert [("channel1", 100), ("channel2", 100)] == sorted(sent)
+    assert [True, False] == [r.ok for r in actual]
+    assert "not_in_channel" == actual[1].error
+
+
+def test_send_messages_web_api_default_channel(monkeypatch):
+    # prepare
+    monkeypatch.setenv("SLACK_BOT_TOKEN", "xoxb-token")
+    monkeypatch.setenv("SLACK_DEFAULT_CHANNEL", "general")
+    sent = []
+
+    def send_message(channel, data, max_chars):
+        sent.append((channel, data["channel"]))
+        if channel == "channel1":
+            return 200, "channel_not_found"
+        if channel == "channel2":
+            return 200, "not_in_channel"
+        return 200, None
+
+    monkeypatch.setattr(slackapi.slackwebapi, "send_message", send_message)
+
+    store = slackapi.SlackMessageStore()
+    store.add("channel1", "link1")
+    store.add("channel2", "link2")
+    store.add("channel3", "link3")
+
+    # execute
+    actual = slackapi.send_messages(store)
 
     # verify
+    assert [True, True, True] == [r.ok for r in actual]
+    assert [True, True, False] == [r.fallback for r in actual]
+    assert [
+        ("channel1", "channel1"),
+        ("channel2", "channel2"),
+        ("channel3", "channel3"),
+        ("general", "general"),
+        ("general", "general"),
+    ] == sorted(sent)
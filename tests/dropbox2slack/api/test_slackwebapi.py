@@ -0,0 +1,210 @@
+import json
+import os
+import time
+
+import boto3
+import httpretty
+import pytest
+from moto import mock_dynamodb
+
+import dropbox2slack.api.slackwebapi as slackwebapi
+
+
+@pytest.fixture(autouse=True)
+def dynamodb():
+    slackwebapi.models.CursorModel.Meta.table_name = os.environ["TABLE_NAME"]
+
+    with mock_dynamodb():
+        client = boto3.client("dynamodb")
+        client.create_table(
+            TableName=os.environ["TABLE_NAME"],
+            KeySchema=[
+                {"AttributeName": "id", "KeyType": "HASH"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "id", "AttributeType": "S"},
+            ],
+            ProvisionedThroughput={"ReadCapacityUnits": 3, "WriteCapacityUnits": 3},
+        )
+
+        yield client
+
+
+@pytest.fixture(autouse=True)
+def slack_web_api(monkeypatch):
+    """Stand-in Web API, returns the requests by method."""
+    monkeypatch.setenv("SLACK_BOT_TOKEN", "xoxb-token")
+    monkeypatch.setattr(
+        slackwebapi,
+        "rate_limiter",
+        slackwebapi.ratelimit.RateLimiter(slackwebapi.DEFAULT_RATE_LIMITS),
+    )
+    requests = {"chat.postMessage": [], "chat.update": []}
+    errors = {}
+
+    def request_callback(request, uri, response_headers):
+        method = uri.rsplit("/", 1)[-1]
+        body = json.loads(request.body)
+        requests[method].append(body)
+        assert "Bearer xoxb-token" == request.headers["Authorization"]
+        if method in errors:
+            res = {"ok": False, "error": errors.pop(method)}
+        else:
+            ts = "1700000000.{:06d}".format(len(requests[method]))
+            res = {"ok": True, "channel": "C0001", "ts": body.get("ts", ts)}
+        return [200, response_headers, json.dumps(res)]
+
+    with httpretty.enabled(allow_net_connect=False):
+        for method in requests:
+            httpretty.register_uri(
+                httpretty.POST,
+                slackwebapi.API_URL + method,
+                body=request_callback,
+            )
+        yield requests, errors
+
+
+def build_message(title, *lines):
+    return {
+        "channel": "channel1",
+        "attachments": [
+            {"fields": [{"title": title, "value": "\n".join(lines)}]}
+        ],
+    }
+
+
+def get_value(body):
+    return body["attachments"][0]["fields"][0]["value"]
+
+
+def test_send_message_post_then_update(slack_web_api):
+    # prepare
+    requests, _ = slack_web_api
+
+    # execute
+    first = slackwebapi.send_message("channel1", build_message("t", "a", "b"), 100)
+    second = slackwebapi.send_message(
+        "channel1", build_message("t(2)", "b", "c"), 100
+    )
+    third = slackwebapi.send_message("channel1", build_message("t", "a", "c"), 100)
+
+    # verify
+    assert (200, None) == first
+    assert (200, None) == second
+    assert (200, None) == third
+    assert 1 == len(requests["chat.postMessage"])
+    assert "channel1" == requests["chat.postMessage"][0]["channel"]
+    # the files already in the message are not sent again
+    assert 1 == len(requests["chat.update"])
+    update = requests["chat.update"][0]
+    assert "C0001" == update["channel"]
+    assert "1700000000.000001" == update["ts"]
+    assert "a\nb\nc" == get_value(update)
+    assert "t" == update["attachments"][0]["fields"][0]["title"]
+
+
+def test_send_message_post_when_full(slack_web_api):
+    # prepare
+    requests, _ = slack_web_api
+
+    # execute
+    slackwebapi.send_message("channel1", build_message("t", "a", "b"), 3)
+    slackwebapi.send_message("channel1", build_message("t", "c"), 3)
+    slackwebapi.send_message("channel1", build_message("t", "d"), 3)
+
+    # verify
+    assert ["a\nb", "c"] == [get_value(b) for b in requests["chat.postMessage"]]
+    # the later files are put into the new message
+    assert ["c\nd"] == [get_value(b) for b in requests["chat.update"]]
+    assert "1700000000.000002" == requests["chat.update"][0]["ts"]
+
+
+def test_send_message_deleted_message(slack_web_api):
+    # prepare
+    requests, errors = slack_web_api
+    slackwebapi.send_message("channel1", build_message("t", "a"), 100)
+    errors["chat.update"] = "message_not_found"
+
+    # execute
+    actual = slackwebapi.send_message("channel1", build_message("t", "b"), 100)
+
+    # verify
+    assert (200, None) == actual
+    assert ["a", "b"] == [get_value(b) for b in requests["chat.postMessage"]]
+
+
+def test_send_message_error(slack_web_api):
+    # prepare
+    requests, errors = slack_web_api
+    errors["chat.postMessage"] = "channel_not_found"
+
+    # execute
+    actual = slackwebapi.send_message("channel1", build_message("t", "a"), 100)
+
+    # verify
+    assert (200, "channel_not_found") == actual
+    # the next message is posted again
+    slackwebapi.send_message("channel1", build_message("t", "a"), 100)
+    assert 2 == len(requests["chat.postMessage"])
+
+
+def test_send_message_default_channel(slack_web_api, monkeypatch):
+    # prepare
+    monkeypatch.setenv("SLACK_DEFAULT_CHANNEL", "general")
+    requests, _ = slack_web_api
+    data = build_message("t", "a")
+    del data["channel"]
+
+    # execute
+    actual = slackwebapi.send_message("", data, 100)
+
+    # verify
+    assert (200, None) == actual
+    assert "general" == requests["chat.postMessage"][0]["channel"]
+
+
+def test_send_message_default_channel_not_set(slack_web_api):
+    # prepare
+    requests, _ = slack_web_api
+    data = build_message("t", "a")
+    del data["channel"]
+
+    # execute
+    actual = slackwebapi.send_message("", data, 100)
+
+    # verify
+    assert (200, "channel_not_found") == actual
+    assert [] == requests["chat.postMessage"]
+
+
+def test_send_message_thread_mode(slack_web_api, monkeypatch):
+    # prepare
+    monkeypatch.setenv("SLACK_MESSAGE_MODE", "thread")
+    requests, _ = slack_web_api
+
+    # execute
+    slackwebapi.send_message("channel1", build_message("t", "a"), 100)
+    slackwebapi.send_message("channel1", build_message("t", "b"), 100)
+
+    # verify
+    posted = requests["chat.postMessage"]
+    assert "thread_ts" not in posted[0]
+    assert "1700000000.000001" == posted[1]["thread_ts"]
+    assert "C0001" == posted[1]["channel"]
+    assert [] == requests["chat.update"]
+
+
+def test_send_message_new_window(slack_web_api):
+    # prepare
+    requests, _ = slack_web_api
+    window = int(time.time() // slackwebapi.DEFAULT_WINDOW_SECONDS)
+    slackwebapi.models.save_slack_message(
+        "channel1", window - 1, "C0001", "1600000000.000001", ["a"], 3600
+    )
+
+    # execute
+    slackwebapi.send_message("channel1", build_message("t", "b"), 100)
+
+    # verify
+    assert ["b"] == [get_value(b) for b in requests["chat.postMessage"]]
+    assert [] == requests["chat.update"]
@@ -7,3 +7,5 @@ def setenv(monkeypatch):
     monkeypatch.setenv("DROPBOX_TOKEN", "DUMMYTOKEN")
     monkeypatch.setenv("DROPBOX_TARGET_DIR", "/target")
     monkeypatch.setenv("SLACK_WEBHOOK_URL", "https://hooks.slack.com/services/xxxxxxxx")
+    # jobs are drained by worker_handler in the tests
+    monkeypatch.setenv("JOB_QUEUE_URL", "local")
@@ -1,3 +1,6 @@
+import os
+import subprocess
+import sys
 import uuid
 from collections import namedtuple
 
@@ -48,3 +51,43 @@ def test_verify_no_querystrings(lambda_context):
     # verify
     print(response)
     assert 400 == response["statusCode"]
+
+
+def test_verify_does_not_load_heavy_modules():
+    # prepare
+    script = """
+import sys
+from collections import namedtuple
+from lambda_function import lambda_handler
+Context = namedtuple(
+    "LambdaContext",
+    "function_name memory_limit_in_mb invoked_function_arn aws_request_id",
+)
+context = Context("dropbox2slack", 128, "arn", "request-id")
+event = {
+    "path": "/",
+    "httpMethod": "GET",
+    "queryStringParameters": {"challenge": "challenge_value"},
+}
+assert 200 == lambda_handler(event, context)["statusCode"]
+print("modules:" + ",".join(sorted(sys.modules)))
+"""
+    src_dir = os.path.join(
+        os.path.dirname(__file__), "..", "..", "..", "src", "dropbox2slack"
+    )
+
+    # execute
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=src_dir,
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+
+    # verify
+    line = [line for line in result.stdout.splitlines() if "modules:" in line]
+    modules = line[-1].replace("modules:", "").split(",")
+    # NOTE: powertools imports only the botocore package for the user agent.
+    for heavy in ("requests", "pydantic", "pynamodb", "boto3", "botocore.session"):
+        assert heavy not in modules
@@ -1,16 +1,37 @@
 import json
 import os
+import time
 import uuid
 from collections import namedtuple
 
+import api.dropboxapi as dropboxapi
+import api.slackapi as slackapi
 import boto3
 import httpretty
 import pytest
+import util.jobqueue as jobqueue
+import util.metrics as metrics
+import util.models as models
 from httpretty import HTTPretty
 from moto import mock_dynamodb
-from util.models import CursorModel
+from util.models import (
+    CURSOR_ID,
+    CursorModel,
+    LeaseModel,
+    RouteAttribute,
+    acquire_lease,
+    clear_cursor_cache,
+    clear_routes_cache,
+    get_handled,
+    get_lease_id,
+    save_handled,
+    save_routes,
+    save_shared_links,
+)
 
-from dropbox2slack.lambda_function import lambda_handler
+from dropbox2slack.lambda_function import lambda_handler, worker_handler
+
+LEASE_ID = get_lease_id(CURSOR_ID)
 
 
 @pytest.fixture(autouse=True)
@@ -40,9 +61,17 @@ def mock_http_request():
         yield
 
 
+@pytest.fixture(autouse=True)
+def slack_rate_limiter(monkeypatch):
+    # reset the limit of each test
+    monkeypatch.setattr(slackapi, "rate_limiter", slackapi._create_rate_limiter())
+
+
 @pytest.fixture(autouse=True)
 def dynamodb():
     CursorModel.Meta.table_name = os.environ["TABLE_NAME"]
+    clear_cursor_cache()
+    clear_routes_cache()
 
     with mock_dynamodb():
         client = boto3.client("dynamodb")
@@ -99,7 +128,7 @@ def test_webhook_no_cursor(lambda_context, dynamodb):
     # verify saved cursor
     item = {"id": {"S": "cursor"}}
     act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
-    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}}
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}, "version": {"N": "1"}}
     assert exp == act["Item"]
 
 
@@ -130,7 +159,87 @@ def test_webhook_no_entries(lambda_context, dynamodb):
     # verify saved cursor
     item = {"id": {"S": "cursor"}}
     act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
-    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}}
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}, "version": {"N": "1"}}
+    assert exp == act["Item"]
+
+
+def test_webhook_stale_cursor_cache(lambda_context, dynamodb):
+    """cursor was saved by another invocation after cached"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    lambda_handler(event, lambda_context)
+    item = {
+        "id": {"S": "cursor"},
+        "cursor": {"S": "other-cursor"},
+        "version": {"N": "5"},
+    }
+    dynamodb.put_item(TableName=os.environ["TABLE_NAME"], Item=item)
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    req = httpretty.last_request()
+    assert "list_folder/continue" in req.url
+    assert json.dumps({"cursor": "other-cursor"}) == req.body.decode()
+
+    # verify saved cursor
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}, "version": {"N": "6"}}
+    assert exp == act["Item"]
+
+
+def test_webhook_has_more(lambda_context, dynamodb):
+    """entries are paginated"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    # mock list_folder_continue
+    pages = [
+        {
+            "cursor": "UT-cursor1",
+            "entries": [{".tag": "folder", "path_display": "/target/channel1"}],
+            "has_more": True,
+        },
+        {
+            "cursor": "UT-cursor2",
+            "entries": [{".tag": "deleted", "path_display": "/target/channel2"}],
+            "has_more": False,
+        },
+    ]
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(page)) for page in pages],
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    req_list = [
+        req for req in httpretty.latest_requests() if "list_folder/continue" in req.url
+    ]
+    assert json.dumps({"cursor": "UT-cursor1"}) == req_list[-1].body.decode()
+
+    # verify saved cursor, saved once after the files are notified
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor2"}, "version": {"N": "1"}}
     assert exp == act["Item"]
 
 
@@ -156,11 +265,21 @@ def test_webhook_one_entry_has_shared_link(lambda_context, dynamodb):
         "https://api.dropboxapi.com/2/files/list_folder/continue",
         responses=[HTTPretty.Response(json.dumps(res_body))],
     )
-    # mock list_shared_link
+    # mock list_shared_links
     res_body = {
         "links": [
-            {"url": "https://shared.link.com"},
-        ]
+            {
+                ".tag": "file",
+                "url": "https://shared.link.com",
+                "path_lower": f"{os.environ['DROPBOX_TARGET_DIR']}/channel1/file",
+            },
+            {
+                ".tag": "file",
+                "url": "https://other.link.com",
+                "path_lower": "/other/channel1/file",
+            },
+        ],
+        "has_more": False,
     }
     httpretty.register_uri(
         httpretty.POST,
@@ -187,7 +306,7 @@ def test_webhook_one_entry_has_shared_link(lambda_context, dynamodb):
     # verify saved cursor
     item = {"id": {"S": "cursor"}}
     act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
-    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}}
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}, "version": {"N": "1"}}
     assert exp == act["Item"]
     # verify send_message
     req = httpretty.last_request()
@@ -210,6 +329,71 @@ def test_webhook_one_entry_has_shared_link(lambda_context, dynamodb):
     assert json.dumps(exp_body) == req.body.decode()
 
 
+def test_webhook_one_entry_shared_link_settings_match(lambda_context, dynamodb):
+    """shared link already has the settings for sharing team member"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {
+                ".tag": "file",
+                "path_display": f"{os.environ['DROPBOX_TARGET_DIR']}/channel1/file",
+            },
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    # mock list_shared_links
+    res_body = {
+        "links": [
+            {
+                ".tag": "file",
+                "url": "https://shared.link.com",
+                "path_lower": f"{os.environ['DROPBOX_TARGET_DIR']}/channel1/file",
+                "link_permissions": {
+                    "effective_audience": {".tag": "team"},
+                    "link_access_level": {".tag": "viewer"},
+                    "allow_download": True,
+                },
+            },
+        ],
+        "has_more": False,
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/sharing/list_shared_links",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    assert not any(
+        "modify_shared_link_settings" in req.url
+        for req in httpretty.latest_requests()
+    )
+    req = httpretty.last_request()
+    assert os.environ["SLACK_WEBHOOK_URL"] == req.url
+    value = json.loads(req.body)["attachments"][0]["fields"][0]["value"]
+    assert "<https://shared.link.com|/target/channel1/file>" == value
+
+
 def test_webhook_one_entry_has_no_shared_link(lambda_context, dynamodb):
     """one entry"""
     # prepare
@@ -232,8 +416,8 @@ def test_webhook_one_entry_has_no_shared_link(lambda_context, dynamodb):
         "https://api.dropboxapi.com/2/files/list_folder/continue",
         responses=[HTTPretty.Response(json.dumps(res_body))],
     )
-    # mock list_shared_link
-    res_body = {"links": []}
+    # mock list_shared_links
+    res_body = {"links": [], "has_more": False}
     httpretty.register_uri(
         httpretty.POST,
         "https://api.dropboxapi.com/2/sharing/list_shared_links",
@@ -261,7 +445,7 @@ def test_webhook_one_entry_has_no_shared_link(lambda_context, dynamodb):
     # verify saved cursor
     item = {"id": {"S": "cursor"}}
     act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
-    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}}
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}, "version": {"N": "1"}}
     assert exp == act["Item"]
     # verify send_message
     req = httpretty.last_request()
@@ -282,3 +466,1357 @@ def test_webhook_one_entry_has_no_shared_link(lambda_context, dynamodb):
         ],
     }
     assert json.dumps(exp_body) == req.body.decode()
+    # verify cached shared link
+    item = {"id": {"S": "link#/target/channel1/file"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "https://created.shared.link" == act["Item"]["url"]["S"]
+    # created for public, modified on the next change
+    assert not act["Item"]["settings_applied"]["BOOL"]
+
+
+def test_webhook_modify_shared_link_failed(lambda_context, dynamodb, monkeypatch):
+    """a link whose settings were not modified is not cached as applied"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [{".tag": "file", "path_display": f"{target_dir}/channel1/file"}],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    link = {
+        ".tag": "file",
+        "url": "https://public.link",
+        "link_permissions": {"effective_audience": {".tag": "public"}},
+    }
+    monkeypatch.setattr(
+        dropboxapi, "list_shared_link", lambda path: {"links": [link]}
+    )
+    monkeypatch.setattr(
+        dropboxapi,
+        "modify_shared_link",
+        lambda url: {"error_summary": "settings_error/"},
+    )
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    value = json.loads(httpretty.last_request().body)["attachments"][0]["fields"][0][
+        "value"
+    ]
+    assert f"<https://public.link|{target_dir}/channel1/file>" == value
+    item = {"id": {"S": f"link#{target_dir}/channel1/file"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert not act["Item"]["settings_applied"]["BOOL"]
+
+
+def test_webhook_recreated_file_shared_link(lambda_context, dynamodb, monkeypatch):
+    """the link of a deleted file is not used for the file re-created at the path"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {
+                ".tag": "file",
+                "id": "id:new",
+                "path_display": f"{target_dir}/channel1/export.csv",
+            }
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    # link of the deleted file
+    save_shared_links({"id:old": "https://revoked.link"}, {"id:old"})
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(
+        dropboxapi, "create_shared_link", lambda path: {"url": "https://new.link"}
+    )
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    value = json.loads(httpretty.last_request().body)["attachments"][0]["fields"][0][
+        "value"
+    ]
+    assert f"<https://new.link|{target_dir}/channel1/export.csv>" == value
+    item = {"id": {"S": "link#id:new"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "https://new.link" == act["Item"]["url"]["S"]
+
+
+def test_webhook_one_entry_cached_shared_link(lambda_context, dynamodb):
+    """shared link is cached"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {
+                ".tag": "file",
+                "path_display": f"{os.environ['DROPBOX_TARGET_DIR']}/channel1/File",
+            },
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    save_shared_links(
+        {"/target/channel1/file": "https://cached.shared.link"},
+        {"/target/channel1/file"},
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    assert not any("/sharing/" in req.url for req in httpretty.latest_requests())
+    req = httpretty.last_request()
+    assert os.environ["SLACK_WEBHOOK_URL"] == req.url
+    value = json.loads(req.body)["attachments"][0]["fields"][0]["value"]
+    assert "<https://cached.shared.link|/target/channel1/File>" == value
+
+
+def test_webhook_one_entry_shared_link_already_exists(lambda_context, dynamodb):
+    """shared link is created after listing shared links"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {
+                ".tag": "file",
+                "path_display": f"{os.environ['DROPBOX_TARGET_DIR']}/channel1/file",
+            },
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    # mock list_shared_links
+    res_body = {"links": [], "has_more": False}
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/sharing/list_shared_links",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    # mock create_shared_link
+    res_body = {
+        "error_summary": "shared_link_already_exists/metadata/..",
+        "error": {
+            ".tag": "shared_link_already_exists",
+            "shared_link_already_exists": {
+                ".tag": "metadata",
+                "metadata": {".tag": "file", "url": "https://existing.shared.link"},
+            },
+        },
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/sharing/create_shared_link_with_settings",
+        responses=[HTTPretty.Response(json.dumps(res_body), status=409)],
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    req = httpretty.last_request()
+    assert os.environ["SLACK_WEBHOOK_URL"] == req.url
+    value = json.loads(req.body)["attachments"][0]["fields"][0]["value"]
+    assert "<https://existing.shared.link|/target/channel1/file>" == value
+
+
+def test_webhook_multiple_entries_keep_order(lambda_context, dynamodb, monkeypatch):
+    """links are resolved concurrently, messages keep the order of entries"""
+    # prepare
+    monkeypatch.setenv("LINK_CONCURRENCY", "4")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    filenames = [f"file{i}" for i in range(10)]
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {".tag": "file", "path_display": f"{target_dir}/channel1/{name}"}
+            for name in filenames
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+
+    # mock list_shared_links
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/sharing/list_shared_links",
+        responses=[HTTPretty.Response(json.dumps({"links": [], "has_more": False}))],
+    )
+
+    # NOTE: httpretty is not thread safe, so sharing APIs are replaced directly.
+    def create_shared_link(path):
+        name = path.split("/")[-1]
+        # finish in reverse order
+        time.sleep((len(filenames) - int(name[4:])) * 0.005)
+        if name == "file3":
+            # failed entry is skipped
+            return {"error": "conflict"}
+        return {"url": f"https://{name}.link"}
+
+    monkeypatch.setattr(dropboxapi, "create_shared_link", create_shared_link)
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    req = httpretty.last_request()
+    assert os.environ["SLACK_WEBHOOK_URL"] == req.url
+    value = json.loads(req.body)["attachments"][0]["fields"][0]["value"]
+    exp = "\n".join(
+        f"<https://{name}.link|{target_dir}/channel1/{name}>"
+        for name in filenames
+        if name != "file3"
+    )
+    assert exp == value
+
+
+def test_webhook_coalesced(lambda_context, dynamodb):
+    """another invocation is processing changes"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    LeaseModel(LEASE_ID, owner="other", expires_at=time.time() + 60).save()
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    assert "coalesced" == response["body"]
+    assert [] == httpretty.latest_requests()
+    item = {"id": {"S": LEASE_ID}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert act["Item"]["pending"]["BOOL"]
+
+
+def test_webhook_async_mode(lambda_context, dynamodb, monkeypatch):
+    """only queue the job in async mode"""
+    # prepare
+    monkeypatch.setenv("WEBHOOK_MODE", "async")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    local_queue = jobqueue.get_local_queue()
+    list(local_queue.drain())
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    assert "accepted" == response["body"]
+    assert [] == httpretty.latest_requests()
+    assert [{"type": "folder_changed"}] == list(local_queue.drain())
+
+
+def test_webhook_async_mode_no_queue(lambda_context, dynamodb, monkeypatch):
+    """async mode without a queue processes the changes in the invocation"""
+    # prepare
+    monkeypatch.setenv("WEBHOOK_MODE", "async")
+    monkeypatch.delenv("JOB_QUEUE_URL")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    assert any(
+        "list_folder/continue" in req.url for req in httpretty.latest_requests()
+    )
+
+
+def test_worker_handler_local_queue(lambda_context, dynamodb):
+    """worker drains the local queue"""
+    # prepare
+    local_queue = jobqueue.get_local_queue()
+    list(local_queue.drain())
+    local_queue.put({"type": "folder_changed"})
+    local_queue.put({"type": "folder_changed"})
+
+    # execute
+    worker_handler({}, lambda_context)
+
+    # verify
+    assert 0 == len(local_queue)
+    req_list = [
+        req for req in httpretty.latest_requests() if "list_folder/continue" in req.url
+    ]
+    assert 1 == len({req.body for req in req_list})
+
+    # verify saved cursor
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}, "version": {"N": "1"}}
+    assert exp == act["Item"]
+
+
+def test_worker_handler_sqs_event(lambda_context, dynamodb):
+    """worker processes jobs of SQS event"""
+    # prepare
+    event = {
+        "Records": [
+            {"body": json.dumps({"type": "folder_changed"})},
+        ]
+    }
+
+    # execute
+    worker_handler(event, lambda_context)
+
+    # verify saved cursor
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}, "version": {"N": "1"}}
+    assert exp == act["Item"]
+
+
+def test_webhook_multiple_routes(lambda_context, dynamodb, monkeypatch):
+    """changes of each route are notified to its own webhook"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    save_routes(
+        [
+            RouteAttribute(
+                name="team1",
+                root="/team1",
+                slack_webhook_url="https://hooks.slack.com/services/team1",
+                channel_rules={"folder1": "channel1"},
+            ),
+            RouteAttribute(name="team2", root="/team2"),
+        ]
+    )
+
+    # NOTE: httpretty is not thread safe, so APIs are replaced directly.
+    def get_latest_cursor(path):
+        return {"cursor": "latest" + path}
+
+    def iter_list_folder_continue(cursor):
+        root = cursor.replace("latest", "")
+        entries = [{".tag": "file", "path_display": f"{root}/folder1/file"}]
+        yield {"cursor": "next" + root, "entries": entries}
+
+    sent = {}
+
+    def send_messages(store, webhook_url=None):
+        sent[webhook_url] = list(store.generate_messages_items())
+        return []
+
+    monkeypatch.setattr(dropboxapi, "get_latest_cursor", get_latest_cursor)
+    monkeypatch.setattr(
+        dropboxapi, "iter_list_folder_continue", iter_list_folder_continue
+    )
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(
+        dropboxapi, "create_shared_link", lambda path: {"url": "https://link"}
+    )
+    monkeypatch.setattr(slackapi, "send_messages", send_messages)
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    assert {"https://hooks.slack.com/services/team1", None} == set(sent)
+    assert "channel1" == sent["https://hooks.slack.com/services/team1"][0][0]
+    assert "folder1" == sent[None][0][0]
+
+    # verify saved cursors
+    for cursor_id, exp in [("cursor:team1", "next/team1"), ("cursor:team2", "next/team2")]:
+        item = {"id": {"S": cursor_id}}
+        act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+        assert exp == act["Item"]["cursor"]["S"]
+
+
+def test_webhook_duplicated_entries(lambda_context, dynamodb, monkeypatch):
+    """shared links are resolved once per distinct file"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {".tag": "file", "path_display": f"{target_dir}/channel1/file"},
+            {".tag": "file", "path_display": f"{target_dir}/channel1/~$file"},
+            {".tag": "file", "path_display": f"{target_dir}/channel1/temp"},
+            {".tag": "file", "path_display": f"{target_dir}/channel1/file"},
+            {".tag": "deleted", "path_display": f"{target_dir}/channel1/temp"},
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    called = []
+
+    def create_shared_link(path):
+        called.append(path)
+        return {"url": "https://file.link"}
+
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(dropboxapi, "create_shared_link", create_shared_link)
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    assert [f"{target_dir}/channel1/file"] == called
+    req = httpretty.last_request()
+    value = json.loads(req.body)["attachments"][0]["fields"][0]["value"]
+    assert f"<https://file.link|{target_dir}/channel1/file>" == value
+
+
+def test_webhook_root_file(lambda_context, dynamodb, monkeypatch):
+    """files right under the root are sent to the default channel"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [{".tag": "file", "path_display": f"{target_dir}/file"}],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(
+        dropboxapi, "create_shared_link", lambda path: {"url": "https://file.link"}
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    body = json.loads(httpretty.last_request().body)
+    assert "channel" not in body
+    value = body["attachments"][0]["fields"][0]["value"]
+    assert f"<https://file.link|{target_dir}/file>" == value
+
+
+def test_webhook_streaming_delivery(lambda_context, dynamodb, monkeypatch):
+    """full messages of a channel are sent before the other batches"""
+    # prepare
+    monkeypatch.setenv("CHECKPOINT_BATCH_SIZE", "2")
+    # two links per message
+    monkeypatch.setenv("SLACK_MAX_MESSAGE_CHARS", "100")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    entries = [
+        {".tag": "file", "path_display": f"{target_dir}/channel1/file{i}"}
+        for i in range(4)
+    ]
+    entries += [
+        {".tag": "file", "path_display": f"{target_dir}/channel2/file9"},
+        {".tag": "file", "path_display": f"{target_dir}/channel1/file4"},
+        {".tag": "deleted", "path_display": f"{target_dir}/channel1/file4"},
+        {".tag": "file", "path_display": f"{target_dir}/channel1/file5"},
+    ]
+    res_body = {"cursor": "UT-cursor", "entries": entries}
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    events = []
+
+    def create_shared_link(path):
+        events.append(("link", path.split("/")[-1]))
+        return {"url": "https://file.link"}
+
+    def send_message(webhook_url, channel, data):
+        field = data["attachments"][0]["fields"][0]
+        events.append(("send", channel, field["title"], field["value"]))
+        return slackapi.DeliveryResult(channel, 200, 0.0)
+
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(dropboxapi, "create_shared_link", create_shared_link)
+    put = slackapi.MessageSender.put
+
+    def put_message(self, channel, data):
+        events.append(("put", channel))
+        put(self, channel, data)
+
+    monkeypatch.setattr(slackapi, "_send_message", send_message)
+    monkeypatch.setattr(slackapi.MessageSender, "put", put_message)
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    sent = [event[1:] for event in events if event[0] == "send"]
+    link = "<https://file.link|{}/{}/{}>".format
+    assert [
+        (
+            "channel1",
+            "以下のファイルが更新されました。(1)",
+            "\n".join(link(target_dir, "channel1", f"file{i}") for i in (0, 1)),
+        ),
+        (
+            "channel1",
+            "以下のファイルが更新されました。(2)",
+            "\n".join(link(target_dir, "channel1", f"file{i}") for i in (2, 3)),
+        ),
+        (
+            "channel1",
+            "以下のファイルが更新されました。(3)",
+            link(target_dir, "channel1", "file5"),
+        ),
+        (
+            "channel2",
+            "以下のファイルが更新されました。",
+            link(target_dir, "channel2", "file9"),
+        ),
+    ] == sent
+    # the first message is queued before the links of the later batches
+    assert events.index(("put", "channel1")) < events.index(("link", "file4"))
+
+
+def test_webhook_digest_mode(lambda_context, dynamodb, monkeypatch):
+    """changes are sent at once after the quiet window"""
+    # prepare
+    monkeypatch.setenv("DIGEST_WINDOW_SECONDS", "0.1")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    local_queue = jobqueue.get_local_queue()
+    local_queue.clear()
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(
+        dropboxapi,
+        "create_shared_link",
+        lambda path: {"url": "https://{}.link".format(path.split("/")[-1])},
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    for name in ("file1", "file2"):
+        # mock list_folder_continue
+        res_body = {
+            "cursor": "UT-cursor",
+            "entries": [
+                {".tag": "file", "path_display": f"{target_dir}/channel1/{name}"}
+            ],
+        }
+        httpretty.register_uri(
+            httpretty.POST,
+            "https://api.dropboxapi.com/2/files/list_folder/continue",
+            responses=[HTTPretty.Response(json.dumps(res_body))],
+        )
+        lambda_handler(event, lambda_context)
+    worker_handler({}, lambda_context)
+    slack_requests_in_window = [
+        req
+        for req in httpretty.latest_requests()
+        if req.url == os.environ["SLACK_WEBHOOK_URL"]
+    ]
+    time.sleep(0.2)
+    worker_handler({}, lambda_context)
+
+    # verify
+    assert [] == slack_requests_in_window
+    assert 0 == len(local_queue)
+    req = httpretty.last_request()
+    assert os.environ["SLACK_WEBHOOK_URL"] == req.url
+    value = json.loads(req.body)["attachments"][0]["fields"][0]["value"]
+    exp = "\n".join(
+        f"<https://{name}.link|{target_dir}/channel1/{name}>"
+        for name in ("file1", "file2")
+    )
+    assert exp == value
+
+
+def test_webhook_digest_mode_flush_failed(lambda_context, dynamodb, monkeypatch):
+    """the flush is scheduled by the retry of a failed invocation"""
+    # prepare
+    monkeypatch.setenv("DIGEST_WINDOW_SECONDS", "0.1")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    local_queue = jobqueue.get_local_queue()
+    local_queue.clear()
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [{".tag": "file", "path_display": f"{target_dir}/channel1/file"}],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        # listed again by the retry
+        responses=[HTTPretty.Response(json.dumps(res_body))] * 2,
+    )
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(
+        dropboxapi, "create_shared_link", lambda path: {"url": "https://file.link"}
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+    put = jobqueue.LocalQueue.put
+
+    def put_failing(self, job, delay_seconds=0):
+        raise RuntimeError("failed")
+
+    # execute
+    monkeypatch.setattr(jobqueue.LocalQueue, "put", put_failing)
+    with pytest.raises(RuntimeError):
+        lambda_handler(event, lambda_context)
+    monkeypatch.setattr(jobqueue.LocalQueue, "put", put)
+    lambda_handler(event, lambda_context)
+    time.sleep(0.2)
+    worker_handler({}, lambda_context)
+
+    # verify
+    assert 0 == len(local_queue)
+    req = httpretty.last_request()
+    assert os.environ["SLACK_WEBHOOK_URL"] == req.url
+    value = json.loads(req.body)["attachments"][0]["fields"][0]["value"]
+    # sent once
+    assert f"<https://file.link|{target_dir}/channel1/file>" == value
+
+
+def test_webhook_digest_mode_no_queue(lambda_context, dynamodb, monkeypatch):
+    """digest mode without a queue sends the changes immediately"""
+    # prepare
+    monkeypatch.setenv("DIGEST_WINDOW_SECONDS", "60")
+    monkeypatch.delenv("JOB_QUEUE_URL")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [{".tag": "file", "path_display": f"{target_dir}/channel1/file"}],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(
+        dropboxapi, "create_shared_link", lambda path: {"url": "https://file.link"}
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    req = httpretty.last_request()
+    assert os.environ["SLACK_WEBHOOK_URL"] == req.url
+    value = json.loads(req.body)["attachments"][0]["fields"][0]["value"]
+    assert f"<https://file.link|{target_dir}/channel1/file>" == value
+
+
+def test_webhook_metrics(lambda_context, dynamodb, monkeypatch):
+    """metrics of the stages are emitted once per invocation"""
+    # prepare
+    # drop metrics recorded by other tests
+    monkeypatch.setattr(metrics.recorder, "sink", metrics.InMemorySink())
+    metrics.recorder.flush()
+    sink = metrics.InMemorySink()
+    metrics.recorder.sink = sink
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {".tag": "folder", "path_display": f"{target_dir}/channel1"},
+            {".tag": "file", "path_display": f"{target_dir}/channel1/file"},
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    # mock list_shared_links
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/sharing/list_shared_links",
+        responses=[HTTPretty.Response(json.dumps({"links": [], "has_more": False}))],
+    )
+    # mock create_shared_link
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/sharing/create_shared_link_with_settings",
+        responses=[HTTPretty.Response(json.dumps({"url": "https://file.link"}))],
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    lambda_handler(event, lambda_context)
+
+    # verify
+    assert 1 == sink.flushed
+    assert 2 == sink.get("entries_seen")
+    assert 1 == sink.get("entries_skipped")
+    assert 1 == sink.get("files_notified")
+    assert 1 == sink.get("messages_sent")
+    assert 1 == sink.get("api_calls_dropbox_get_latest_cursor")
+    assert 1 == sink.get("api_calls_dropbox_create_shared_link")
+    assert 1 == sink.get("api_calls_slack_webhook")
+    for stage in (
+        "cursor_load",
+        "listing",
+        "link_resolution",
+        "message_generation",
+        "slack_delivery",
+    ):
+        assert sink.get(f"stage_{stage}_ms") is not None
+
+
+def test_webhook_already_handled(lambda_context, dynamodb, monkeypatch):
+    """revisions already notified are skipped before any API call"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {
+                ".tag": "file",
+                "path_display": f"{target_dir}/channel1/{name}",
+                "rev": "rev1",
+            }
+            for name in ("file1", "file2")
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    called = []
+
+    def create_shared_link(path):
+        called.append(path)
+        return {"url": "https://file.link"}
+
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(dropboxapi, "create_shared_link", create_shared_link)
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+    save_handled([f"{target_dir}/channel1/file1@rev1".lower()])
+
+    # execute
+    lambda_handler(event, lambda_context)
+
+    # verify
+    assert [f"{target_dir}/channel1/file2"] == called
+    req = httpretty.last_request()
+    value = json.loads(req.body)["attachments"][0]["fields"][0]["value"]
+    assert f"<https://file.link|{target_dir}/channel1/file2>" == value
+    assert {
+        f"{target_dir}/channel1/file1@rev1".lower(),
+        f"{target_dir}/channel1/file2@rev1".lower(),
+    } == get_handled(
+        [
+            f"{target_dir}/channel1/file1@rev1".lower(),
+            f"{target_dir}/channel1/file2@rev1".lower(),
+        ]
+    )
+
+
+class DeadlineContext:
+    """LambdaContext whose deadline comes after the given checks"""
+
+    function_name = "dropbox2slack"
+    memory_limit_in_mb = 128
+    invoked_function_arn = (
+        "arn:aws:lambda:ap-northeast-1:123456789012:function:dropbox2slack"
+    )
+    aws_request_id = "deadline-request"
+
+    def __init__(self, checks):
+        self.checks = checks
+
+    def get_remaining_time_in_millis(self):
+        self.checks -= 1
+        return 60000 if self.checks >= 0 else 0
+
+
+def test_webhook_checkpoint_before_deadline(lambda_context, dynamodb, monkeypatch):
+    """stop before the deadline and continue from the checkpoint"""
+    # prepare
+    monkeypatch.setenv("CHECKPOINT_BATCH_SIZE", "2")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    local_queue = jobqueue.get_local_queue()
+    local_queue.clear()
+    filenames = [f"file{i}" for i in range(5)]
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {".tag": "file", "path_display": f"{target_dir}/channel1/{name}"}
+            for name in filenames
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        # the same page is listed again from the checkpoint
+        responses=[HTTPretty.Response(json.dumps(res_body))] * 2,
+    )
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(
+        dropboxapi,
+        "create_shared_link",
+        lambda path: {"url": "https://{}.link".format(path.split("/")[-1])},
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    def sent_value():
+        # NOTE: the last request is not always the message.
+        req = [
+            req
+            for req in httpretty.latest_requests()
+            if req.url == os.environ["SLACK_WEBHOOK_URL"]
+        ][-1]
+        return json.loads(req.body)["attachments"][0]["fields"][0]["value"]
+
+    # execute
+    # the deadline comes at the third batch,
+    # checked before each batch and each link
+    lambda_handler(event, DeadlineContext(checks=6))
+    first_value = sent_value()
+    item = {"id": {"S": "cursor"}}
+    checkpoint = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    worker_handler({}, lambda_context)
+
+    # verify
+    exp = "\n".join(
+        f"<https://{name}.link|{target_dir}/channel1/{name}>" for name in filenames[:4]
+    )
+    assert exp == first_value
+    assert "cursor-value" == checkpoint["Item"]["cursor"]["S"]
+    assert "4" == checkpoint["Item"]["offset"]["N"]
+
+    exp = f"<https://file4.link|{target_dir}/channel1/file4>"
+    assert exp == sent_value()
+    assert 0 == len(local_queue)
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "UT-cursor" == act["Item"]["cursor"]["S"]
+    assert "offset" not in act["Item"]
+
+
+def test_webhook_pending_at_deadline(lambda_context, dynamodb, monkeypatch):
+    """changes notified while processing are continued by a job"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    local_queue = jobqueue.get_local_queue()
+    local_queue.clear()
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [{".tag": "file", "path_display": f"{target_dir}/channel1/file"}],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+
+    def create_shared_link(path):
+        # notified by another invocation while processing
+        assert not acquire_lease("other")
+        return {"url": "https://file.link"}
+
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(dropboxapi, "create_shared_link", create_shared_link)
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    # the deadline comes after the first batch and its link
+    lambda_handler(event, DeadlineContext(checks=2))
+
+    # verify
+    assert ["folder_changed"] == [job["type"] for job in local_queue.drain()]
+    item = {"id": {"S": LEASE_ID}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "Item" not in act
+
+
+def test_webhook_checkpoint_no_queue(lambda_context, dynamodb, monkeypatch):
+    """the checkpoint is continued by the next notification without a queue"""
+    # prepare
+    monkeypatch.setenv("CHECKPOINT_BATCH_SIZE", "1")
+    monkeypatch.delenv("JOB_QUEUE_URL")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {".tag": "file", "path_display": f"{target_dir}/channel1/file{i}"}
+            for i in range(2)
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(
+        dropboxapi, "create_shared_link", lambda path: {"url": "https://file.link"}
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, DeadlineContext(checks=2))
+
+    # verify
+    assert 200 == response["statusCode"]
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "cursor-value" == act["Item"]["cursor"]["S"]
+    assert "1" == act["Item"]["offset"]["N"]
+
+
+def test_webhook_lease_lost(lambda_context, dynamodb, monkeypatch):
+    """processing stops when the lease was taken by another invocation"""
+    # prepare
+    monkeypatch.setenv("CHECKPOINT_BATCH_SIZE", "1")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {".tag": "file", "path_display": f"{target_dir}/channel1/file{i}"}
+            for i in range(2)
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    called = []
+
+    def create_shared_link(path):
+        called.append(path)
+        # the lease expired and was taken while processing
+        LeaseModel(LEASE_ID, owner="other", expires_at=time.time() + 60).save()
+        return {"url": "https://file.link"}
+
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(dropboxapi, "create_shared_link", create_shared_link)
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    response = lambda_handler(event, lambda_context)
+
+    # verify
+    assert 200 == response["statusCode"]
+    assert [f"{target_dir}/channel1/file0"] == called
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "Item" not in act
+    item = {"id": {"S": LEASE_ID}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "other" == act["Item"]["owner"]["S"]
+
+
+def test_webhook_shared_link_index(lambda_context, dynamodb, monkeypatch):
+    """all the links are listed at once only for many files"""
+    # prepare
+    monkeypatch.setenv("LINK_INDEX_THRESHOLD", "2")
+    monkeypatch.setenv("CHECKPOINT_BATCH_SIZE", "2")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {".tag": "file", "path_display": f"{target_dir}/channel1/file{i}"}
+            for i in range(3)
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    listed = []
+
+    def build_shared_link_index(root):
+        listed.append(root)
+        return {}
+
+    def list_shared_link(path):
+        listed.append(path)
+        return {"links": []}
+
+    monkeypatch.setattr(dropboxapi, "build_shared_link_index", build_shared_link_index)
+    monkeypatch.setattr(dropboxapi, "list_shared_link", list_shared_link)
+    monkeypatch.setattr(
+        dropboxapi, "create_shared_link", lambda path: {"url": "https://file.link"}
+    )
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    lambda_handler(event, lambda_context)
+
+    # verify
+    # the index for the first batch, a lookup for the last file
+    assert [target_dir, f"{target_dir}/channel1/file2".lower()] == listed
+
+
+def test_webhook_streamed_messages_handled(lambda_context, dynamodb, monkeypatch):
+    """files of a streamed message are recorded even if the run fails later"""
+    # prepare
+    monkeypatch.setenv("CHECKPOINT_BATCH_SIZE", "2")
+    # two links per message
+    monkeypatch.setenv("SLACK_MAX_MESSAGE_CHARS", "100")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    keys = [f"{target_dir}/channel1/file{i}@rev1".lower() for i in range(6)]
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {
+                ".tag": "file",
+                "path_display": f"{target_dir}/channel1/file{i}",
+                "rev": "rev1",
+            }
+            for i in range(6)
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(
+        dropboxapi, "create_shared_link", lambda path: {"url": "https://file.link"}
+    )
+    monkeypatch.setattr(
+        slackapi,
+        "_send_message",
+        lambda webhook_url, channel, data: slackapi.DeliveryResult(channel, 200, 0.0),
+    )
+    calls = []
+    get_handled_org = models.get_handled
+
+    def get_handled_failing(keys):
+        calls.append(keys)
+        if len(calls) == 3:
+            raise RuntimeError("failed")
+        return get_handled_org(keys)
+
+    monkeypatch.setattr(models, "get_handled", get_handled_failing)
+
+    # execute
+    with pytest.raises(RuntimeError):
+        lambda_handler(event, lambda_context)
+
+    # verify
+    assert set(keys[:2]) == get_handled_org(keys)
+
+
+
+def test_webhook_deadline_in_batch(lambda_context, dynamodb, monkeypatch):
+    """links are not resolved after the deadline, the batch is continued"""
+    # prepare
+    monkeypatch.setenv("CHECKPOINT_BATCH_SIZE", "2")
+    monkeypatch.setenv("LINK_CONCURRENCY", "1")
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    local_queue = jobqueue.get_local_queue()
+    local_queue.clear()
+    # mock list_folder_continue
+    res_body = {
+        "cursor": "UT-cursor",
+        "entries": [
+            {".tag": "file", "path_display": f"{target_dir}/channel1/file{i}"}
+            for i in range(2)
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))],
+    )
+    called = []
+
+    def create_shared_link(path):
+        called.append(path)
+        return {"url": "https://file.link"}
+
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(dropboxapi, "create_shared_link", create_shared_link)
+    # mock slackapi.send_message
+    httpretty.register_uri(
+        httpretty.POST,
+        os.environ["SLACK_WEBHOOK_URL"],
+        responses=[HTTPretty.Response("", status=200)],
+    )
+
+    # execute
+    # the deadline comes after the first link
+    lambda_handler(event, DeadlineContext(checks=2))
+
+    # verify
+    assert [f"{target_dir}/channel1/file0"] == called
+    assert not any(
+        req.url == os.environ["SLACK_WEBHOOK_URL"] for req in httpretty.latest_requests()
+    )
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "0" == act["Item"]["offset"]["N"]
+    assert ["folder_changed"] == [job["type"] for job in local_queue.drain()]
+    # the resolved link is cached for the continuation
+    item = {"id": {"S": f"link#{target_dir}/channel1/file0".lower()}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "https://file.link" == act["Item"]["url"]["S"]
+
+
+def test_webhook_failed_message_cursor_kept(lambda_context, dynamodb, monkeypatch):
+    """the cursor is kept if a message failed, the others are not sent again"""
+    # prepare
+    event = {
+        "path": "/",
+        "httpMethod": "POST",
+    }
+    target_dir = os.environ["DROPBOX_TARGET_DIR"]
+    res_body = {
+        "cursor": "UT-cursor-next",
+        "entries": [
+            {
+                ".tag": "file",
+                "path_display": f"{target_dir}/{channel}/file",
+                "rev": "rev1",
+            }
+            for channel in ["channel1", "channel2"]
+        ],
+    }
+    httpretty.register_uri(
+        httpretty.POST,
+        "https://api.dropboxapi.com/2/files/list_folder/continue",
+        responses=[HTTPretty.Response(json.dumps(res_body))] * 2,
+    )
+    monkeypatch.setattr(dropboxapi, "list_shared_link", lambda path: {"links": []})
+    monkeypatch.setattr(
+        dropboxapi, "create_shared_link", lambda path: {"url": "https://file.link"}
+    )
+    sent = []
+
+    def send_message(webhook_url, channel, data):
+        sent.append(channel)
+        status = 500 if channel == "channel2" else 200
+        return slackapi.DeliveryResult(channel, status, 0.0)
+
+    monkeypatch.setattr(slackapi, "_send_message", send_message)
+
+    # execute
+    lambda_handler(event, lambda_context)
+    lambda_handler(event, lambda_context)
+
+    # verify
+    assert ["channel1", "channel2", "channel2"] == sent
+    # the cursor the run started from
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "cursor-value" == act["Item"]["cursor"]["S"]
@@ -0,0 +1,145 @@
+import pytest
+
+from dropbox2slack.util.changes import (
+    DEFAULT_IGNORE_PATTERNS,
+    ChangeSet,
+    get_ignore_patterns,
+)
+
+
+def file(path):
+    return {".tag": "file", "path_display": path, "path_lower": path.lower()}
+
+
+def deleted(path):
+    return {".tag": "deleted", "path_display": path, "path_lower": path.lower()}
+
+
+def folder(path):
+    return {".tag": "folder", "path_display": path, "path_lower": path.lower()}
+
+
+def paths(entries):
+    return [entry["path_display"] for entry in entries]
+
+
+def test_get_ignore_patterns_default(monkeypatch):
+    # prepare
+    monkeypatch.delenv("IGNORE_PATTERNS", raising=False)
+
+    # execute
+    actual = get_ignore_patterns()
+
+    # verify
+    assert list(DEFAULT_IGNORE_PATTERNS) == actual
+
+
+def test_get_ignore_patterns_from_env(monkeypatch):
+    # prepare
+    monkeypatch.setenv("IGNORE_PATTERNS", "*.bak, *.log,")
+
+    # execute
+    actual = get_ignore_patterns()
+
+    # verify
+    assert ["*.bak", "*.log"] == actual
+
+
+@pytest.mark.parametrize(
+    "filepath, exp",
+    [
+        ("/target/channel1/~$foo.xlsx", True),
+        ("/target/channel1/.DS_Store", True),
+        ("/target/channel1/.ds_store", True),
+        ("/target/channel1/.~lock.foo.odt#", True),
+        ("/target/channel1/foo.tmp", True),
+        ("/target/channel1/foo.xlsx", False),
+        ("/target/~$channel/foo.xlsx", False),
+    ],
+)
+def test_is_ignored(filepath, exp):
+    # execute
+    actual = ChangeSet().is_ignored(filepath)
+
+    # verify
+    assert exp == actual
+
+
+def test_add_collapse_same_path():
+    # prepare
+    changes = ChangeSet()
+    entries = [
+        file("/target/c/a"),
+        file("/target/c/b"),
+        file("/target/c/A"),
+    ]
+
+    # execute
+    actual = changes.add(entries)
+
+    # verify
+    assert ["/target/c/A", "/target/c/b"] == paths(actual)
+
+
+def test_add_drop_folders_and_ignored():
+    # prepare
+    changes = ChangeSet()
+    entries = [
+        folder("/target/c"),
+        file("/target/c/~$a.xlsx"),
+        file("/target/c/a.xlsx"),
+    ]
+
+    # execute
+    actual = changes.add(entries)
+
+    # verify
+    assert ["/target/c/a.xlsx"] == paths(actual)
+
+
+def test_add_drop_deleted_later():
+    # prepare
+    changes = ChangeSet()
+    entries = [
+        file("/target/c/a"),
+        file("/target/c/b"),
+        deleted("/target/c/a"),
+        file("/target/d/x"),
+        deleted("/target/d"),
+    ]
+
+    # execute
+    actual = changes.add(entries)
+
+    # verify
+    assert ["/target/c/b"] == paths(actual)
+
+
+def test_add_readded_after_delete():
+    # prepare
+    changes = ChangeSet()
+    entries = [
+        file("/target/c/a"),
+        deleted("/target/c"),
+        file("/target/c/a"),
+    ]
+
+    # execute
+    actual = changes.add(entries)
+
+    # verify
+    assert ["/target/c/a"] == paths(actual)
+
+
+def test_add_multiple_pages():
+    # prepare
+    changes = ChangeSet()
+    changes.add([file("/target/c/a"), file("/target/c/b")])
+
+    # execute
+    actual = changes.add([file("/target/c/a"), deleted("/target/c/b")])
+
+    # verify
+    assert [] == actual
+    assert changes.is_alive("/target/c/a")
+    assert not changes.is_alive("/target/c/b")
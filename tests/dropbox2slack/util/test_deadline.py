@@ -0,0 +1,56 @@
+from dropbox2slack.util.deadline import DEFAULT_MARGIN_MS, Deadline
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_deadline_not_expired():
+    # prepare
+    deadline = Deadline(FakeContext(DEFAULT_MARGIN_MS + 1))
+
+    # execute
+    actual = deadline.expired()
+
+    # verify
+    assert not actual
+
+
+def test_deadline_expired():
+    # prepare
+    deadline = Deadline(FakeContext(DEFAULT_MARGIN_MS - 1))
+
+    # execute
+    actual = deadline.expired()
+
+    # verify
+    assert actual
+
+
+def test_deadline_margin_from_env(monkeypatch):
+    # prepare
+    monkeypatch.setenv("CHECKPOINT_MARGIN_MS", "500")
+    deadline = Deadline(FakeContext(1000))
+
+    # execute
+    actual = deadline.expired()
+
+    # verify
+    assert 500 == deadline.margin_ms
+    assert not actual
+
+
+def test_deadline_without_context():
+    # prepare
+    deadline = Deadline()
+
+    # execute
+    actual = deadline.expired()
+
+    # verify
+    assert deadline.remaining_ms() is None
+    assert not actual
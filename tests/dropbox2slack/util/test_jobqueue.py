@@ -0,0 +1,103 @@
+import json
+
+import boto3
+import pytest
+from moto import mock_sqs
+
+from dropbox2slack.util.jobqueue import (
+    LocalQueue,
+    QueueNotConfiguredError,
+    SqsQueue,
+    get_local_queue,
+    get_queue,
+    is_queue_configured,
+    parse_sqs_event,
+)
+
+
+@pytest.fixture
+def sqs():
+    with mock_sqs():
+        client = boto3.client("sqs")
+        res = client.create_queue(QueueName="dummy-queue")
+
+        yield client, res["QueueUrl"]
+
+
+def test_local_queue():
+    # prepare
+    queue = LocalQueue()
+    queue.put({"type": "job1"})
+    queue.put({"type": "job2"})
+
+    # execute
+    actual = list(queue.drain())
+
+    # verify
+    assert [{"type": "job1"}, {"type": "job2"}] == actual
+    assert 0 == len(queue)
+
+
+def test_local_queue_delayed():
+    # prepare
+    queue = LocalQueue()
+    queue.put({"type": "job1"}, delay_seconds=60)
+    queue.put({"type": "job2"})
+
+    # execute
+    actual = list(queue.drain())
+
+    # verify
+    assert [{"type": "job2"}] == actual
+    assert 1 == len(queue)
+
+
+def test_get_queue_local():
+    # execute
+    actual = get_queue()
+
+    # verify
+    assert get_local_queue() is actual
+
+
+def test_get_queue_not_configured(monkeypatch):
+    # prepare
+    monkeypatch.delenv("JOB_QUEUE_URL")
+
+    # execute
+    with pytest.raises(QueueNotConfiguredError):
+        get_queue()
+
+    # verify
+    assert not is_queue_configured()
+
+
+def test_get_queue_sqs(sqs, monkeypatch):
+    # prepare
+    client, queue_url = sqs
+    monkeypatch.setenv("JOB_QUEUE_URL", queue_url)
+
+    # execute
+    queue = get_queue()
+    queue.put({"type": "folder_changed"})
+
+    # verify
+    assert isinstance(queue, SqsQueue)
+    res = client.receive_message(QueueUrl=queue_url)
+    assert {"type": "folder_changed"} == json.loads(res["Messages"][0]["Body"])
+
+
+def test_parse_sqs_event():
+    # prepare
+    event = {
+        "Records": [
+            {"body": json.dumps({"type": "job1"})},
+            {"body": json.dumps({"type": "job2"})},
+        ]
+    }
+
+    # execute
+    actual = parse_sqs_event(event)
+
+    # verify
+    assert [{"type": "job1"}, {"type": "job2"}] == actual
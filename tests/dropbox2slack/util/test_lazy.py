@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+from dropbox2slack.util.lazy import lazy_import, load
+
+
+@pytest.fixture
+def module_dir(tmp_path, monkeypatch):
+    code = 'import os\nos.environ["UT_LAZY_LOADED"] = "1"\nVALUE = 1\n'
+    (tmp_path / "ut_lazy_module.py").write_text(code)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delenv("UT_LAZY_LOADED", raising=False)
+    yield tmp_path
+    sys.modules.pop("ut_lazy_module", None)
+
+
+def test_lazy_import(module_dir):
+    # execute
+    module = lazy_import("ut_lazy_module")
+
+    # verify
+    assert "UT_LAZY_LOADED" not in os.environ
+    assert 1 == module.VALUE
+    assert "1" == os.environ["UT_LAZY_LOADED"]
+
+
+def test_lazy_import_loaded_module():
+    # execute
+    actual = lazy_import("os")
+
+    # verify
+    assert sys.modules["os"] is actual
+
+
+def test_lazy_import_not_found():
+    # execute / verify
+    with pytest.raises(ModuleNotFoundError):
+        lazy_import("ut_no_such_module")
+
+
+def test_load(module_dir):
+    # prepare
+    module = lazy_import("ut_lazy_module")
+
+    # execute
+    load(module)
+
+    # verify
+    assert "1" == os.environ["UT_LAZY_LOADED"]
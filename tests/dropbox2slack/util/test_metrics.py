@@ -0,0 +1,71 @@
+import json
+
+from dropbox2slack.util.metrics import (
+    InMemorySink,
+    MetricsRecorder,
+    PowertoolsSink,
+)
+
+
+def test_count():
+    # prepare
+    sink = InMemorySink()
+    recorder = MetricsRecorder(sink)
+
+    # execute
+    recorder.count("entries_seen", 3)
+    recorder.count("entries_seen", 2)
+    recorder.count("api_calls")
+    actual = recorder.flush()
+
+    # verify
+    assert {"entries_seen": 5, "api_calls": 1} == actual
+    assert [("entries_seen", "Count", 5), ("api_calls", "Count", 1)] == sink.metrics
+    assert 1 == sink.flushed
+
+
+def test_timer():
+    # prepare
+    sink = InMemorySink()
+    recorder = MetricsRecorder(sink)
+
+    # execute
+    with recorder.timer("listing"):
+        pass
+    recorder.add_time("listing", 0.5)
+    recorder.flush()
+
+    # verify
+    name, unit, value = sink.metrics[0]
+    assert "stage_listing_ms" == name
+    assert "Milliseconds" == unit
+    assert 500 <= value < 600
+
+
+def test_flush_resets():
+    # prepare
+    sink = InMemorySink()
+    recorder = MetricsRecorder(sink)
+    recorder.count("api_calls")
+    recorder.flush()
+
+    # execute
+    actual = recorder.flush()
+
+    # verify
+    assert {} == actual
+    assert 1 == sink.flushed
+
+
+def test_powertools_sink(capsys):
+    # prepare
+    recorder = MetricsRecorder(PowertoolsSink(namespace="UT"))
+    recorder.count("api_calls", 2)
+
+    # execute
+    recorder.flush()
+
+    # verify
+    emf = json.loads(capsys.readouterr().out)
+    assert "UT" == emf["_aws"]["CloudWatchMetrics"][0]["Namespace"]
+    assert [2.0] == emf["api_calls"]
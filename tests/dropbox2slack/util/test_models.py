@@ -1,17 +1,56 @@
-import uuid
+import json
 import os
+import time
+import uuid
+from datetime import timedelta
 
 import boto3
 import pytest
 from moto import mock_dynamodb
 
-from dropbox2slack.util.models import CursorModel, get_cursor, save_cursor
+import dropbox2slack.util.models as models
+from dropbox2slack.util.models import (
+    CURSOR_ID,
+    CursorConflictError,
+    CursorModel,
+    LeaseModel,
+    RouteAttribute,
+    SharedLinkModel,
+    acquire_lease,
+    append_digest,
+    clear_cursor_cache,
+    clear_routes_cache,
+    get_access_token,
+    get_checkpoint,
+    get_digest,
+    get_handled,
+    get_lease_id,
+    get_ledger_key,
+    get_routes,
+    get_shared_links,
+    get_slack_message,
+    migrate_cursor,
+    release_lease,
+    renew_lease,
+    save_access_token,
+    save_cursor,
+    save_handled,
+    save_routes,
+    save_shared_links,
+    save_slack_message,
+    set_digest_flush,
+    take_digest,
+)
+
+LEASE_ID = get_lease_id(CURSOR_ID)
 
 
 @pytest.fixture(autouse=True)
 def dynamodb():
     # NOTE: Since it is static, it will be loaded at the start of the test.
     CursorModel.Meta.table_name = os.environ["TABLE_NAME"]
+    clear_cursor_cache()
+    clear_routes_cache()
 
     with mock_dynamodb():
         client = boto3.client("dynamodb")
@@ -29,7 +68,7 @@ def dynamodb():
         yield client
 
 
-def test_get_cursor(dynamodb):
+def test_get_checkpoint_cursor(dynamodb):
     # prepare
     exp = str(uuid.uuid4())
     item = {
@@ -39,18 +78,18 @@ def test_get_cursor(dynamodb):
     dynamodb.put_item(TableName=os.environ["TABLE_NAME"], Item=item)
 
     # execute
-    actual = get_cursor()
+    actual = get_checkpoint()[0]
 
     # verify
     assert exp == actual
 
 
-def test_get_cursor_no_record():
+def test_get_checkpoint_no_record():
     # prepare
 
     # execute / verify
     with pytest.raises(CursorModel.DoesNotExist):
-        get_cursor()
+        get_checkpoint()[0]
 
 
 def test_save_cursor(dynamodb):
@@ -64,7 +103,7 @@ def test_save_cursor(dynamodb):
     item = {"id": {"S": "cursor"}}
     act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
 
-    exp = {"id": {"S": "cursor"}, "cursor": {"S": cursor}}
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": cursor}, "version": {"N": "1"}}
     assert exp == act["Item"]
 
 
@@ -84,5 +123,528 @@ def test_update_cursor(dynamodb):
     item = {"id": {"S": "cursor"}}
     act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
 
-    exp = {"id": {"S": "cursor"}, "cursor": {"S": cursor}}
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": cursor}, "version": {"N": "1"}}
+    assert exp == act["Item"]
+
+
+def test_get_checkpoint_cached(dynamodb):
+    # prepare
+    item = {
+        "id": {"S": "cursor"},
+        "cursor": {"S": "UT-cursor"},
+        "version": {"N": "1"},
+    }
+    dynamodb.put_item(TableName=os.environ["TABLE_NAME"], Item=item)
+    get_checkpoint()[0]
+    dynamodb.delete_item(TableName=os.environ["TABLE_NAME"], Key={"id": {"S": "cursor"}})
+
+    # execute
+    actual = get_checkpoint()[0]
+
+    # verify
+    assert "UT-cursor" == actual
+
+
+def test_save_cursor_twice(dynamodb):
+    # prepare
+    save_cursor("UT-cursor1")
+
+    # execute
+    save_cursor("UT-cursor2")
+
+    # verify
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor2"}, "version": {"N": "2"}}
+    assert exp == act["Item"]
+    assert "UT-cursor2" == get_checkpoint()[0]
+
+
+def test_save_cursor_conflict(dynamodb):
+    # prepare
+    save_cursor("UT-cursor1")
+    # saved by another invocation
+    item = {
+        "id": {"S": "cursor"},
+        "cursor": {"S": "UT-cursor-other"},
+        "version": {"N": "2"},
+    }
+    dynamodb.put_item(TableName=os.environ["TABLE_NAME"], Item=item)
+
+    # execute / verify
+    with pytest.raises(CursorConflictError):
+        save_cursor("UT-cursor2")
+
+    # the cache is cleared
+    assert "UT-cursor-other" == get_checkpoint()[0]
+
+
+def test_migrate_cursor(dynamodb):
+    # prepare
+    item = {
+        "id": {"S": "cursor"},
+        "cursor": {"S": "UT-cursor"},
+    }
+    dynamodb.put_item(TableName=os.environ["TABLE_NAME"], Item=item)
+
+    # execute
+    migrate_cursor()
+
+    # verify
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    exp = {"id": {"S": "cursor"}, "cursor": {"S": "UT-cursor"}, "version": {"N": "1"}}
     assert exp == act["Item"]
+
+
+def test_migrate_cursor_no_record(dynamodb):
+    # execute
+    migrate_cursor()
+
+    # verify
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "Item" not in act
+
+
+def get_lease_item(dynamodb):
+    item = {"id": {"S": LEASE_ID}}
+    return dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item).get("Item")
+
+
+def test_acquire_lease(dynamodb):
+    # execute
+    actual = acquire_lease("owner1")
+
+    # verify
+    assert actual
+    item = get_lease_item(dynamodb)
+    assert "owner1" == item["owner"]["S"]
+    assert not item["pending"]["BOOL"]
+
+
+def test_acquire_lease_held_by_other(dynamodb):
+    # prepare
+    acquire_lease("owner1")
+
+    # execute
+    actual = acquire_lease("owner2")
+
+    # verify
+    assert not actual
+    item = get_lease_item(dynamodb)
+    assert "owner1" == item["owner"]["S"]
+    assert item["pending"]["BOOL"]
+
+
+def test_acquire_lease_per_cursor(dynamodb):
+    # prepare
+    acquire_lease("owner1")
+
+    # execute
+    actual = acquire_lease("owner2", "cursor:other")
+
+    # verify
+    assert actual
+    item = get_lease_item(dynamodb)
+    assert not item["pending"]["BOOL"]
+
+
+def test_acquire_lease_expired(dynamodb):
+    # prepare
+    LeaseModel(LEASE_ID, owner="owner1", expires_at=time.time() - 1).save()
+
+    # execute
+    actual = acquire_lease("owner2")
+
+    # verify
+    assert actual
+    assert "owner2" == get_lease_item(dynamodb)["owner"]["S"]
+
+
+def test_release_lease(dynamodb):
+    # prepare
+    acquire_lease("owner1")
+
+    # execute
+    actual = release_lease("owner1")
+
+    # verify
+    assert actual
+    assert get_lease_item(dynamodb) is None
+
+
+def test_release_lease_pending(dynamodb):
+    # prepare
+    acquire_lease("owner1")
+    acquire_lease("owner2")
+
+    # execute
+    actual = release_lease("owner1")
+
+    # verify
+    assert not actual
+    item = get_lease_item(dynamodb)
+    assert "owner1" == item["owner"]["S"]
+    assert not item["pending"]["BOOL"]
+
+    # released after processing again
+    assert release_lease("owner1")
+
+
+def test_release_lease_force(dynamodb):
+    # prepare
+    acquire_lease("owner1")
+    acquire_lease("owner2")
+
+    # execute
+    actual = release_lease("owner1", force=True)
+
+    # verify
+    assert actual
+    assert get_lease_item(dynamodb) is None
+
+
+def test_release_lease_taken_by_other(dynamodb):
+    # prepare
+    LeaseModel(LEASE_ID, owner="owner2", expires_at=time.time() + 60).save()
+
+    # execute
+    actual = release_lease("owner1")
+
+    # verify
+    assert actual
+    assert "owner2" == get_lease_item(dynamodb)["owner"]["S"]
+
+
+def test_renew_lease(dynamodb):
+    # prepare
+    LeaseModel(LEASE_ID, owner="owner1", expires_at=time.time() - 1).save()
+
+    # execute
+    actual = renew_lease("owner1")
+
+    # verify
+    assert actual
+    assert time.time() < float(get_lease_item(dynamodb)["expires_at"]["N"])
+
+
+def test_renew_lease_taken_by_other(dynamodb):
+    # prepare
+    LeaseModel(LEASE_ID, owner="owner2", expires_at=time.time() + 60).save()
+
+    # execute
+    actual = renew_lease("owner1")
+
+    # verify
+    assert not actual
+    assert "owner2" == get_lease_item(dynamodb)["owner"]["S"]
+
+
+def test_save_shared_links(dynamodb):
+    # prepare
+    links = {
+        "/path/to/file1": "https://file1.link",
+        "/path/to/file2": "https://file2.link",
+    }
+
+    # execute
+    save_shared_links(links, {"/path/to/file1"})
+
+    # verify
+    item = {"id": {"S": "link#/path/to/file1"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)["Item"]
+    assert "https://file1.link" == act["url"]["S"]
+    assert act["settings_applied"]["BOOL"]
+    assert time.time() < int(act["ttl"]["N"])
+    item = {"id": {"S": "link#/path/to/file2"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)["Item"]
+    assert not act["settings_applied"]["BOOL"]
+    assert {} == get_shared_links(["/path/to/file2"])
+
+
+def test_get_shared_links(dynamodb):
+    # prepare
+    save_shared_links({"/path/to/file1": "https://file1.link"}, {"/path/to/file1"})
+    SharedLinkModel(
+        "link#/path/to/expired",
+        url="https://expired.link",
+        settings_applied=True,
+        ttl=timedelta(seconds=-1),
+    ).save()
+    SharedLinkModel(
+        "link#/path/to/not_applied",
+        url="https://not_applied.link",
+        settings_applied=False,
+        ttl=timedelta(seconds=60),
+    ).save()
+
+    # execute
+    actual = get_shared_links(
+        [
+            "/path/to/file1",
+            "/path/to/expired",
+            "/path/to/not_applied",
+            "/path/to/no_record",
+        ]
+    )
+
+    # verify
+    assert {"/path/to/file1": "https://file1.link"} == actual
+
+
+def test_get_shared_links_empty():
+    # execute
+    actual = get_shared_links([])
+
+    # verify
+    assert {} == actual
+
+
+def test_save_cursor_of_route(dynamodb):
+    # prepare
+    route = RouteAttribute(name="team1", root="/team1")
+
+    # execute
+    save_cursor("cursor-value", route.cursor_id)
+
+    # verify
+    item = {"id": {"S": "cursor:team1"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "cursor-value" == act["Item"]["cursor"]["S"]
+    assert "cursor-value" == get_checkpoint("cursor:team1")[0]
+
+
+def test_get_routes_default():
+    # execute
+    actual = get_routes()
+
+    # verify
+    assert 1 == len(actual)
+    assert "default" == actual[0].name
+    assert os.environ["DROPBOX_TARGET_DIR"] == actual[0].root
+    assert "cursor" == actual[0].cursor_id
+    assert actual[0].slack_webhook_url is None
+
+
+def test_save_routes():
+    # prepare
+    routes = [
+        RouteAttribute(
+            name="team1",
+            root="/team1",
+            slack_webhook_url="https://hooks.slack.com/services/team1",
+            channel_rules={"folder1": "channel1"},
+        ),
+        RouteAttribute(name="team2", root="/team2"),
+    ]
+
+    # execute
+    save_routes(routes)
+    actual = get_routes()
+
+    # verify
+    assert ["team1", "team2"] == [route.name for route in actual]
+    assert {"folder1": "channel1"} == actual[0].channel_rules
+    assert "cursor:team2" == actual[1].cursor_id
+
+
+def test_get_routes_cached(dynamodb):
+    # prepare
+    get_routes()
+    save_routes_item = {
+        "id": {"S": "routes"},
+        "routes": {"L": []},
+    }
+    dynamodb.put_item(TableName=os.environ["TABLE_NAME"], Item=save_routes_item)
+
+    # execute
+    actual = get_routes()
+
+    # verify
+    assert "default" == actual[0].name
+
+
+def test_append_digest(dynamodb, monkeypatch):
+    # prepare
+    monkeypatch.setattr(models, "DIGEST_CHUNK_SIZE", 2)
+    files = [("channel1", f"/target/channel1/file{i}", "https://link") for i in range(3)]
+
+    # execute
+    first = append_digest(files)
+    set_digest_flush(time.time() + 60)
+    second = append_digest(files[:1])
+
+    # verify
+    assert first
+    assert not second
+    digest = get_digest()
+    assert 3 == digest.chunks
+    assert 3 == digest.pending
+    item = {"id": {"S": "digest#cursor#2"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert [list(files[0])] == json.loads(act["Item"]["files"]["S"])
+
+
+@pytest.mark.parametrize("flush_at", [None, -models.DIGEST_FLUSH_GRACE_SECONDS - 1])
+def test_append_digest_flush_lost(dynamodb, flush_at):
+    # prepare
+    files = [("channel1", "/target/channel1/file", "https://link")]
+    append_digest(files)
+    if flush_at is not None:
+        set_digest_flush(time.time() + flush_at)
+
+    # execute
+    actual = append_digest(files)
+
+    # verify
+    assert actual
+
+
+def test_get_digest_no_record():
+    # execute
+    actual = get_digest()
+
+    # verify
+    assert actual is None
+
+
+def test_take_digest(dynamodb):
+    # prepare
+    files = [("channel1", f"/target/channel1/file{i}", "https://link") for i in range(3)]
+    append_digest(files[:2])
+    append_digest(files[2:])
+    digest = get_digest()
+
+    # execute
+    actual = take_digest(digest)
+
+    # verify
+    assert files == actual
+    assert 0 == get_digest().pending
+    item = {"id": {"S": "digest#cursor#0"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "Item" not in act
+    # appended again after taken
+    assert append_digest(files[:1])
+    assert [files[0]] == take_digest(get_digest())
+
+
+def test_take_digest_taken_by_other():
+    # prepare
+    append_digest([("channel1", "/target/channel1/file", "https://link")])
+    digest = get_digest()
+    take_digest(get_digest())
+
+    # execute
+    actual = take_digest(digest)
+
+    # verify
+    assert actual is None
+
+
+def test_save_handled(dynamodb):
+    # execute
+    save_handled(["/target/channel1/file@rev1"])
+
+    # verify
+    item = {"id": {"S": "ledger#/target/channel1/file@rev1"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "ttl" in act["Item"]
+
+
+def test_get_handled(dynamodb):
+    # prepare
+    save_handled(
+        [
+            get_ledger_key("/target/channel1/file1", "rev1"),
+            get_ledger_key("/target/channel1/file2", "rev1"),
+        ]
+    )
+    # expired
+    item = {
+        "id": {"S": "ledger#/target/channel1/file3@rev1"},
+        "ttl": {"N": str(int(time.time()) - 1)},
+    }
+    dynamodb.put_item(TableName=os.environ["TABLE_NAME"], Item=item)
+
+    # execute
+    actual = get_handled(
+        [
+            "/target/channel1/file1@rev1",
+            "/target/channel1/file2@rev2",
+            "/target/channel1/file3@rev1",
+        ]
+    )
+
+    # verify
+    assert {"/target/channel1/file1@rev1"} == actual
+
+
+def test_get_handled_empty():
+    # execute
+    actual = get_handled([])
+
+    # verify
+    assert set() == actual
+
+
+def test_save_cursor_checkpoint(dynamodb):
+    # prepare
+    save_cursor("cursor-value", offset=3)
+    clear_cursor_cache()
+
+    # execute
+    actual = get_checkpoint()
+    save_cursor("next-cursor")
+
+    # verify
+    assert ("cursor-value", 3) == actual
+    item = {"id": {"S": "cursor"}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert "offset" not in act["Item"]
+    assert ("next-cursor", 0) == get_checkpoint()
+
+
+def test_save_access_token(dynamodb):
+    # prepare
+    expires_at = time.time() + 14400
+
+    # execute
+    save_access_token("token1", expires_at)
+
+    # verify
+    assert ("token1", expires_at) == get_access_token()
+    item = {"id": {"S": models.ACCESS_TOKEN_ID}}
+    act = dynamodb.get_item(TableName=os.environ["TABLE_NAME"], Key=item)
+    assert str(int(expires_at)) == act["Item"]["ttl"]["N"]
+
+
+def test_get_access_token_not_saved():
+    # execute
+    actual = get_access_token()
+
+    # verify
+    assert actual is None
+
+
+def test_save_slack_message(dynamodb):
+    # prepare
+    assert save_slack_message("channel1", 10, "C0001", "1.0", ["a"], 3600)
+    message = get_slack_message("channel1", 10)
+    other = get_slack_message("channel1", 10)
+
+    # execute
+    saved = save_slack_message(
+        "channel1", 10, "C0001", "1.0", ["a", "b"], 3600, message=message
+    )
+    # updated by another invocation
+    conflicted = save_slack_message(
+        "channel1", 10, "C0001", "1.0", ["a", "c"], 3600, message=other
+    )
+
+    # verify
+    assert saved
+    assert not conflicted
+    assert ["a", "b"] == get_slack_message("channel1", 10).lines
+    assert get_slack_message("channel1", 11) is None
@@ -0,0 +1,74 @@
+import pytest
+
+from dropbox2slack.util.router import ChannelRouter, get_router
+
+
+@pytest.mark.parametrize(
+    "filepath, exp",
+    [
+        ("/target/channel1/file", "channel1"),
+        ("/target/channel1/sub/file", "channel1"),
+        ("/Target/Channel1/file", "Channel1"),
+        ("/target/file", ""),
+        ("/other/channel1/file", None),
+        ("/target2/channel1/file", None),
+    ],
+)
+def test_resolve_default(filepath, exp):
+    # prepare
+    router = ChannelRouter("/target")
+
+    # execute
+    actual = router.resolve(filepath)
+
+    # verify
+    assert exp == actual
+
+
+@pytest.mark.parametrize(
+    "filepath, exp",
+    [
+        # alias
+        ("/target/old-name/file", "new-name"),
+        ("/target/OLD-NAME/file", "new-name"),
+        # nested prefix, the deepest rule is used
+        ("/target/projects/file", "projects"),
+        ("/target/projects/a/file", "project-a"),
+        ("/target/projects/a/docs/file", "project-a-docs"),
+        ("/target/projects/b/file", "projects"),
+        # glob
+        ("/target/clients/acme/reports/file", "client-reports"),
+        ("/target/clients/acme/file", "clients"),
+        ("/target/team-sales/file", "teams"),
+        # exact names are preferred to patterns
+        ("/target/team-dev/file", "dev"),
+    ],
+)
+def test_resolve_rules(filepath, exp):
+    # prepare
+    rules = {
+        "old-name": "new-name",
+        "projects/a": "project-a",
+        "projects/a/docs": "project-a-docs",
+        "clients/*/reports": "client-reports",
+        "team-*": "teams",
+        "team-dev": "dev",
+    }
+    router = ChannelRouter("/target/", rules)
+
+    # execute
+    actual = router.resolve(filepath)
+
+    # verify
+    assert exp == actual
+
+
+def test_get_router_is_reused():
+    # execute
+    router1 = get_router("/target", {"a": "b"})
+    router2 = get_router("/target", {"a": "b"})
+    router3 = get_router("/target", {"a": "c"})
+
+    # verify
+    assert router1 is router2
+    assert router1 is not router3